@@ -0,0 +1,180 @@
+"""Agregados de la distribucion del ingreso sobre una grilla fija.
+
+``Agregados`` guarda sumas (conteos para la densidad, histograma de pesos
+e ingreso, momentos y conteos de pobreza) de un conjunto de personas. Como
+son sumas, se pueden restar y sumar: el efecto de un choque que solo toca
+a algunos hogares se obtiene como::
+
+    base - agregar(personas afectadas, ingreso sin choque)
+         + agregar(personas afectadas, ingreso con choque)
+
+sin recorrer el resto de la encuesta. ``GrillaAgregados.resultados``
+convierte unos agregados en las mismas salidas de ``Modelo.evaluar``.
+"""
+import numpy as np
+
+from kde import (CORTE, REFINAMIENTO, bandwidth_factor, fine_grid,
+                 linear_binning, smooth)
+from lorenz import lorenz_from_histogram
+from quantiles import summary_from_histogram
+
+
+class Agregados:
+    """Sumas sobre un conjunto de personas (ver ``GrillaAgregados``)."""
+
+    CAMPOS = ('conteos', 'pesos', 'ingresos', 'momentos', 'pobreza')
+
+    def __init__(self, conteos, pesos, ingresos, momentos, pobreza):
+        self.conteos = conteos    # binning lineal para la densidad
+        self.pesos = pesos        # histograma de pesos
+        self.ingresos = ingresos  # histograma de peso * ingreso
+        # [sum w, sum w (y - c), sum w (y - c)**2, sum w**2]
+        self.momentos = momentos
+        # sumas de pobreza.IndicadoresPobreza.sumas
+        self.pobreza = pobreza
+
+    def _combinar(self, otro, signo):
+        return Agregados(*[getattr(self, c) + signo * getattr(otro, c)
+                           for c in self.CAMPOS])
+
+    def __add__(self, otro):
+        return self._combinar(otro, 1)
+
+    def __sub__(self, otro):
+        return self._combinar(otro, -1)
+
+
+class GrillaAgregados:
+    """Grilla fija de ingreso sobre la que se calculan los agregados.
+
+    La grilla se define a partir de ``xs`` y de un ancho de banda de
+    referencia ``h``, con un paso dos veces mas fino que el de
+    ``kde.binned_kde``: la densidad mantiene la cota de error de kde.py
+    mientras el ancho de banda del escenario no caiga por debajo de h / 2 y
+    el paso no quede limitado por ``kde.MAX_CELDAS`` (h muy pequeno frente
+    al paso de ``xs``; los agregados no guardan los datos para sumar el
+    kernel directamente).
+    """
+
+    def __init__(self, xs, h, centro=0.0, bw_method='scott'):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.bw_method = bw_method
+        self.centro = centro
+        (self.inicio, self.delta, self.celdas, self.r,
+         self.pad) = fine_grid(self.xs, h, refinamiento=2 * REFINAMIENTO,
+                               margen=2 * CORTE)
+        self.edges = self.inicio + self.delta * np.arange(self.celdas)
+
+    def agregar(self, ingreso, pesos, pobreza):
+        """Agregados de un conjunto de personas.
+
+        ``pobreza`` son las sumas de ``IndicadoresPobreza.sumas`` para las
+        mismas personas.
+        """
+        ingreso = np.asarray(ingreso, dtype=np.float64)
+        finito = np.isfinite(ingreso)
+        y = ingreso[finito]
+        w = np.asarray(pesos, dtype=np.float64)[finito]
+
+        conteos = linear_binning(y, w, self.inicio, self.delta, self.celdas)
+        intervalo = np.clip(np.searchsorted(self.edges, y, side='right') - 1,
+                            0, self.celdas - 2)
+        hist_pesos = np.bincount(intervalo, weights=w,
+                                 minlength=self.celdas - 1)
+        hist_ingresos = np.bincount(intervalo, weights=w * y,
+                                    minlength=self.celdas - 1)
+        d = y - self.centro
+        momentos = np.array([w.sum(), (w * d).sum(), (w * d * d).sum(),
+                             (w * w).sum()])
+
+        return Agregados(conteos, hist_pesos, hist_ingresos, momentos,
+                         pobreza)
+
+    def histogramas_por_nivel(self, base, perdida, niveles, pesos, lineas,
+                              peso_pobreza, max_elementos=2 ** 23):
+        """Histogramas y pobreza para varios niveles de choque a la vez.
+
+        El ingreso de cada persona es afin en el choque:
+        ``base - nivel / 100 * perdida``. Se evalua la matriz personas x
+        niveles por bloques de niveles (a lo sumo ``max_elementos``
+        elementos por bloque). Devuelve ``(pesos, ingresos, pobreza)`` con
+        una fila por nivel; ``pobreza`` tiene columnas [peso de pobres,
+        peso total].
+        """
+        niveles = np.asarray(niveles, dtype=np.float64)
+        n_intervalos = self.celdas - 1
+        hist_pesos = np.zeros((len(niveles), n_intervalos))
+        hist_ingresos = np.zeros((len(niveles), n_intervalos))
+        pobreza = np.zeros((len(niveles), 2))
+        # como en agregar(), el ingreso no finito no entra a los histogramas
+        finito = np.isfinite(base)
+        base = np.where(finito, base, 0)
+        pesos = np.where(finito, np.asarray(pesos, dtype=np.float64), 0)
+        peso_pobreza = np.asarray(peso_pobreza, dtype=np.float64)
+        lineas = np.asarray(lineas)
+        pobreza[:, 1] = peso_pobreza.sum()
+
+        bloque = max(1, max_elementos // max(1, len(base)))
+        for inicio in range(0, len(niveles), bloque):
+            nivel = niveles[inicio:inicio + bloque, None]
+            ingreso = base[None, :] - nivel / 100 * perdida[None, :]
+            fila = np.arange(len(nivel))[:, None] * n_intervalos
+            intervalo = np.clip(
+                np.searchsorted(self.edges, ingreso, side='right') - 1,
+                0, n_intervalos - 1) + fila
+            w = np.broadcast_to(pesos, ingreso.shape)
+            forma = (len(nivel), n_intervalos)
+            hist_pesos[inicio:inicio + bloque] = np.bincount(
+                intervalo.ravel(), weights=w.ravel(),
+                minlength=forma[0] * forma[1]).reshape(forma)
+            hist_ingresos[inicio:inicio + bloque] = np.bincount(
+                intervalo.ravel(), weights=(w * ingreso).ravel(),
+                minlength=forma[0] * forma[1]).reshape(forma)
+            pobreza[inicio:inicio + bloque, 0] = (
+                (ingreso < lineas[None, :]) * peso_pobreza).sum(axis=1)
+        return hist_pesos, hist_ingresos, pobreza
+
+    def curvas(self, agregados, hist_pesos, hist_ingresos, pobreza):
+        """Pobreza, mediana y Gini por nivel, sobre unos agregados de base.
+
+        ``agregados`` son los de las personas que no cambian con el choque;
+        los histogramas de ``histogramas_por_nivel`` se le suman fila por
+        fila. ``pobreza`` ([pobres, total] por nivel) ya incluye a todos.
+        """
+        pesos = agregados.pesos[None, :] + hist_pesos
+        ingresos = agregados.ingresos[None, :] + hist_ingresos
+        acumulado = np.cumsum(pesos, axis=1)
+        mediana = np.array([
+            np.interp(0.5 * a[-1], np.concatenate([[0], a]), self.edges)
+            for a in acumulado])
+        gini = np.array([lorenz_from_histogram(p, i)[1]
+                         for p, i in zip(pesos, ingresos)])
+        pobres, total = np.asarray(pobreza).T
+        return {'pobreza': 100 * pobres / total,
+                'mediana': mediana,
+                'gini': gini}
+
+    def bandwidth(self, agregados):
+        s0, s1, s2, sw2 = agregados.momentos
+        varianza = (s2 / s0 - (s1 / s0) ** 2) / (1 - sw2 / s0 ** 2)
+        return np.sqrt(varianza) * bandwidth_factor(s0 ** 2 / sw2,
+                                                    self.bw_method)
+
+    def densidad(self, agregados):
+        h = self.bandwidth(agregados)
+        densidad = smooth(agregados.conteos, self.delta, h)
+        densidad = densidad[self.pad:self.celdas - self.pad:self.r]
+        return np.maximum(densidad / agregados.momentos[0], 0)
+
+    def resultados(self, agregados):
+        """Salidas de ``Modelo.evaluar`` que dependen de la distribucion."""
+        resumen = summary_from_histogram(agregados.pesos, agregados.ingresos,
+                                         self.edges)
+        lorenz, gini = lorenz_from_histogram(agregados.pesos,
+                                             agregados.ingresos)
+        return {'densidad': self.densidad(agregados),
+                'mediana': resumen['mediana'],
+                'resumen': resumen,
+                'lorenz': lorenz,
+                'gini': gini,
+                'aproximado': True}
@@ -1,115 +1,228 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 import flask
-from dash.dependencies import Input, Output, State
-from scipy.stats import gaussian_kde
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from functions import *
-import quantecon as qe
+from conjuntos import Conjuntos
+from bootstrap import REPLICAS, intervalos
+from descomposicion import NOMBRES_ZONAS
+from modelo import normalizar_escenario
+from cache import ScenarioCache, clave_escenario
+from figures import *
+from jobs import ScenarioJobs, JobsSaturados, PENDIENTE, LISTO
+from metricas import (PUBLICAR, Registro, registro, memoria_rss,
+                      identificador_proceso, proceso_vivo)
 import time
 from dash.exceptions import PreventUpdate
-import random
-import datetime
+import logging
+import uuid
+from os import getpid
 
-# Tutorial: https://dash.plotly.com/layout
-
-################################
-# 0. colors
-################################
+logging.basicConfig(level=logging.INFO)
+# Dash(__name__) agrega su propio handler al logger de este modulo ('app'):
+# con ese nombre cada linea se imprimiria dos veces
+logger = logging.getLogger('escenarios')
 
-grey = '#f7f4eb'
-teal = '#3C7A89'
-purple = '#37123C'
-rose = '#945D5E'
-naranja = '#edb183'
-naranja_fill = '#ffdcc2'
-black = '#001514'
+# Tutorial: https://dash.plotly.com/layout
 
 ################################
 # 1. Data and initial Graphs
 ################################
 
-df = pd.read_csv('GEIH_mini.csv')
-ingreso_original = df.ING_pc_bl_def_arriendo
-df.rename(columns={'seccion_2d': 'sector'}, inplace=True)
-print(df.shape)
-
-# KDE
+# conjuntos de datos disponibles (ver conjuntos.py). Cada uno se carga al
+# primer uso, con su motor del choque y su linea base; el predeterminado se
+# carga antes del fork de gunicorn
+conjuntos = Conjuntos()
 start = time.time()
-kernel_original = gaussian_kde(ingreso_original,
-                               weights=df.fac_exp_ind_12m)
-# generate equally spaced X values
-xs = np.linspace(0, max(df.ING_pc_bl_def_arriendo), 1000)
-dist_original = kernel_original(xs)
-print('Kernel calculated in {} minutes'.format((time.time()-start)/60))
-
-fig_hist = go.Figure(
-    layout=go.Layout(
-        title=go.layout.Title(text=u"Distribución del ingreso, pobreza y "
-                                   u"vulnerabilidad"),
-        xaxis=go.layout.XAxis(title=u"Ingreso Per Cápita",
-                              range=[0, 1000000]),
-        yaxis=go.layout.YAxis(visible=False),
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        font_color='grey'
-    )
-)
-
-# Original distribution
-fig_hist.add_trace(go.Scatter(x=xs, y=dist_original,
-                         mode='lines',
-                         name=u'Distribución Original',
-                         line=dict(color=black)))
-
-# summary statistics
-median_original = weighted_median(df,
-                                  'ING_pc_bl_def_arriendo',
-                                  'fac_exp_ind_12m')
-
-# Lorenz curve and GINI (https://python.quantecon.org/wealth_dynamics.html)
-# TODO: weighted version of these calculations
-
-# start = time.time()
-# gini_original = qe.gini_coefficient(df.ING_pc_bl_def_arriendo.to_numpy())
-# print('Gini calculated in {} minutes'.format((time.time()-start)/60))
-
-f_vals, l_vals = qe.lorenz_curve(df.ING_pc_bl_def_arriendo.to_numpy())
-
-fig_lorenz = go.Figure(
-    layout=go.Layout(
-        title=go.layout.Title(text=u"Curva de Lorenz"),
-        xaxis=go.layout.XAxis(title="Porcentaje acumulado de personas"),
-        yaxis=go.layout.YAxis(title="Porcentaje acumulado del ingreso"),
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        font_color='grey',
-        showlegend=True
-    )
-)
-
-# sample to plot
-ids = list(range(0,len(f_vals)))
-sample_ids = random.sample(ids,10000)
-
-fig_lorenz.add_trace(go.Scatter(x=[0,1], y=[0,1],
-                         mode='lines',
-                         name=u'Igualdad total',
-                         line=dict(color='grey', dash="dashdot"),
-                                fill=None))
-
-fig_lorenz.add_trace(go.Scatter(x=f_vals[sample_ids],
-                                y=l_vals[sample_ids],
-                         mode='lines',
-                         name=u'Distribución Original',
-                         line_color=black, fill=None))
-
-
-# Pobreza 
-pobreza_original = calculo_pobreza(df, 'ING_pc_bl_def_arriendo')
+conjuntos.modelo()
+registro.fijar('modelo_seconds', time.time() - start,
+               ayuda='Tiempo de carga del conjunto predeterminado al '
+                     'iniciar.')
+
+# resultados de escenarios compartidos entre workers
+cache = ScenarioCache()
+
+# calculo de escenarios en un pool de procesos (ver jobs.py)
+jobs = ScenarioJobs(conjuntos, cache)
+
+# Modelo.descripcion de cada conjunto en este worker. Los conjuntos que no
+# se cargaron antes del fork se cargan en un proceso del pool: cargar datos
+# en el worker web bloquearia todas sus conexiones (ver update_dataset)
+descripciones = {}
+# distingue las cargas de este arranque en el cache compartido
+ARRANQUE = uuid.uuid4().hex
+
+
+def clave_conjunto(conjunto):
+    return clave_escenario((conjunto,), 'conjunto-' + ARRANQUE)
+
+
+def descripcion_conjunto(conjunto):
+    """``Modelo.descripcion`` del conjunto, o None si aun no se carga."""
+    descripcion = descripciones.get(conjunto)
+    if descripcion is None:
+        modelo = conjuntos.cargado(conjunto)
+        if modelo is not None:
+            descripcion = modelo.descripcion()
+        else:
+            descripcion = cache.get(clave_conjunto(conjunto), contar=False)
+        if descripcion is not None:
+            descripciones[conjunto] = descripcion
+    return descripcion
+
+
+SECTORES = {1: 'Actividades Agropecuarias',
+            2: 'Pesca',
+            3: 'Minería',
+            4: 'Manufactura',
+            5: 'Energía',
+            6: 'Construcción',
+            7: 'Comercio y talleres automotores',
+            8: 'Hotelería y restaurantes',
+            9: 'Transporte y comunicaciones',
+            10: 'Finanzas',
+            11: 'Inmobiliaria',
+            12: 'Sector Público',
+            13: 'Educación',
+            14: 'Salud y servicios sociales',
+            15: 'Servicios comunitarios y personales',
+            16: 'Servicios a Hogares',
+            17: 'Otras Organizaciones'}
+
+EMPRESAS = {1: 'Pequeña',
+            2: 'Mediana',
+            3: 'Grande',
+            4: 'Gigante'}
+
+# valores de 'informales'
+FORMALIDADES = {0: 'Formal',
+                1: 'Informal'}
+
+
+def opciones(nombres):
+    return [{'label': nombre, 'value': valor}
+            for valor, nombre in nombres.items()]
+
+
+def opciones_tabla(nombres):
+    # 'todos': la fila aplica a cualquier valor (ver choques.py)
+    return [{'label': u'Todos', 'value': 'todos'}] + opciones(nombres)
+
+
+def texto_resumen(resumen):
+    deciles = ', '.join('{:,.0f}'.format(d) for d in resumen['deciles'])
+    return [html.P(u'Deciles: {}'.format(deciles)),
+            html.P(u'P90/P10: {:.2f} | Palma: {:.2f} | '
+                   u'Participación del 1% más rico: {:.2f}%'.format(
+                       resumen['p90_p10'], resumen['palma'],
+                       resumen['top1'] * 100))]
+
+
+NOMBRES_POBREZA = [('pobreza', u'Pobreza'),
+                   ('vulnerabilidad', u'Vulnerabilidad'),
+                   ('brecha', u'Brecha (FGT1)'),
+                   ('severidad', u'Severidad (FGT2)')]
+
+
+def tabla_pobreza(detalle):
+    # indicadores (%) totales y por cat_dom (ver pobreza.py)
+    filas = [('Total', detalle)] + [
+        ('cat_dom {}'.format(dominio), valores)
+        for dominio, valores in sorted(detalle['por_dominio'].items())]
+    return html.Table(
+        [html.Tr([html.Th('')] + [html.Th(nombre)
+                                  for _, nombre in NOMBRES_POBREZA])] +
+        [html.Tr([html.Td(etiqueta)] +
+                 [html.Td('{:.2f}%'.format(valores[clave]))
+                  for clave, _ in NOMBRES_POBREZA])
+         for etiqueta, valores in filas])
+
+
+DIMENSIONES = [('sector', u'Sector'),
+               ('tipo_empresa', u'Tamaño de la empresa'),
+               ('zona', u'Zona'),
+               ('cat_dom', u'cat_dom')]
+
+NOMBRES_GRUPOS = {'sector': SECTORES,
+                  'tipo_empresa': EMPRESAS,
+                  'zona': NOMBRES_ZONAS}
+
+
+def _numero(formato, valor):
+    return '-' if not np.isfinite(valor) else formato.format(valor)
+
+
+def tabla_descomposicion(descomposicion, dimension):
+    # indicadores por grupo sin y con el choque (ver descomposicion.py)
+    original = descomposicion['original'][dimension]
+    choque = descomposicion['choque'][dimension]
+    nombres = NOMBRES_GRUPOS.get(dimension, {})
+    encabezados = [u'Grupo', u'Población', u'Pobreza original',
+                   u'Pobreza choque', u'Aporte a la pobreza (pp)',
+                   u'Mediana original', u'Mediana choque',
+                   u'Cambio mediana']
+    filas = []
+    for i, codigo in enumerate(choque['codigos']):
+        etiqueta = (u'Sin dato' if codigo < 0 else
+                    nombres.get(codigo, '{} {}'.format(dimension, codigo)))
+        cambio = choque['mediana'][i] / original['mediana'][i] - 1 \
+            if original['mediana'][i] > 0 else np.nan
+        filas.append([
+            etiqueta,
+            _numero('{:.1f}%', choque['poblacion'][i]),
+            _numero('{:.2f}%', original['pobreza'][i]),
+            _numero('{:.2f}%', choque['pobreza'][i]),
+            _numero('{:+.2f}', choque['aporte_pobreza'][i] -
+                    original['aporte_pobreza'][i]),
+            _numero('{:,.0f}', original['mediana'][i]),
+            _numero('{:,.0f}', choque['mediana'][i]),
+            _numero('{:+.1%}', cambio)])
+    tabla = html.Table(
+        [html.Tr([html.Th(nombre) for nombre in encabezados])] +
+        [html.Tr([html.Td(valor) for valor in fila]) for fila in filas])
+    # el Theil total es la suma de las contribuciones entre y dentro
+    theil = [html.P(u'Theil {}: {:.4f} (entre grupos {:.4f}, dentro de los '
+                    u'grupos {:.4f})'.format(
+                        clave, descomposicion[clave]['theil'],
+                        grupos['entre'].sum(), grupos['dentro'].sum()))
+             for clave, grupos in [('original', original),
+                                   ('choque', choque)]]
+    return [tabla] + theil
+
+
+def salidas_originales(descripcion):
+    """Figuras base y estadisticas de la distribucion original.
+
+    ``descripcion`` es la de ``Modelo.descripcion``. Los trazos originales
+    y las lineas de referencia se envian al navegador una sola vez por
+    conjunto de datos (ver ``update_dataset``).
+    """
+    dist_original = descripcion['dist_original']
+    base_figuras = figuras_base(
+        trazo_original(descripcion['xs'], dist_original),
+        trazo_original(descripcion['lorenz_grilla'],
+                       descripcion['lorenz_original']),
+        {valor: generate_reference_lines([valor], dist_original)
+         for valor in ['Minimum Wage', 'Poverty Line',
+                       'Vulnerability Line']})
+    return (base_figuras,
+            'Mediana distribución original: {:,.0f} COP'.format(
+                descripcion['resumen_original']['mediana']),
+            texto_resumen(descripcion['resumen_original']),
+            u'Coeficiente de Gini original: {:.4f}'.format(
+                descripcion['gini_original']),
+            u'Índice de pobreza original: {:.2f}%'.format(
+                descripcion['pobreza_detalle_original']['pobreza']),
+            tabla_pobreza(descripcion['pobreza_detalle_original']))
+
+
+(base_figuras, texto_mediana_original, resumen_original, texto_gini_original,
+ texto_pobreza_original, detalle_pobreza_original) = salidas_originales(
+    descripcion_conjunto(conjuntos.predeterminado))
 
 ################################
 # 2. App Layout
@@ -120,6 +233,75 @@ app = dash.Dash(__name__, server=server)
 
 
 app.config['suppress_callback_exceptions'] = True
+
+
+# ----------------------------
+# Metricas (ver metricas.py)
+# ----------------------------
+
+# las solicitudes no se perfilan: en un worker de gevent varias comparten
+# el hilo y un cProfile por solicitud mezclaria sus frames. Los calculos se
+# perfilan en el pool (ver jobs.py)
+@server.before_request
+def iniciar_solicitud():
+    flask.g.inicio = time.perf_counter()
+
+
+@server.after_request
+def terminar_solicitud(respuesta):
+    ruta = flask.request.url_rule.rule if flask.request.url_rule else 'otra'
+    if hasattr(flask.g, 'inicio'):
+        registro.observar('solicitud_seconds',
+                          time.perf_counter() - flask.g.inicio,
+                          ayuda='Duracion de las solicitudes HTTP, '
+                                'incluida la serializacion.',
+                          ruta=ruta, estado=respuesta.status_code)
+    publicar_metricas()
+    return respuesta
+
+
+publicado = {'momento': 0}
+
+
+def publicar_metricas(forzar=False):
+    """Publica en el cache el estado del registro de este worker."""
+    if not forzar and time.time() - publicado['momento'] < PUBLICAR:
+        return
+    publicado['momento'] = time.time()
+    registro.fijar('conjuntos_cargados', len(conjuntos.cargados()),
+                   ayuda='Conjuntos de datos en memoria en este worker.')
+    registro.fijar('conjuntos_bytes', conjuntos.memoria(),
+                   ayuda='Memoria aproximada de los conjuntos cargados.')
+    registro.fijar('conjuntos_desalojos', conjuntos.desalojos,
+                   ayuda='Conjuntos descartados por el presupuesto de '
+                         'memoria.')
+    registro.fijar('trabajos_pendientes', jobs.pendientes(),
+                   ayuda='Escenarios en cola en este worker.')
+    registro.fijar('rss_bytes', memoria_rss(),
+                   ayuda='Memoria residente del worker.')
+    cache.publicar_metricas(identificador_proceso(), getpid(),
+                            registro.estado())
+
+
+@server.route('/metrics')
+def metrics():
+    # cualquier worker puede atender la solicitud: se combinan las series
+    # publicadas por todos (ver metricas.py)
+    publicar_metricas(forzar=True)
+    estados = cache.leer_metricas(
+        proceso_vivo, lambda estados: Registro.combinar(
+            [(0, estado) for estado in estados]).estado())
+    total = Registro.combinar(
+        estados, vivos={pid for pid, _ in estados if pid})
+    estadisticas = cache.stats()
+    total.fijar('cache_hits', estadisticas['hits_total'],
+                ayuda='Aciertos del cache (todos los workers).')
+    total.fijar('cache_misses', estadisticas['misses_total'],
+                ayuda='Fallos del cache (todos los workers).')
+    total.fijar('cache_entradas', estadisticas['entries'])
+    return flask.Response(total.texto(),
+                          mimetype='text/plain; version=0.0.4')
+
 app.layout = html.Div(children=[
 
     html.Header(
@@ -141,6 +323,19 @@ app.layout = html.Div(children=[
     html.Div(
         className='three columns',
         children=[
+            # ----------------------------
+            # 0. Conjunto de datos
+            # ----------------------------
+            html.H5('Datos', style={'color': teal}),
+            dcc.Dropdown(
+                id='conjunto',
+                options=[{'label': nombre, 'value': nombre}
+                         for nombre in conjuntos.nombres],
+                value=conjuntos.predeterminado,
+                clearable=False,
+                style={"margin-bottom": "3em"}
+            ),
+            dcc.Interval(id='sondeo-conjunto', interval=500, disabled=True),
             # ----------------------------
             # 1. Vulnerabilidad Sectorial
             # ----------------------------
@@ -149,26 +344,7 @@ app.layout = html.Div(children=[
                     u'choque', style={'color': 'grey'}),
             dcc.Dropdown(
                 id='sectores',
-                options=[
-                    {'label': 'Actividades Agropecuarias', 'value': 1},
-                    {'label': 'Pesca', 'value': 2},
-                    {'label': 'Minería', 'value': 3},
-                    {'label': 'Manufactura', 'value': 4},
-                    {'label': 'Energía', 'value': 5},
-                    {'label': 'Construcción', 'value': 6},
-                    {'label': 'Comercio y talleres automotores', 'value': 7},
-                    {'label': 'Hotelería y restaurantes', 'value': 8},
-                    {'label': 'Transporte y comunicaciones', 'value': 9},
-                    {'label': 'Finanzas', 'value': 10},
-                    {'label': 'Inmobiliaria', 'value': 11},
-                    {'label': 'Sector Público', 'value': 12},
-                    {'label': 'Educación', 'value': 13},
-                    {'label': 'Salud y servicios sociales', 'value': 14},
-                    {'label': 'Servicios comunitarios y personales', 'value':
-                        15},
-                    {'label': 'Servicios a Hogares', 'value': 16},
-                    {'label': 'Otras Organizaciones', 'value': 17}
-                ],
+                options=opciones(SECTORES),
                 multi=True,
                 value=None,
                 style={"margin-bottom": "3em"}
@@ -182,12 +358,8 @@ app.layout = html.Div(children=[
                 children=[
                     dcc.Dropdown(
                         id='empresa',
-                        options=[
-                            {'label': 'Pequeña', 'value': 1},
-                            {'label': 'Mediana', 'value': 2},
-                            {'label': 'Grande', 'value': 3},
-                            {'label': 'Gigante', 'value': 4}
-                        ], style={"margin-bottom": "1.5em"}),
+                        options=opciones(EMPRESAS),
+                        style={"margin-bottom": "1.5em"}),
                     html.P(u'Relación laboral', style={'color': 'grey'}),
                     dcc.Checklist(
                         id='formalidad',
@@ -213,13 +385,58 @@ app.layout = html.Div(children=[
                     value=0,
                 )
             ], style={'marginBottom': '3em'}),
+            html.P(u'Choques por grupo: aplican a todas las personas de '
+                   u'cada grupo, aunque no estén en la selección de arriba, '
+                   u'y reemplazan la magnitud general (si varias filas '
+                   u'aplican, cuenta la última)', style={'color': 'grey'}),
+            dash_table.DataTable(
+                id='tabla-choques',
+                columns=[
+                    {'id': 'sector', 'name': 'Sector',
+                     'presentation': 'dropdown'},
+                    {'id': 'empresa', 'name': u'Tamaño',
+                     'presentation': 'dropdown'},
+                    {'id': 'formalidad', 'name': 'Formalidad',
+                     'presentation': 'dropdown'},
+                    {'id': 'choque', 'name': u'Choque (%)',
+                     'type': 'numeric'}],
+                data=[],
+                editable=True,
+                row_deletable=True,
+                dropdown={'sector': {'options': opciones_tabla(SECTORES)},
+                          'empresa': {'options': opciones_tabla(EMPRESAS)},
+                          'formalidad': {
+                              'options': opciones_tabla(FORMALIDADES)}},
+                style_cell={'textAlign': 'left', 'minWidth': '5em'}),
+            html.Button(id='agregar-choque', n_clicks=0,
+                        children='Agregar fila',
+                        style={'margin-top': '0.5em',
+                               'margin-bottom': '3em'}),
 
             # ----------------------------
             # 4. Actualizar resultados
             # ----------------------------
             html.Button(id='apply-button', n_clicks=0, children='Aplicar',
                         style={'background-color': rose,
-                               'color': 'white'})
+                               'color': 'white'}),
+            html.Div(id='estado-calculo', style={'color': 'grey'}),
+            dcc.Checklist(
+                id='intervalos',
+                options=[{'label': u'Intervalos de confianza (bootstrap '
+                                   u'de hogares)', 'value': 'bootstrap'}],
+                style={'margin-top': '1em'}),
+
+            # el calculo se hace en segundo plano: se guarda el trabajo
+            # enviado y se consulta su estado periodicamente
+            dcc.Store(id='sesion', storage_type='session'),
+            dcc.Store(id='trabajo'),
+            dcc.Interval(id='sondeo', interval=500, disabled=True),
+            dcc.Store(id='choque'),
+            dcc.Store(id='previa-mostrada'),
+            dcc.Store(id='trabajo-intervalos'),
+            dcc.Interval(id='sondeo-intervalos', interval=500,
+                         disabled=True),
+            dcc.Store(id='base-figuras', data=base_figuras)
         ]),
 
     # -------------------------
@@ -254,19 +471,79 @@ app.layout = html.Div(children=[
                                                style={'background-color': 'white',
                                                       'margin-top': '2.5em'}),
                                  dcc.Graph(id='histogram'),
-                                 html.P('Mediana distribución original: {:,.0f} COP'.format(median_original)),
-                                 html.Div(id='mediana-choque')
+                                 html.P(id='mediana-original',
+                                        children=texto_mediana_original),
+                                 html.Div(id='resumen-original',
+                                          children=resumen_original),
+                                 html.Div(id='mediana-choque'),
+                                 html.Div(id='intervalos-mediana'),
+                                 html.Div(id='resumen-choque')
                              ]),
                      dcc.Tab(label='Desigualdad',
                              children=[
-                                 dcc.Graph(id='lorenz')
+                                 dcc.Graph(id='lorenz'),
+                                 html.P(id='gini-original',
+                                        children=texto_gini_original),
+                                 html.Div(id='gini-choque')
                              ]),
                      dcc.Tab(label='Pobreza',
                              children=[
                                  html.H4('Pobreza'),
-                                 html.P(
-                                     u'Índice de pobreza original: {:.2f}%'.format(pobreza_original)),
-                                 html.Div(id='pobreza-choque')
+                                 html.P(id='pobreza-original',
+                                        children=texto_pobreza_original),
+                                 html.Div(id='pobreza-detalle-original',
+                                          children=detalle_pobreza_original),
+                                 html.Div(id='pobreza-choque'),
+                                 html.Div(id='intervalos-pobreza'),
+                                 html.Div(id='pobreza-detalle-choque')
+                             ]),
+                     dcc.Tab(label='Sensibilidad',
+                             children=[
+                                 html.P(u'Pobreza, mediana y Gini para todas '
+                                        u'las magnitudes del choque, con los '
+                                        u'sectores y características del '
+                                        u'empleo seleccionados.',
+                                        style={'margin-top': '2.5em'}),
+                                 html.Button(id='barrido-button', n_clicks=0,
+                                             children='Calcular',
+                                             style={'background-color': rose,
+                                                    'color': 'white'}),
+                                 html.Div(id='estado-barrido',
+                                          style={'color': 'grey'}),
+                                 dcc.Store(id='trabajo-barrido'),
+                                 dcc.Interval(id='sondeo-barrido',
+                                              interval=500, disabled=True),
+                                 dcc.Graph(id='barrido',
+                                           figure=figura_barrido())
+                             ]),
+                     dcc.Tab(label=u'Descomposición',
+                             children=[
+                                 html.P(u'Pobreza, mediana y desigualdad '
+                                        u'(Theil entre y dentro de los '
+                                        u'grupos) por subgrupo de '
+                                        u'población, con el escenario '
+                                        u'seleccionado.',
+                                        style={'margin-top': '2.5em'}),
+                                 dcc.Dropdown(
+                                     id='dimension',
+                                     options=[{'label': nombre,
+                                               'value': dimension}
+                                              for dimension, nombre
+                                              in DIMENSIONES],
+                                     value='sector',
+                                     clearable=False,
+                                     style={"margin-bottom": "1em"}),
+                                 html.Button(id='descomposicion-button',
+                                             n_clicks=0,
+                                             children='Calcular',
+                                             style={'background-color': rose,
+                                                    'color': 'white'}),
+                                 html.Div(id='estado-descomposicion',
+                                          style={'color': 'grey'}),
+                                 dcc.Store(id='trabajo-descomposicion'),
+                                 dcc.Interval(id='sondeo-descomposicion',
+                                              interval=500, disabled=True),
+                                 html.Div(id='descomposicion')
                              ])
                  ])
              ])
@@ -283,145 +560,459 @@ app.layout = html.Div(children=[
 ################################
 
 # ----------------------------
-# Data and Figures update callback
+# Conjunto de datos
 # ----------------------------
 
-@app.callback(output=[Output('histogram', 'figure'),
-               Output('mediana-choque', component_property='children'),
-               Output('lorenz', 'figure'),
-               Output('pobreza-choque', component_property='children')],
-              inputs=[Input('apply-button', 'n_clicks'),
-               Input('reference-lines', 'value')],
+@app.callback(output=[Output('base-figuras', 'data'),
+               Output('mediana-original', component_property='children'),
+               Output('resumen-original', component_property='children'),
+               Output('gini-original', component_property='children'),
+               Output('pobreza-original', component_property='children'),
+               Output('pobreza-detalle-original',
+                      component_property='children'),
+               Output('sondeo-conjunto', 'disabled')],
+              inputs=[Input('conjunto', 'value'),
+               Input('sondeo-conjunto', 'n_intervals')],
+              prevent_initial_call=True)
+def update_dataset(conjunto, n_intervals):
+    # el layout ya trae las salidas del conjunto predeterminado
+    if conjunto is None:
+        raise PreventUpdate
+    descripcion = descripcion_conjunto(conjunto)
+    if descripcion is not None:
+        return salidas_originales(descripcion) + (True,)
+
+    # el conjunto se carga en un proceso del pool, que deja su descripcion
+    # en el cache; mientras tanto se consulta su estado
+    clave = clave_conjunto(conjunto)
+    if dash.callback_context.triggered[0]['prop_id'] == 'conjunto.value':
+        try:
+            jobs.submit('conjunto-' + conjunto, clave, None,
+                        metodo='descripcion', conjunto=conjunto)
+        except JobsSaturados:
+            return [dash.no_update, MENSAJES_ENVIO['saturado'], None, '',
+                    '', None, True]
+    estado, descripcion = jobs.estado(clave)
+    if estado == PENDIENTE:
+        return [dash.no_update, u'Cargando el conjunto de datos...', None,
+                '', '', None, False]
+    if estado != LISTO:
+        return [dash.no_update, u'No fue posible cargar el conjunto de '
+                                u'datos.', None, '', '', None, True]
+    descripciones[conjunto] = descripcion
+    return salidas_originales(descripcion) + (True,)
+
+
+# ----------------------------
+# Tabla de choques por grupo
+# ----------------------------
+
+@app.callback(output=Output('tabla-choques', 'data'),
+              inputs=[Input('agregar-choque', 'n_clicks')],
+              state=[State('tabla-choques', 'data')])
+def add_shock_row(n_clicks, filas):
+    if not n_clicks:
+        raise PreventUpdate
+    return (filas or []) + [{'sector': 'todos', 'empresa': 'todos',
+                             'formalidad': 'todos', 'choque': None}]
+
+
+# ----------------------------
+# Envio del escenario al pool de calculo
+# ----------------------------
+
+# trabajos que no se pudieron enviar (trabajo['error'])
+MENSAJES_ENVIO = {
+    'saturado': u'Servidor ocupado, intente de nuevo en unos segundos.',
+    'cargando': u'Cargando el conjunto de datos, intente de nuevo en unos '
+                u'segundos.'}
+
+@app.callback(output=[Output('trabajo', 'data'),
+               Output('sesion', 'data'),
+               Output('trabajo-intervalos', 'data')],
+              inputs=[Input('apply-button', 'n_clicks')],
+              state=[State('sectores', 'value'),
+               State('shock', 'value'),
+               State('empresa', 'value'),
+               State('formalidad', 'value'),
+               State('contrato', 'value'),
+               State('tabla-choques', 'data'),
+               State('conjunto', 'value'),
+               State('intervalos', 'value'),
+               State('sesion', 'data')])
+def submit_scenario(n_clicks,
+                    selected_sectors,
+                    shock,
+                    empresa,
+                    formalidad,
+                    contrato,
+                    tabla,
+                    conjunto,
+                    con_intervalos,
+                    sesion):
+    if not n_clicks:
+        raise PreventUpdate
+
+    sesion = sesion or uuid.uuid4().hex
+    escenario = normalizar_escenario(selected_sectors, empresa,
+                                     formalidad, contrato, shock, tabla)
+    # primero el escenario: los bloques de replicas no deben retrasarlo
+    trabajo = enviar_trabajo(sesion, escenario, conjunto, previa=True)
+    trabajo_intervalos = None
+    if con_intervalos:
+        # un bloque de replicas por proceso del pool
+        limites = np.linspace(0, REPLICAS, max(1, jobs.procesos) + 1)
+        trabajo_intervalos = {
+            'conjunto': conjunto,
+            'bloques': [enviar_trabajo(sesion, escenario, conjunto,
+                                       metodo='replicas',
+                                       argumentos=(int(inicio), int(fin)))
+                        for inicio, fin in zip(limites[:-1], limites[1:])]}
+    return trabajo, sesion, trabajo_intervalos
+
+
+def enviar_trabajo(sesion, escenario, conjunto, metodo='evaluar',
+                   argumentos=(), previa=False):
+    """Envia ``metodo`` del escenario al pool (si no esta en el cache).
+
+    Devuelve el trabajo que consultan los callbacks de sondeo. Cada metodo
+    (y cada valor de sus ``argumentos``) tiene su propio namespace en el
+    cache y su propia cola por sesion. Con ``previa``, si el resultado no
+    esta en el cache y hay pool, antes se envia la vista previa
+    (``Modelo.evaluar_previa``, ver muestra.py), que toma milisegundos y
+    queda en ``trabajo['previa']``.
+    """
+    sufijo = '' if metodo == 'evaluar' else '-' + metodo
+    sufijo += ''.join('-{}'.format(argumento) for argumento in argumentos)
+    descripcion = descripcion_conjunto(conjunto)
+    if descripcion is None:
+        # el conjunto todavia se esta cargando (ver update_dataset)
+        clave = ''
+        trabajo = {'enviado': time.time(), 'conjunto': conjunto,
+                   'error': 'cargando'}
+        resultado = 'cargando'
+    else:
+        # el namespace incluye la firma de los datos del conjunto
+        clave = clave_escenario(escenario,
+                                descripcion['namespace'] + sufijo)
+        trabajo = {'clave': clave, 'enviado': time.time(),
+                   'conjunto': conjunto}
+    if clave and cache.get(clave) is None:
+        if previa and conjuntos.previa and jobs.procesos:
+            trabajo_previa = enviar_trabajo(sesion, escenario, conjunto,
+                                            metodo='evaluar_previa')
+            if not trabajo_previa.get('error'):
+                trabajo['previa'] = trabajo_previa['clave']
+        try:
+            # los trabajos de una sesion (el escenario y sus bloques de
+            # replicas) cuentan como uno en el limite de la cola, y la vista
+            # previa no cuenta
+            jobs.submit(sesion + sufijo, clave, escenario, metodo=metodo,
+                        conjunto=conjunto, argumentos=argumentos,
+                        grupo=sesion,
+                        limitar=metodo != 'evaluar_previa')
+            resultado = 'enviado'
+        except JobsSaturados:
+            trabajo['error'] = 'saturado'
+            resultado = 'saturado'
+    elif clave:
+        trabajo['cache'] = True
+        resultado = 'cache'
+    registro.contar('escenarios_total', metodo=metodo, resultado=resultado,
+                    ayuda='Escenarios solicitados, por resultado del envio.')
+    logger.info('Escenario %s (%s): %s', clave[:8], metodo, resultado)
+    return trabajo
+
+
+def registrar_resultado(trabajo, resultados, metodo):
+    """Tiempos por etapa y latencia de un escenario recien calculado."""
+    if trabajo.get('cache'):
+        return
+    registro.observar_etapas(resultados.get('tiempos', {}), metodo=metodo,
+                             modo=conjuntos.modo)
+    registro.observar('escenario_seconds', time.time() - trabajo['enviado'],
+                      ayuda='Tiempo desde el envio hasta el resultado.',
+                      metodo=metodo)
+    registro.contar('personas_en_riesgo_total',
+                    resultados.get('en_riesgo', 0), metodo=metodo,
+                    ayuda='Personas en riesgo en los escenarios calculados.')
+
+
+# ----------------------------
+# Intervalos de confianza (ver bootstrap.py)
+# ----------------------------
+
+def texto_intervalos(intervalo, nombre, formato, unidad_cambio):
+    bajo, alto = intervalo['cambio_' + nombre]
+    significativo = '' if bajo > 0 or alto < 0 else u' (no significativo)'
+    return [html.P(u'IC {:.0%} original: [{}, {}] | choque: [{}, {}]'.format(
+                intervalo['nivel'],
+                *[formato.format(v) for v in
+                  intervalo[nombre + '_original'] + intervalo[nombre]])),
+            html.P(u'IC {:.0%} del cambio: [{:+,.2f}, {:+,.2f}] {}{} '
+                   u'({} réplicas)'.format(intervalo['nivel'], bajo, alto,
+                                           unidad_cambio, significativo,
+                                           intervalo['replicas']))]
+
+
+@app.callback(output=[Output('intervalos-mediana',
+                             component_property='children'),
+               Output('intervalos-pobreza', component_property='children'),
+               Output('sondeo-intervalos', 'disabled')],
+              inputs=[Input('trabajo-intervalos', 'data'),
+               Input('sondeo-intervalos', 'n_intervals'),
+               Input('conjunto', 'value')])
+def update_intervals(trabajo, n_intervals, conjunto):
+    # sin intervalos, o calculados para otro conjunto de datos
+    if trabajo is None or trabajo.get('conjunto') != conjunto:
+        return None, None, True
+    bloques = trabajo['bloques']
+    errores = [b['error'] for b in bloques if b.get('error')]
+    if errores:
+        mensaje = MENSAJES_ENVIO[errores[0]]
+        return mensaje, mensaje, True
+
+    estados = [jobs.estado(b['clave'], b['enviado']) for b in bloques]
+    if any(estado == PENDIENTE for estado, _ in estados):
+        mensaje = u'Calculando intervalos...'
+        return mensaje, mensaje, False
+    if any(estado != LISTO for estado, _ in estados):
+        registro.contar('escenarios_error_total', metodo='replicas')
+        mensaje = u'No fue posible calcular los intervalos.'
+        return mensaje, mensaje, True
+    for bloque, (_, replicas) in zip(bloques, estados):
+        registrar_resultado(bloque, replicas, 'replicas')
+    intervalo = intervalos([replicas for _, replicas in estados])
+    return (texto_intervalos(intervalo, 'mediana', '{:,.0f}', 'COP'),
+            texto_intervalos(intervalo, 'pobreza', '{:.2f}%', 'pp'),
+            True)
+
+
+# ----------------------------
+# Barrido de la magnitud del choque
+# ----------------------------
+
+@app.callback(output=Output('trabajo-barrido', 'data'),
+              inputs=[Input('barrido-button', 'n_clicks')],
+              state=[State('sectores', 'value'),
+               State('empresa', 'value'),
+               State('formalidad', 'value'),
+               State('contrato', 'value'),
+               State('tabla-choques', 'data'),
+               State('conjunto', 'value'),
+               State('sesion', 'data')])
+def submit_sweep(n_clicks, selected_sectors, empresa, formalidad, contrato,
+                 tabla, conjunto, sesion):
+    if not n_clicks:
+        raise PreventUpdate
+
+    # la sesion la asigna submit_scenario; antes del primer escenario el
+    # barrido no cancela trabajos anteriores
+    sesion = sesion or uuid.uuid4().hex
+    # el choque general no se usa: se evaluan todos los niveles (los de la
+    # tabla de choques quedan fijos)
+    escenario = normalizar_escenario(selected_sectors, empresa,
+                                     formalidad, contrato, 100, tabla)
+    return enviar_trabajo(sesion, escenario, conjunto, metodo='barrido')
+
+
+@app.callback(output=[Output('barrido', 'figure'),
+               Output('sondeo-barrido', 'disabled'),
+               Output('estado-barrido', component_property='children')],
+              inputs=[Input('trabajo-barrido', 'data'),
+               Input('sondeo-barrido', 'n_intervals'),
+               Input('conjunto', 'value')])
+def update_sweep(trabajo, n_intervals, conjunto):
+    if trabajo is None:
+        raise PreventUpdate
+    # el barrido es de otro conjunto de datos
+    if trabajo.get('conjunto') != conjunto:
+        return figura_barrido(), True, ''
+    if trabajo.get('error'):
+        return dash.no_update, True, MENSAJES_ENVIO[trabajo['error']]
+
+    estado, barrido = jobs.estado(trabajo['clave'], trabajo['enviado'])
+    if estado == PENDIENTE:
+        return dash.no_update, False, u'Calculando...'
+    if estado != LISTO:
+        registro.contar('escenarios_error_total', metodo='barrido')
+        return dash.no_update, True, u'No fue posible calcular el barrido.'
+    registrar_resultado(trabajo, barrido, 'barrido')
+    return figura_barrido(barrido), True, ''
+
+
+# ----------------------------
+# Descomposicion por subgrupos
+# ----------------------------
+
+@app.callback(output=Output('trabajo-descomposicion', 'data'),
+              inputs=[Input('descomposicion-button', 'n_clicks')],
               state=[State('sectores', 'value'),
                State('shock', 'value'),
                State('empresa', 'value'),
                State('formalidad', 'value'),
-               State('contrato', 'value')])
-def update_tabs(n_clicks,
-                reference_lines,
-                selected_sectors,
-                shock,
-                empresa,
-                formalidad,
-                contrato):
+               State('contrato', 'value'),
+               State('tabla-choques', 'data'),
+               State('conjunto', 'value'),
+               State('sesion', 'data')])
+def submit_decomposition(n_clicks, selected_sectors, shock, empresa,
+                         formalidad, contrato, tabla, conjunto, sesion):
+    if not n_clicks:
+        raise PreventUpdate
+
+    sesion = sesion or uuid.uuid4().hex
+    escenario = normalizar_escenario(selected_sectors, empresa,
+                                     formalidad, contrato, shock, tabla)
+    return enviar_trabajo(sesion, escenario, conjunto,
+                          metodo='descomponer')
+
+
+@app.callback(output=[Output('descomposicion', 'children'),
+               Output('sondeo-descomposicion', 'disabled'),
+               Output('estado-descomposicion',
+                      component_property='children')],
+              inputs=[Input('trabajo-descomposicion', 'data'),
+               Input('sondeo-descomposicion', 'n_intervals'),
+               Input('conjunto', 'value'),
+               Input('dimension', 'value')])
+def update_decomposition(trabajo, n_intervals, conjunto, dimension):
+    if trabajo is None:
+        raise PreventUpdate
+    # la descomposicion es de otro conjunto de datos
+    if trabajo.get('conjunto') != conjunto:
+        return None, True, ''
+    if trabajo.get('error'):
+        return dash.no_update, True, MENSAJES_ENVIO[trabajo['error']]
+
+    estado, descomposicion = jobs.estado(trabajo['clave'],
+                                         trabajo['enviado'])
+    if estado == PENDIENTE:
+        return dash.no_update, False, u'Calculando...'
+    if estado != LISTO:
+        registro.contar('escenarios_error_total', metodo='descomponer')
+        return dash.no_update, True, (u'No fue posible calcular la '
+                                      u'descomposición.')
+    # al cambiar solo la dimension el resultado ya se habia registrado
+    if dash.callback_context.triggered[0]['prop_id'] != 'dimension.value':
+        registrar_resultado(trabajo, descomposicion, 'descomponer')
+    return tabla_descomposicion(descomposicion, dimension), True, ''
+
+
+# ----------------------------
+# Data and Figures update callback
+# ----------------------------
+
+PRELIMINAR = u' (preliminar)'
+
+
+def salidas_escenario(resultados, preliminar=False):
+    """Curvas y textos de un escenario (exacto o de la vista previa)."""
+    marca = PRELIMINAR if preliminar else ''
+    # las figuras se arman en el navegador
+    choque = datos_choque(resultados['densidad'], resultados['lorenz'])
+    texto_mediana = 'Mediana choque{}: {:,.0f} COP'.format(
+        marca, resultados['mediana'])
+    resumen = texto_resumen(resultados['resumen'])
+    texto_gini = u'Coeficiente de Gini choque{}: {:.4f}'.format(
+        marca, resultados['gini'])
+    texto_pobreza = u'Índice de pobreza choque{}: {:.2f}%'.format(
+        marca, resultados['pobreza'])
+    detalle_pobreza = tabla_pobreza(resultados['pobreza_detalle'])
+    return (choque, texto_mediana, resumen, texto_gini, texto_pobreza,
+            detalle_pobreza)
+
+
+@app.callback(output=[Output('choque', 'data'),
+               Output('mediana-choque', component_property='children'),
+               Output('resumen-choque', component_property='children'),
+               Output('gini-choque', component_property='children'),
+               Output('pobreza-choque', component_property='children'),
+               Output('pobreza-detalle-choque',
+                      component_property='children'),
+               Output('sondeo', 'disabled'),
+               Output('estado-calculo', component_property='children'),
+               Output('previa-mostrada', 'data')],
+              inputs=[Input('trabajo', 'data'),
+               Input('sondeo', 'n_intervals'),
+               Input('conjunto', 'value')],
+              state=[State('previa-mostrada', 'data')])
+def update_tabs(trabajo, n_intervals, conjunto, previa_mostrada):
 
     # descriptive statistics
     mediana_choque = 'No choque'
     texto_mediana = 'Mediana choque: {}'.format(mediana_choque)
+    resumen = None
+    texto_gini = u'Coeficiente de Gini choque: No choque'
     pobreza_choque = 'No choque'
     texto_pobreza = u'Índice de pobreza choque: {}'.format(pobreza_choque)
+    detalle_pobreza = None
+    sin_cambios = [dash.no_update] * 6
 
-    # get context
+    # get context. Al cambiar de conjunto de datos el escenario anterior
+    # deja de aplicar
     ctx = dash.callback_context
-    if not ctx.triggered:
-        return fig_hist, texto_mediana, fig_lorenz, texto_pobreza
-    else:
-        action_id = ctx.triggered[0]['prop_id'].split('.')[0]
-
-    if action_id == 'apply-button':
-        # ----------------------------
-        # 1. Datos
-        print(datetime.datetime.now())
-        print('Updating data...')
-        # ----------------------------
-
-        if formalidad is None:
-            formalidad = []
-        if contrato is None:
-            contrato = []
-        if selected_sectors is None:
-            selected_sectors = []
-
-        # reestablezco la base
-        df_shock = df.copy()
-        # definicion de hogares en riesgo
-        df_shock.loc[(((df_shock['sector'].isin(selected_sectors)) &
-                       (df_shock['tipo_empresa'] == empresa)) &
-                      ((df_shock['informales'].isin(formalidad)) |
-                       (df_shock['cuenta_propia'].isin(contrato)))), 'riesgo'] = 1
-
-        df_shock.riesgo = df_shock.riesgo.fillna(value=0)
-        df_shock = update_income(df_shock, shock)
-
-        # ----------------------------
-        # 2. Histograma y mediana
-        print('Updating Histogram...')
-        # ----------------------------
-
-        # clean histogram
-        fig_hist.data = []
-
-        # compute kernel
-        kernel_shock = gaussian_kde(df_shock.ING_pc_choque_arriendo,
-                                    weights=df_shock.fac_exp_ind_12m)
-
-        # update median
-        mediana_choque = weighted_median(df_shock,
-                                       'ING_pc_choque_arriendo',
-                                       'fac_exp_ind_12m')
-        texto_mediana = 'Mediana choque: {:,.0f} COP'.format(mediana_choque)
-
-        # modified distribution
-        fig_hist.add_trace(go.Scatter(x=xs, y=kernel_shock(xs),
-                                      name=u'Distribución Choque',
-                                      line_color=naranja,
-                                      fill='tozeroy',
-                                      fillcolor='rgba(237,177,131,0.5)',
-                                      mode='lines'))
-        # Original distribution
-        fig_hist.add_trace(go.Scatter(x=xs, y=dist_original,
-                                      mode='lines',
-                                      name=u'Distribución Original',
-                                      line=dict(color=black)))
-
-        # ----------------------------
-        # 3. Lorenz
-        print('Updating Lorenz...')
-        # ----------------------------
-
-        # clean figure
-        fig_lorenz.data = []
-
-        fig_lorenz.add_trace(go.Scatter(x=[0, 1], y=[0, 1],
-                                        mode='lines',
-                                        name=u'Igualdad total',
-                                        line=dict(color='grey',
-                                                  dash="dashdot")))
-
-        # calculate new values
-        f_vals_shock, l_vals_shock = qe.lorenz_curve(df_shock.ING_pc_choque_arriendo.to_numpy())
-
-        # sample to plot
-        ids = list(range(0, len(f_vals)))
-        sample_ids = random.sample(ids, 10000)
-
-        fig_lorenz.add_trace(go.Scatter(x=f_vals_shock[sample_ids],
-                                        y=l_vals_shock[sample_ids],
-                                        mode='lines',
-                                        name=u'Distribución Choque',
-                                        line_color=naranja))
-
-        fig_lorenz.add_trace(go.Scatter(x=f_vals[sample_ids],
-                                        y=l_vals[sample_ids],
-                                        mode='lines',
-                                        name=u'Distribución Original',
-                                        line_color=black))
-        # ----------------------------
-        # 4. Poverty
-        print('Updating Poverty Measures... \n')
-        print('-------------------------------------')
-        # ----------------------------
-        pobreza_choque = calculo_pobreza(df_shock, 'ING_pc_choque_arriendo')
-        texto_pobreza = u'Índice de pobreza choque: {:.2f}%'.format(pobreza_choque)
-
-    elif action_id == 'reference-lines':
-        lines, names = generate_reference_lines(reference_lines, dist_original)
-        fig_hist.update_layout(shapes=lines, annotations=names)
-
-    else:
+    if (not ctx.triggered or
+            trabajo is not None and trabajo.get('conjunto') != conjunto):
+        return (None, texto_mediana, resumen, texto_gini, texto_pobreza,
+                detalle_pobreza, True, '', None)
+
+    # ----------------------------
+    # 1. Datos
+    # ----------------------------
+    if trabajo is None:
         raise PreventUpdate
+    if trabajo.get('error'):
+        return sin_cambios + [True, MENSAJES_ENVIO[trabajo['error']],
+                              dash.no_update]
+
+    estado, resultados = jobs.estado(trabajo['clave'], trabajo['enviado'])
+    if estado == PENDIENTE:
+        # la vista previa (si se envio) se muestra una sola vez, cuando
+        # termina; si falla solo se espera el resultado exacto
+        previa = trabajo.get('previa')
+        preliminar = (u'Resultado preliminar con una submuestra de hogares; '
+                      u'calculando el resultado exacto...')
+        if previa and previa != previa_mostrada:
+            estado_previa, resultados = jobs.estado(previa)
+            if estado_previa == LISTO:
+                return list(salidas_escenario(resultados, preliminar=True)) + [
+                    False, preliminar, previa]
+        texto = (preliminar if previa and previa == previa_mostrada else
+                 u'Calculando...')
+        return sin_cambios + [False, texto, dash.no_update]
+    if estado != LISTO:
+        registro.contar('escenarios_error_total', metodo='evaluar',
+                        ayuda='Escenarios que fallaron o expiraron.')
+        return sin_cambios + [True, u'No fue posible calcular el '
+                                    u'escenario.', dash.no_update]
+    registrar_resultado(trabajo, resultados, 'evaluar')
+    inicio_figuras = time.perf_counter()
+
+    # ----------------------------
+    # 2. Curvas del choque, mediana, Gini y pobreza
+    # ----------------------------
+    salidas = salidas_escenario(resultados)
+    registro.observar('figuras_seconds',
+                      time.perf_counter() - inicio_figuras,
+                      ayuda='Construccion de las salidas del escenario.')
+
+    return salidas + (True, '', dash.no_update)
+
+
+# ----------------------------
+# Figuras (en el navegador, ver assets/figuras.js)
+# ----------------------------
+
+app.clientside_callback(
+    ClientsideFunction(namespace='figuras', function_name='histograma'),
+    Output('histogram', 'figure'),
+    [Input('choque', 'data'), Input('reference-lines', 'value'),
+     Input('base-figuras', 'data')])
 
-    return fig_hist, texto_mediana, fig_lorenz, texto_pobreza
+app.clientside_callback(
+    ClientsideFunction(namespace='figuras', function_name='lorenz'),
+    Output('lorenz', 'figure'),
+    [Input('choque', 'data'), Input('base-figuras', 'data')])
 
 ################################
 # 4. Run App
@@ -0,0 +1,122 @@
+"""Artefactos de la linea base guardados en disco.
+
+``Modelo`` calcula al iniciar la densidad original, los ordenamientos del
+ingreso, la curva de Lorenz, los indicadores de pobreza y los agregados del
+modo delta. Estos resultados se guardan en un directorio (arreglos ``.npy``
+que se leen con mmap, valores pequenos en ``valores.pkl`` y ``meta.json``)
+cuyo nombre es un hash del contenido de los datos y de los parametros del
+calculo. Si los datos o los parametros cambian, el hash cambia y la linea
+base se recalcula.
+
+Para construirlos al desplegar (por defecto, los de todos los conjuntos de
+``GEIH_DATASETS``, ver conjuntos.py)::
+
+    python artefactos.py [DATOS ...] [--directorio DIRECTORIO]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from os import environ
+
+import numpy as np
+
+import pobreza
+from kde import CORTE, REFINAMIENTO
+from lorenz import GRILLA
+
+# cambia cuando cambia lo que se guarda o como se calcula
+VERSION_ARTEFACTOS = 6
+
+# '' desactiva el cache de artefactos
+DIRECTORIO = environ.get('BASELINE_CACHE_DIR',
+                         os.path.join(tempfile.gettempdir(),
+                                      'inequality_app_base'))
+
+
+def parametros(n_puntos, bw_method='scott'):
+    """Parametros que afectan la linea base (parte de la clave)."""
+    return {'version': VERSION_ARTEFACTOS,
+            'n_puntos': n_puntos,
+            'bw_method': bw_method,
+            'refinamiento': REFINAMIENTO,
+            'corte': CORTE,
+            'grilla_lorenz': len(GRILLA),
+            'lineas': [pobreza.L_CIUDAD, pobreza.L_CABECERA, pobreza.L_RESTO,
+                       pobreza.L_VULNERABILIDAD]}
+
+
+def clave_artefactos(firma, parametros):
+    texto = json.dumps([firma, parametros], sort_keys=True)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+def ruta_artefactos(firma, parametros, directorio=DIRECTORIO):
+    return os.path.join(directorio,
+                        'base-' + clave_artefactos(firma, parametros)[:20])
+
+
+def guardar_artefactos(ruta, artefactos, meta=None):
+    """Guarda ``artefactos`` (nombre -> arreglo o valor) de forma atomica."""
+    padre = os.path.dirname(ruta)
+    os.makedirs(padre, exist_ok=True)
+    temporal = tempfile.mkdtemp(prefix='.tmp-', dir=padre)
+    try:
+        valores = {}
+        for nombre, valor in artefactos.items():
+            if isinstance(valor, np.ndarray):
+                np.save(os.path.join(temporal, nombre + '.npy'), valor)
+            else:
+                valores[nombre] = valor
+        with open(os.path.join(temporal, 'valores.pkl'), 'wb') as f:
+            pickle.dump(valores, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(temporal, 'meta.json'), 'w') as f:
+            json.dump(dict(meta or {}, creado=time.time()), f, indent=2)
+        os.rename(temporal, ruta)
+    except OSError:
+        # otro proceso ya guardo los mismos artefactos
+        if not os.path.exists(os.path.join(ruta, 'meta.json')):
+            raise
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def cargar_artefactos(ruta):
+    """Artefactos guardados en ``ruta`` (arreglos con mmap) o None."""
+    if not os.path.exists(os.path.join(ruta, 'meta.json')):
+        return None
+    with open(os.path.join(ruta, 'valores.pkl'), 'rb') as f:
+        artefactos = pickle.load(f)
+    for nombre in os.listdir(ruta):
+        if nombre.endswith('.npy'):
+            artefactos[nombre[:-4]] = np.load(os.path.join(ruta, nombre),
+                                              mmap_mode='r')
+    return artefactos
+
+
+if __name__ == '__main__':
+    from conjuntos import rutas_configuradas
+    from datos import cargar_datos
+    from modelo import Modelo
+
+    parser = argparse.ArgumentParser(
+        description='Calcula y guarda los artefactos de la linea base.')
+    parser.add_argument('datos', nargs='*',
+                        default=list(rutas_configuradas().values()),
+                        help='directorios columnares o CSV (ver datos.py)')
+    parser.add_argument('--directorio', default=DIRECTORIO or None)
+    args = parser.parse_args()
+    if not args.directorio:
+        parser.error('falta --directorio (BASELINE_CACHE_DIR esta vacio)')
+
+    for ruta in args.datos:
+        inicio = time.time()
+        modelo = Modelo(cargar_datos(ruta), artefactos=args.directorio)
+        # estadisticas originales del bootstrap
+        modelo.replicas_base()
+        print('Linea base de {} en {} ({:.2f} s)'.format(
+            ruta, modelo.ruta_artefactos, time.time() - inicio))
@@ -0,0 +1,49 @@
+// Figuras del histograma y de Lorenz armadas en el navegador (ver
+// figures.figuras_base y figures.datos_choque). Los objetos de `base` no se
+// modifican: cada figura usa copias superficiales.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figuras: {
+        histograma: function(choque, referencias, base) {
+            var original = base.histograma.data[0];
+            var data = [Object.assign({}, original)];
+            if (choque) {
+                var trazo = Object.assign({}, base.choque_histograma, {
+                    x: original.x,
+                    y: choque.densidad.map(function(v) {
+                        return v * choque.escala;
+                    })
+                });
+                data.unshift(trazo);
+            }
+            var shapes = [];
+            var annotations = [];
+            (referencias || []).forEach(function(valor) {
+                var linea = base.lineas[valor];
+                if (linea) {
+                    shapes = shapes.concat(linea[0]);
+                    annotations = annotations.concat(linea[1]);
+                }
+            });
+            var layout = Object.assign({}, base.histograma.layout, {
+                shapes: shapes,
+                annotations: annotations
+            });
+            return {data: data, layout: layout};
+        },
+
+        lorenz: function(choque, base) {
+            var data = base.lorenz.data.map(function(trazo) {
+                return Object.assign({}, trazo);
+            });
+            if (choque) {
+                var original = data[data.length - 1];
+                data.splice(1, 0, Object.assign({}, base.choque_lorenz, {
+                    x: original.x,
+                    y: choque.lorenz
+                }));
+            }
+            return {data: data,
+                    layout: Object.assign({}, base.lorenz.layout)};
+        }
+    }
+});
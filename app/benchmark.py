@@ -0,0 +1,272 @@
+"""Benchmark de cada etapa del calculo de un escenario con datos sinteticos.
+
+``generar`` construye una encuesta con el esquema de la GEIH que usa la app
+(hogares con DIRECTORIO/SECUENCIA_P/HOGAR, codigos P6430/P6050, componentes
+del ingreso, factores de expansion, sectores...) del tamano que se pida. Para
+cada tamano se mide por separado cada etapa: tiempo (el minimo de varias
+repeticiones) y memoria pico (con ``tracemalloc``, en una ejecucion aparte).
+
+Los resultados se pueden guardar como linea base y comparar despues::
+
+    python benchmark.py --tamanos 100000 1000000 --guardar base.json
+    python benchmark.py --tamanos 100000 1000000 --comparar base.json
+
+Con ``--comparar`` el proceso termina con codigo 1 si alguna etapa es mas
+lenta que la linea base en mas de ``TOLERANCIA``.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+from bootstrap import REPLICAS
+from datos import FALTANTE, Datos, firma_columnas
+from engine import ShockEngine
+from figures import datos_choque
+from functions import update_income, weighted_median
+from kde import BinnedKDE
+from lorenz import weighted_lorenz
+from modelo import DELTA, Modelo, normalizar_escenario
+from quantiles import sort_order
+
+TAMANOS = [100000, 1000000, 5000000, 20000000]
+ESCENARIO = normalizar_escenario([4, 7, 8], 1, [1], [1], 40)
+# el mismo escenario con choques por grupo (ver choques.py)
+ESCENARIO_TABLA = normalizar_escenario(
+    [4, 7, 8], 1, [1], [1], 40,
+    [(8, None, None, 80), (4, None, 1, 20), (None, 1, 0, 55)])
+# update_income (pandas) solo se mide hasta este numero de personas
+MAX_LEGADO = 2000000
+# una etapa es una regresion si tarda mas que TOLERANCIA veces la linea
+# base (y al menos MIN_DIFERENCIA segundos mas)
+TOLERANCIA = 1.25
+MIN_DIFERENCIA = 0.01
+
+
+# ----------------------------
+# Datos sinteticos
+# ----------------------------
+
+def generar(n_personas, semilla=0):
+    """Encuesta sintetica con ``n_personas`` (aprox.) y tipos de datos.py."""
+    rng = np.random.default_rng(semilla)
+    tamano = rng.integers(1, 7, n_personas // 3 + 1)
+    tamano = tamano[:np.searchsorted(np.cumsum(tamano), n_personas) + 1]
+    n_hogares, n = len(tamano), int(tamano.sum())
+    hogar = np.repeat(np.arange(n_hogares), tamano)
+
+    def codigo(valores, p_faltante=0.0):
+        elegido = rng.choice(np.asarray(valores, dtype=np.int8), n)
+        if p_faltante:
+            elegido[rng.random(n) < p_faltante] = FALTANTE
+        return elegido
+
+    def ingreso(mu, p_cero):
+        valores = rng.lognormal(mu, 1, n)
+        valores[rng.random(n) < p_cero] = 0
+        return valores
+
+    columnas = {
+        'DIRECTORIO': (5000000 + hogar // 2).astype(np.int32),
+        'SECUENCIA_P': (1 + hogar % 2).astype(np.int8),
+        'HOGAR': np.ones(n, dtype=np.int8),
+        'personas_hogar': np.repeat(tamano, tamano).astype(np.int8),
+        'P6430': codigo(range(1, 10), 0.1),
+        'P6050': codigo(range(1, 10), 0.01),
+        'DSI': (rng.random(n) < 0.05).astype(np.int8),
+        'INI': (rng.random(n) < 0.03).astype(np.int8),
+        'CLASE_per': codigo([1, 2]),
+        'AREA_per': rng.choice(np.array([5, 8, 11, 12344], dtype=np.int16),
+                               n),
+        'sector': codigo(range(1, 18), 1 / 18),
+        'tipo_empresa': codigo([1, 2, 3, 4], 0.2),
+        'informales': codigo([0, 1]),
+        'cuenta_propia': codigo([0, 1]),
+        'cat_dom': codigo([1, 2, 3]),
+        'IMPA_y': ingreso(13, 0.6),
+        'IE_y': ingreso(12, 0.8),
+        'ISA_y': ingreso(11, 0.8),
+        'IOF_y': ingreso(11, 0.7),
+        'IMDI_y': ingreso(12, 0.9),
+        'arriendo_estimado': np.repeat(
+            rng.lognormal(12, 0.5, n_hogares) *
+            (rng.random(n_hogares) < 0.5), tamano),
+        'fac_exp_ind_12m': np.repeat(
+            rng.uniform(50, 900, n_hogares), tamano).astype(np.float32),
+        'edad': rng.integers(0, 95, n).astype(np.int8),
+    }
+    # ingreso sin choque con las mismas reglas de la app
+    columnas['ING_pc_bl_def_arriendo'] = ShockEngine(columnas).ingreso_base
+    return Datos(columnas, firma=firma_columnas(columnas))
+
+
+def frame_legado(datos, escenario):
+    """DataFrame como el que recibia ``update_income`` en la version original."""
+    df = pd.DataFrame({c: np.asarray(v) for c, v in datos.items()})
+    riesgo = ((df.sector.isin(escenario.sectores)) &
+              (df.tipo_empresa == escenario.empresa) &
+              (df.informales.isin(escenario.formalidad) |
+               df.cuenta_propia.isin(escenario.contrato)))
+    df['riesgo'] = riesgo.astype(int)
+    return df
+
+
+# ----------------------------
+# Etapas
+# ----------------------------
+
+def etapas(modelo, escenario=ESCENARIO):
+    """Lista de (nombre, funcion sin argumentos) a medir."""
+    riesgo = modelo.riesgo(escenario)
+    ingreso = modelo.engine.ingreso_choque(riesgo, escenario.shock)
+    orden = sort_order(ingreso, orden_base=modelo.orden_base)
+    frame = pd.DataFrame({'ingreso': ingreso, 'pesos': modelo.pesos})
+    densidad = BinnedKDE(ingreso, weights=modelo.pesos)(modelo.xs)
+    lorenz, _ = weighted_lorenz(ingreso, modelo.pesos, orden=orden)
+
+    def serializar():
+        # lo que envia update_tabs por escenario (ver figures.datos_choque)
+        return json.dumps(datos_choque(densidad, lorenz),
+                          cls=PlotlyJSONEncoder)
+
+    def replicas_base():
+        # se memoriza en el modelo: se mide la generacion completa
+        modelo._replicas_base = None
+        return modelo.replicas_base()
+
+    lista = [
+        ('riesgo', lambda: modelo.riesgo(escenario)),
+        ('ingreso_choque', lambda: modelo.engine.ingreso_choque(
+            riesgo, escenario.shock)),
+        ('kde', lambda: BinnedKDE(ingreso, weights=modelo.pesos)(modelo.xs)),
+        ('orden', lambda: sort_order(ingreso, orden_base=modelo.orden_base)),
+        ('weighted_median', lambda: weighted_median(frame, 'ingreso',
+                                                    'pesos', orden=orden)),
+        ('lorenz', lambda: weighted_lorenz(ingreso, modelo.pesos,
+                                           orden=orden)),
+        ('calculo_pobreza', lambda: modelo.indicadores.calcular(ingreso)),
+        ('serializacion', serializar),
+        ('evaluar_exacto', lambda: modelo.evaluar_exacto(escenario)),
+        ('evaluar_delta', lambda: modelo.evaluar_delta(escenario)),
+        ('evaluar_tabla', lambda: modelo.evaluar_delta(ESCENARIO_TABLA)),
+        ('barrido', lambda: modelo.barrido(escenario)),
+        ('descomponer', lambda: modelo.descomponer(escenario)),
+        ('replicas_base', replicas_base),
+        ('replicas', lambda: modelo.replicas(escenario, 0, REPLICAS // 2)),
+    ]
+    if len(ingreso) <= MAX_LEGADO:
+        legado = frame_legado(modelo.datos, escenario)
+        lista.insert(2, ('update_income', lambda: update_income(
+            legado.copy(), escenario.shock)))
+    return lista
+
+
+def medir(funcion, repeticiones=3):
+    """(segundos, MB pico): minimo de ``repeticiones`` y memoria aparte."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    tracemalloc.start()
+    try:
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(tiempos), pico / 2 ** 20
+
+
+def ejecutar(tamanos=TAMANOS, repeticiones=3, semilla=0):
+    """{tamano: {etapa: {'segundos': s, 'memoria_mb': mb}}}."""
+    resultados = {}
+    for n in tamanos:
+        inicio = time.perf_counter()
+        datos = generar(n, semilla=semilla)
+        print('{:>10,} personas generadas en {:.1f} s'.format(
+            datos.filas, time.perf_counter() - inicio))
+
+        # el modelo se construye una vez (es el arranque de la app), sin y
+        # con artefactos guardados
+        segundos, memoria = medir(
+            lambda: Modelo(datos, modo=DELTA, artefactos=None),
+            repeticiones=1)
+        por_etapa = {'modelo': {'segundos': segundos, 'memoria_mb': memoria}}
+        with tempfile.TemporaryDirectory() as directorio:
+            Modelo(datos, modo=DELTA, artefactos=directorio)
+            segundos, memoria = medir(
+                lambda: Modelo(datos, modo=DELTA, artefactos=directorio),
+                repeticiones)
+        por_etapa['modelo_artefactos'] = {'segundos': segundos,
+                                          'memoria_mb': memoria}
+        modelo = Modelo(datos, modo=DELTA, artefactos=None)
+        for nombre, funcion in etapas(modelo):
+            segundos, memoria = medir(funcion, repeticiones)
+            por_etapa[nombre] = {'segundos': segundos, 'memoria_mb': memoria}
+        resultados[str(n)] = por_etapa
+        imprimir(n, por_etapa)
+    return resultados
+
+
+def imprimir(n, por_etapa, base=None):
+    print('{:>10,} personas'.format(int(n)))
+    for nombre, medida in por_etapa.items():
+        linea = '  {:<18} {:>10.4f} s {:>10.1f} MB'.format(
+            nombre, medida['segundos'], medida['memoria_mb'])
+        if base is not None and nombre in base:
+            linea += '  x{:.2f}'.format(medida['segundos'] /
+                                        base[nombre]['segundos'])
+        print(linea)
+
+
+def regresiones(resultados, base):
+    """(tamano, etapa, segundos, segundos base) mas lentos que la base."""
+    lentas = []
+    for n, por_etapa in resultados.items():
+        for nombre, medida in por_etapa.items():
+            anterior = base.get(n, {}).get(nombre)
+            if anterior is None:
+                continue
+            antes, ahora = anterior['segundos'], medida['segundos']
+            if ahora > TOLERANCIA * antes and ahora - antes > MIN_DIFERENCIA:
+                lentas.append((n, nombre, ahora, antes))
+    return lentas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark por etapa con datos sinteticos.')
+    parser.add_argument('--tamanos', type=int, nargs='+', default=TAMANOS)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--guardar', help='guarda los resultados (JSON)')
+    parser.add_argument('--comparar', help='linea base guardada (JSON)')
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.tamanos, args.repeticiones, args.semilla)
+
+    if args.guardar:
+        with open(args.guardar, 'w') as f:
+            json.dump({'resultados': resultados,
+                       'repeticiones': args.repeticiones,
+                       'fecha': time.strftime('%Y-%m-%d %H:%M:%S')},
+                      f, indent=2)
+        print('Linea base guardada en {}'.format(args.guardar))
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            base = json.load(f)['resultados']
+        print('Comparacion con {}'.format(args.comparar))
+        for n, por_etapa in resultados.items():
+            imprimir(n, por_etapa, base.get(n))
+        lentas = regresiones(resultados, base)
+        for n, nombre, ahora, antes in lentas:
+            print('REGRESION {} personas, {}: {:.4f} s (base {:.4f} s)'.format(
+                n, nombre, ahora, antes))
+        sys.exit(1 if lentas else 0)
@@ -0,0 +1,136 @@
+"""Intervalos de confianza por bootstrap de hogares con pesos de replica.
+
+Cada replica remuestrea hogares (DIRECTORIO/SECUENCIA_P/HOGAR) con
+reemplazo: el peso de replica de una persona es su factor de expansion por
+el numero de veces que sale su hogar. La replica ``r`` se genera siempre con
+la misma semilla, de modo que la distribucion original y la del choque usan
+las mismas replicas y el resultado no depende de como se repartan las
+replicas entre procesos.
+
+Las replicas se evaluan en bloques vectorizados (matriz replicas x
+hogares): la pobreza y los totales salen de productos matriz-vector con
+sumas por hogar, y la mediana de una suma acumulada solo sobre una ventana
+de personas alrededor de la mediana puntual (con un calculo completo para
+las replicas cuya mediana cae fuera de la ventana). Las multiplicidades de
+un bloque se regeneran con la semilla de cada replica cuando se evalua (la
+matriz de todas las replicas ocuparia replicas x hogares bytes); las
+estadisticas originales no dependen del escenario y ``Modelo.replicas_base``
+las guarda con los artefactos de la linea base.
+"""
+from os import environ
+
+import numpy as np
+
+REPLICAS = int(environ.get('BOOTSTRAP_REPLICAS', '200'))
+SEMILLA = 2020
+# replicas por bloque vectorizado
+BLOQUE = 16
+# media ventana (fraccion de la poblacion) alrededor de la mediana: a lo
+# sumo VENTANA y, con muchos hogares, VENTANA_HOGARES / sqrt(hogares)
+# (varias veces el error estandar de la proporcion bajo la mediana)
+VENTANA = 0.05
+VENTANA_HOGARES = 8
+NIVEL = 0.95
+
+ESTADISTICAS = ('pobreza_original', 'pobreza', 'mediana_original', 'mediana')
+
+
+def multiplicidades(n_hogares, replicas, semilla=SEMILLA):
+    """Matriz (replicas, hogares) con las veces que sale cada hogar.
+
+    Un hogar sale a lo sumo unas pocas decenas de veces, asi que cabe en
+    ``uint8``.
+    """
+    matriz = np.empty((len(replicas), n_hogares), dtype=np.uint8)
+    for i, replica in enumerate(replicas):
+        rng = np.random.default_rng([semilla, replica])
+        matriz[i] = np.bincount(rng.integers(0, n_hogares, n_hogares),
+                                minlength=n_hogares)
+    return matriz
+
+
+class Bootstrap:
+    """Pobreza y mediana de un vector de ingreso con pesos de replica.
+
+    ``lineas`` y ``peso_pobreza`` son los de ``pobreza.IndicadoresPobreza``.
+    """
+
+    def __init__(self, hogar, n_hogares, pesos, lineas, peso_pobreza):
+        self.hogar = hogar
+        self.n_hogares = n_hogares
+        self.pesos = np.asarray(pesos, dtype=np.float64)
+        self.lineas = lineas
+        self.peso_pobreza = peso_pobreza
+
+    def _por_hogar(self, valores, personas=None):
+        hogar = self.hogar if personas is None else self.hogar[personas]
+        return np.bincount(hogar, weights=valores, minlength=self.n_hogares)
+
+    def preparar(self, ingreso, orden):
+        """Sumas por hogar y ventana de la mediana de ``ingreso``.
+
+        ``orden`` son los indices que ordenan ``ingreso``.
+        """
+        y = np.asarray(ingreso, dtype=np.float64)
+        w = np.where(np.isfinite(y), self.pesos, 0)
+        w_ord = w[orden]
+        acumulado = np.cumsum(w_ord)
+        ventana = min(VENTANA, VENTANA_HOGARES / np.sqrt(self.n_hogares))
+        inicio, fin = np.searchsorted(
+            acumulado, [(0.5 - ventana) * acumulado[-1],
+                        (0.5 + ventana) * acumulado[-1]])
+        ventana = orden[inicio:fin + 1]
+        sumas = np.column_stack([
+            self._por_hogar(self.peso_pobreza * (y < self.lineas)),
+            self._por_hogar(self.peso_pobreza),
+            self._por_hogar(w),
+            self._por_hogar(w_ord[:inicio], orden[:inicio])])
+        return {'y': y, 'w': w, 'orden': orden, 'sumas': sumas,
+                'hogar_ventana': self.hogar[ventana],
+                'w_ventana': w[ventana], 'y_ventana': y[ventana]}
+
+    def evaluar(self, preparado, matriz):
+        """(pobreza %, mediana) con cada fila de ``matriz``.
+
+        ``matriz`` son filas de ``multiplicidades``; ``preparado`` la salida
+        de ``preparar``.
+        """
+        matriz = np.asarray(matriz, dtype=np.float64)
+        pobres, peso_pobreza, total, debajo = (matriz @
+                                               preparado['sumas']).T
+        pobreza = 100 * pobres / peso_pobreza
+
+        objetivo = 0.5 * total
+        acumulado = debajo[:, None] + np.cumsum(
+            matriz[:, preparado['hogar_ventana']] * preparado['w_ventana'],
+            axis=1)
+        alcanza = acumulado >= objetivo[:, None]
+        mediana = preparado['y_ventana'][alcanza.argmax(axis=1)]
+
+        # mediana por fuera de la ventana: suma acumulada completa
+        orden = preparado['orden']
+        for r in np.flatnonzero((debajo >= objetivo) | ~alcanza[:, -1]):
+            acumulado = np.cumsum(matriz[r, self.hogar[orden]] *
+                                  preparado['w'][orden])
+            idx = np.searchsorted(acumulado, objetivo[r], side='left')
+            mediana[r] = preparado['y'][orden[min(idx, len(orden) - 1)]]
+        return pobreza, mediana
+
+
+def intervalos(bloques, nivel=NIVEL):
+    """Intervalos percentiles a partir de los bloques de ``Modelo.replicas``.
+
+    Incluye los cambios frente a la distribucion original, calculados
+    replica por replica.
+    """
+    replicas = {nombre: np.concatenate([b[nombre] for b in bloques])
+                for nombre in ESTADISTICAS}
+    replicas['cambio_pobreza'] = (replicas['pobreza'] -
+                                  replicas['pobreza_original'])
+    replicas['cambio_mediana'] = (replicas['mediana'] -
+                                  replicas['mediana_original'])
+    cola = 50 * (1 - nivel)
+    resultado = {nombre: tuple(np.percentile(valores, [cola, 100 - cola]))
+                 for nombre, valores in replicas.items()}
+    resultado.update(replicas=len(replicas['pobreza']), nivel=nivel)
+    return resultado
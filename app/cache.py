@@ -0,0 +1,186 @@
+"""Cache de resultados de escenarios compartido entre workers de gunicorn.
+
+Los resultados se guardan en una base SQLite local, de modo que todos los
+workers de un mismo nodo consultan y alimentan el mismo cache. El tamano se
+limita por numero de entradas con desalojo LRU, y los aciertos y fallos se
+cuentan tanto por proceso como en total. Los calculos que fallan tambien
+se registran (``set_error``), para que cualquier worker pueda reportarlos,
+y cada worker publica aqui sus metricas (``publicar_metricas``) para que
+``/metrics`` las combine.
+"""
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from os import environ
+
+CACHE_PATH = environ.get('SCENARIO_CACHE_PATH',
+                         os.path.join(tempfile.gettempdir(),
+                                      'inequality_app_cache.sqlite'))
+CACHE_SIZE = int(environ.get('SCENARIO_CACHE_SIZE', '512'))
+
+
+def clave_escenario(escenario, namespace=''):
+    """Clave estable para un escenario ya normalizado."""
+    texto = json.dumps([namespace, list(escenario)], sort_keys=True,
+                       default=str)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+class ScenarioCache:
+    """Cache LRU de resultados respaldado por SQLite."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._pid = None
+        with self._conexion() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS resultados ('
+                        'clave TEXT PRIMARY KEY, valor BLOB, acceso REAL)')
+            con.execute('CREATE TABLE IF NOT EXISTS contadores ('
+                        'nombre TEXT PRIMARY KEY, valor INTEGER)')
+            con.execute('CREATE TABLE IF NOT EXISTS errores ('
+                        'clave TEXT PRIMARY KEY, mensaje TEXT, momento REAL)')
+            con.execute('CREATE TABLE IF NOT EXISTS metricas ('
+                        'proceso TEXT PRIMARY KEY, pid INTEGER, valor BLOB, '
+                        'momento REAL)')
+
+    def _conexion(self):
+        # una conexion por hilo y por proceso (las conexiones de SQLite no
+        # sobreviven a un fork)
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.execute('PRAGMA journal_mode=WAL')
+            self._local.con = con
+        return con
+
+    def _contar(self, con, nombre):
+        con.execute('INSERT OR IGNORE INTO contadores VALUES (?, 0)',
+                    (nombre,))
+        con.execute('UPDATE contadores SET valor = valor + 1 '
+                    'WHERE nombre = ?', (nombre,))
+
+    def get(self, clave, contar=True):
+        """Resultado guardado o ``None``.
+
+        ``contar=False`` no afecta los contadores (para consultas repetidas
+        del mismo escenario, p. ej. mientras se espera un resultado).
+        """
+        with self._conexion() as con:
+            fila = con.execute('SELECT valor FROM resultados WHERE clave = ?',
+                               (clave,)).fetchone()
+            if fila is None:
+                if contar:
+                    self.misses += 1
+                    self._contar(con, 'misses')
+                return None
+            if contar:
+                self.hits += 1
+                self._contar(con, 'hits')
+            con.execute('UPDATE resultados SET acceso = ? WHERE clave = ?',
+                        (time.time(), clave))
+        return pickle.loads(fila[0])
+
+    def set(self, clave, valor):
+        blob = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._conexion() as con:
+            con.execute('INSERT OR REPLACE INTO resultados VALUES (?, ?, ?)',
+                        (clave, blob, time.time()))
+            con.execute('DELETE FROM resultados WHERE clave NOT IN ('
+                        'SELECT clave FROM resultados '
+                        'ORDER BY acceso DESC LIMIT ?)', (self.max_entries,))
+
+    def set_error(self, clave, mensaje):
+        """Registra que el calculo de ``clave`` fallo."""
+        with self._conexion() as con:
+            con.execute('INSERT OR REPLACE INTO errores VALUES (?, ?, ?)',
+                        (clave, mensaje, time.time()))
+            con.execute('DELETE FROM errores WHERE clave NOT IN ('
+                        'SELECT clave FROM errores '
+                        'ORDER BY momento DESC LIMIT ?)', (self.max_entries,))
+
+    def get_error(self, clave):
+        """Mensaje del ultimo fallo de ``clave`` o ``None``."""
+        with self._conexion() as con:
+            fila = con.execute('SELECT mensaje FROM errores WHERE clave = ?',
+                               (clave,)).fetchone()
+        return None if fila is None else fila[0]
+
+    def borrar_error(self, clave):
+        with self._conexion() as con:
+            con.execute('DELETE FROM errores WHERE clave = ?', (clave,))
+
+    def publicar_metricas(self, proceso, pid, estado):
+        """Guarda el estado de las metricas de un proceso."""
+        blob = pickle.dumps(estado, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._conexion() as con:
+            con.execute('INSERT OR REPLACE INTO metricas VALUES (?, ?, ?, ?)',
+                        (proceso, pid, blob, time.time()))
+
+    def leer_metricas(self, vivo, combinar):
+        """Pares (pid, estado) publicados por todos los procesos.
+
+        Los procesos para los que ``vivo(pid)`` es falso se acumulan con
+        ``combinar`` (lista de estados -> estado) en una sola fila con
+        pid 0, para que sus contadores no se pierdan ni se cuenten dos
+        veces.
+        """
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            filas = [(proceso, pid, pickle.loads(valor))
+                     for proceso, pid, valor in con.execute(
+                         'SELECT proceso, pid, valor FROM metricas')]
+            muertos = [fila for fila in filas if fila[1] and not vivo(fila[1])]
+            if muertos:
+                estados = [estado for _, pid, estado in filas if not pid]
+                estados += [estado for _, _, estado in muertos]
+                blob = pickle.dumps(combinar(estados),
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                con.executemany('DELETE FROM metricas WHERE proceso = ?',
+                                [(fila[0],) for fila in muertos])
+                con.execute('INSERT OR REPLACE INTO metricas '
+                            'VALUES (?, 0, ?, ?)',
+                            ('terminados', blob, time.time()))
+                filas = [fila for fila in filas
+                         if fila[1] and vivo(fila[1])]
+                filas.append(('terminados', 0, pickle.loads(blob)))
+        return [(pid, estado) for _, pid, estado in filas]
+
+    def get_or_compute(self, clave, funcion):
+        valor = self.get(clave)
+        if valor is None:
+            valor = funcion()
+            self.set(clave, valor)
+        return valor
+
+    def stats(self):
+        """Contadores de este proceso y totales del nodo."""
+        with self._conexion() as con:
+            totales = dict(con.execute('SELECT nombre, valor '
+                                       'FROM contadores').fetchall())
+            entradas = con.execute('SELECT COUNT(*) '
+                                   'FROM resultados').fetchone()[0]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hits_total': totales.get('hits', 0),
+                'misses_total': totales.get('misses', 0),
+                'entries': entradas,
+                'max_entries': self.max_entries}
+
+    def clear(self):
+        with self._conexion() as con:
+            con.execute('DELETE FROM resultados')
+            con.execute('DELETE FROM contadores')
+            con.execute('DELETE FROM errores')
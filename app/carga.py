@@ -0,0 +1,542 @@
+"""Prueba de carga local: la app bajo gunicorn con trafico de callbacks.
+
+Inicia la app con gunicorn (``config.py``, con la clase y el numero de
+workers que se pidan) y simula usuarios concurrentes contra el endpoint
+``_dash-update-component`` de Dash. Cada usuario repite la interaccion de
+"Aplicar": envia un escenario (``submit_scenario``) y consulta su estado
+cada ``interval`` de ``dcc.Interval`` (``update_tabs``) hasta tener el
+resultado. Las lineas de referencia y las figuras se dibujan en el
+navegador (assets/figuras.js), asi que no generan trafico.
+
+Tambien se puede reproducir trafico grabado: un archivo JSONL con un cuerpo
+de ``_dash-update-component`` por linea (p. ej. copiado de las
+herramientas de desarrollo del navegador); cada usuario las envia en
+orden.
+
+Reporta, por configuracion: solicitudes e interacciones por segundo,
+latencia p50/p95/p99 por tipo, tasa de errores y de timeouts, y la memoria
+(RSS y PSS, que reparte las paginas compartidas por el fork) de cada
+proceso de gunicorn y del pool de escenarios. Solo Linux (lee ``/proc``)::
+
+    python carga.py --clases gevent sync --workers 2 4 --usuarios 20
+    python carga.py --workers 4 --guardar carga.json
+    python carga.py --workers 4 --comparar carga.json
+
+Con ``--comparar`` el proceso termina con codigo 1 si alguna latencia p95
+supera la linea base en mas de ``TOLERANCIA`` o el throughput cae en esa
+misma proporcion.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+TOLERANCIA = 1.25
+# diferencia minima (s) para considerar una latencia como regresion
+MIN_DIFERENCIA = 0.01
+
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+
+# ----------------------------
+# Servidor
+# ----------------------------
+
+def iniciar_servidor(clase, workers, puerto, max_requests=1000,
+                     entorno=None, registro=None):
+    """Proceso de gunicorn con la app; el log va al archivo ``registro``.
+
+    Se ejecuta en el directorio actual, de modo que las rutas relativas de
+    ``GEIH_DATA`` y ``GEIH_DATASETS`` se leen como con ``python app.py``.
+    """
+    comando = ['gunicorn', '-c', os.path.join(DIRECTORIO, 'config.py'),
+               '--pythonpath', DIRECTORIO, '-k', clase,
+               '-w', str(workers), '-b', '127.0.0.1:{}'.format(puerto),
+               '--max-requests', str(max_requests), 'app:server']
+    salida = open(registro, 'w') if registro else subprocess.DEVNULL
+    return subprocess.Popen(comando, stdout=salida,
+                            stderr=subprocess.STDOUT,
+                            env=dict(os.environ, **(entorno or {})))
+
+
+def esperar_servidor(url, proceso, arranque):
+    limite = time.time() + arranque
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError('gunicorn termino con codigo {}'.format(
+                proceso.returncode))
+        try:
+            urllib.request.urlopen(url + '/_dash-layout', timeout=5).read()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError('gunicorn no respondio en {} s'.format(arranque))
+
+
+def detener_servidor(proceso):
+    proceso.send_signal(signal.SIGTERM)
+    try:
+        proceso.wait(30)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+
+
+# ----------------------------
+# Memoria por proceso (/proc)
+# ----------------------------
+
+def descendientes(raiz):
+    """pid -> pid del padre, de ``raiz`` y de todos sus descendientes."""
+    padres = {}
+    for nombre in os.listdir('/proc'):
+        if not nombre.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(nombre)) as f:
+                # el nombre del proceso (entre parentesis) puede tener
+                # espacios; despues vienen el estado y el pid del padre
+                campos = f.read().rsplit(')', 1)[1].split()
+            padres[int(nombre)] = int(campos[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    arbol = {raiz: padres.get(raiz)}
+    nuevos = True
+    while nuevos:
+        nuevos = {pid: padre for pid, padre in padres.items()
+                  if padre in arbol and pid not in arbol}
+        arbol.update(nuevos)
+    return arbol
+
+
+def memoria_proceso(pid):
+    """(rss, pss) en bytes; pss es None si el kernel no lo reporta."""
+    rss = pss = None
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    rss = int(linea.split()[1]) * 1024
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            for linea in f:
+                if linea.startswith('Pss:'):
+                    pss = int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    return rss, pss
+
+
+class MuestreoMemoria(threading.Thread):
+    """Maximo de RSS y PSS de cada proceso del arbol de gunicorn."""
+
+    def __init__(self, raiz, intervalo=0.5):
+        super().__init__(daemon=True)
+        self.raiz = raiz
+        self.intervalo = intervalo
+        self.maximos = {}  # pid -> {'rol', 'rss', 'pss'}
+        self._fin = threading.Event()
+
+    def _rol(self, pid, padre):
+        if pid == self.raiz:
+            return 'master'
+        return 'worker' if padre == self.raiz else 'pool'
+
+    def muestrear(self):
+        for pid, padre in descendientes(self.raiz).items():
+            rss, pss = memoria_proceso(pid)
+            if rss is None:
+                continue
+            maximo = self.maximos.setdefault(
+                pid, {'rol': self._rol(pid, padre), 'rss': 0, 'pss': 0})
+            maximo['rss'] = max(maximo['rss'], rss)
+            maximo['pss'] = max(maximo['pss'], pss or 0)
+
+    def run(self):
+        while not self._fin.is_set():
+            self.muestrear()
+            self._fin.wait(self.intervalo)
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+# ----------------------------
+# Cliente de callbacks de Dash
+# ----------------------------
+
+def _obtener(url):
+    with urllib.request.urlopen(url, timeout=30) as respuesta:
+        return json.loads(respuesta.read())
+
+
+def valores_iniciales(layout, valores=None):
+    """'id.propiedad' -> valor de cada componente del layout con id."""
+    valores = {} if valores is None else valores
+    if isinstance(layout, list):
+        for hijo in layout:
+            valores_iniciales(hijo, valores)
+    elif isinstance(layout, dict):
+        props = layout.get('props', {})
+        if 'id' in props:
+            for propiedad, valor in props.items():
+                valores['{}.{}'.format(props['id'], propiedad)] = valor
+        valores_iniciales(props.get('children'), valores)
+    return valores
+
+
+def buscar_callback(dependencias, entrada, salida):
+    """Callback del servidor con la ``entrada`` y la ``salida`` dadas."""
+    for dependencia in dependencias:
+        entradas = ['{id}.{property}'.format(**i)
+                    for i in dependencia['inputs']]
+        if (entrada in entradas and salida in dependencia['output'] and
+                not dependencia.get('clientside_function')):
+            return dependencia
+    raise LookupError('no hay callback con {} -> {}'.format(entrada, salida))
+
+
+def cuerpo(dependencia, valores, disparador):
+    """Cuerpo de ``_dash-update-component`` con los ``valores`` dados."""
+    salida = dependencia['output']
+    if salida.startswith('..'):
+        salidas = [dict(zip(('id', 'property'), s.split('.')))
+                   for s in salida.strip('.').split('...')]
+    else:
+        salidas = dict(zip(('id', 'property'), salida.split('.')))
+
+    def con_valor(dependencias):
+        return [dict(d, value=valores.get('{id}.{property}'.format(**d)))
+                for d in dependencias]
+
+    return {'output': salida, 'outputs': salidas,
+            'inputs': con_valor(dependencia['inputs']),
+            'state': con_valor(dependencia['state']),
+            'changedPropIds': [disparador]}
+
+
+class Cliente:
+    """Envia callbacks y registra (tipo, segundos, estado) de cada uno."""
+
+    def __init__(self, url, limite, registros):
+        self.url = url
+        self.limite = limite
+        self.registros = registros
+
+    def enviar(self, tipo, datos):
+        """Respuesta de Dash (``{}`` si no hubo cambios) o None si falla."""
+        solicitud = urllib.request.Request(
+            self.url + '/_dash-update-component',
+            data=json.dumps(datos).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(solicitud,
+                                        timeout=self.limite) as respuesta:
+                contenido = respuesta.read()
+            estado = OK
+        except urllib.error.HTTPError:
+            contenido, estado = None, ERROR
+        except (urllib.error.URLError, OSError) as error:
+            razon = getattr(error, 'reason', error)
+            contenido = None
+            estado = TIMEOUT if 'timed out' in str(razon) else ERROR
+        self.registros.append((tipo, time.perf_counter() - inicio, estado))
+        if contenido is None:
+            return None
+        # 204: PreventUpdate
+        return json.loads(contenido)['response'] if contenido else {}
+
+
+# ----------------------------
+# Interacciones
+# ----------------------------
+
+def escenarios_aleatorios(cantidad, semilla=0):
+    """Valores de los controles de ``cantidad`` escenarios distintos."""
+    rng = random.Random(semilla)
+    escenarios = []
+    for _ in range(cantidad):
+        escenarios.append({
+            'sectores.value': sorted(rng.sample(range(1, 18),
+                                                rng.randint(1, 5))),
+            'empresa.value': rng.randint(1, 4),
+            'formalidad.value': [1] if rng.random() < 0.7 else [],
+            'contrato.value': [1] if rng.random() < 0.5 else [],
+            'shock.value': rng.randrange(10, 101, 10)})
+    return escenarios
+
+
+class Aplicar:
+    """Interaccion de "Aplicar": envio del escenario y sondeo del estado."""
+
+    def __init__(self, dependencias, layout, escenarios, limite):
+        self.envio = buscar_callback(dependencias, 'apply-button.n_clicks',
+                                     'trabajo.data')
+        self.consulta = buscar_callback(dependencias, 'sondeo.n_intervals',
+                                        'choque.data')
+        self.iniciales = valores_iniciales(layout)
+        self.intervalo = self.iniciales.get('sondeo.interval', 500) / 1000
+        self.escenarios = escenarios
+        self.limite = limite
+
+    def __call__(self, cliente, rng, estado_usuario):
+        valores = dict(self.iniciales, **rng.choice(self.escenarios))
+        estado_usuario['clicks'] = estado_usuario.get('clicks', 0) + 1
+        valores['apply-button.n_clicks'] = estado_usuario['clicks']
+        valores['sesion.data'] = estado_usuario.get('sesion')
+
+        inicio = time.perf_counter()
+        respuesta = cliente.enviar('envio', cuerpo(
+            self.envio, valores, 'apply-button.n_clicks'))
+        trabajo = (respuesta or {}).get('trabajo', {}).get('data')
+        if not trabajo or trabajo.get('error'):
+            return ERROR
+        estado_usuario['sesion'] = respuesta['sesion']['data']
+        valores['trabajo.data'] = trabajo
+
+        for n in itertools.count():
+            if time.perf_counter() - inicio > self.limite:
+                return TIMEOUT
+            time.sleep(self.intervalo)
+            valores['sondeo.n_intervals'] = n + 1
+            respuesta = cliente.enviar('sondeo', cuerpo(
+                self.consulta, valores, 'sondeo.n_intervals'))
+            if respuesta is None:
+                return ERROR
+            if respuesta.get('sondeo', {}).get('disabled'):
+                # sin resultado, update_tabs explica el error en el estado
+                return (ERROR if respuesta['estado-calculo']['children']
+                        else OK)
+
+
+class Grabacion:
+    """Reproduce en orden los cuerpos de un archivo JSONL."""
+
+    def __init__(self, ruta):
+        with open(ruta) as f:
+            self.cuerpos = [json.loads(linea) for linea in f if linea.strip()]
+
+    def __call__(self, cliente, rng, estado_usuario):
+        for datos in self.cuerpos:
+            # el tipo es la salida del callback, sin los separadores
+            tipo = datos['output'].strip('.').split('.')[0]
+            if cliente.enviar(tipo, datos) is None:
+                return ERROR
+        return OK
+
+
+def simular(url, interaccion, usuarios, duracion, pausa, limite, semilla=0):
+    """Usuarios concurrentes repitiendo ``interaccion`` durante
+    ``duracion`` segundos; devuelve (solicitudes, interacciones)."""
+    solicitudes, interacciones = [], []
+    fin = time.time() + duracion
+
+    def usuario(i):
+        rng = random.Random(semilla + i)
+        cliente = Cliente(url, limite, solicitudes)
+        estado_usuario = {}
+        # arranque escalonado, como usuarios que llegan a distintos tiempos
+        time.sleep(rng.uniform(0, pausa))
+        while time.time() < fin:
+            inicio = time.perf_counter()
+            estado = interaccion(cliente, rng, estado_usuario)
+            interacciones.append(('interaccion',
+                                  time.perf_counter() - inicio, estado))
+            time.sleep(rng.uniform(0, 2 * pausa))
+
+    with ThreadPoolExecutor(usuarios) as pool:
+        list(pool.map(usuario, range(usuarios)))
+    return solicitudes, interacciones
+
+
+# ----------------------------
+# Resultados
+# ----------------------------
+
+def resumir(registros):
+    """tipo -> n, p50/p95/p99 (s) y tasas de error y timeout."""
+    por_tipo = {}
+    for tipo, segundos, estado in registros:
+        por_tipo.setdefault(tipo, []).append((segundos, estado))
+    resumen = {}
+    for tipo, valores in sorted(por_tipo.items()):
+        segundos = np.array([s for s, _ in valores])
+        estados = [e for _, e in valores]
+        p50, p95, p99 = np.percentile(segundos, [50, 95, 99])
+        resumen[tipo] = {'n': len(valores), 'p50': p50, 'p95': p95,
+                         'p99': p99,
+                         'errores': estados.count(ERROR) / len(valores),
+                         'timeouts': estados.count(TIMEOUT) / len(valores)}
+    return resumen
+
+
+def probar(clase, workers, args, interaccion_para):
+    """Inicia gunicorn, corre la simulacion y resume una configuracion."""
+    puerto = args.puerto
+    url = 'http://127.0.0.1:{}'.format(puerto)
+    with tempfile.TemporaryDirectory() as temporal:
+        # cache de escenarios vacio en cada corrida
+        entorno = {'SCENARIO_CACHE_PATH': os.path.join(temporal,
+                                                       'escenarios.sqlite')}
+        registro = os.path.join(temporal, 'gunicorn.log')
+        proceso = iniciar_servidor(clase, workers, puerto,
+                                   args.max_requests, entorno, registro)
+        try:
+            esperar_servidor(url, proceso, args.arranque)
+            interaccion = interaccion_para(url)
+            memoria = MuestreoMemoria(proceso.pid)
+            memoria.start()
+            inicio = time.time()
+            solicitudes, interacciones = simular(
+                url, interaccion, args.usuarios, args.duracion, args.pausa,
+                args.limite, args.semilla)
+            segundos = time.time() - inicio
+            memoria.detener()
+        except Exception:
+            with open(registro) as f:
+                sys.stderr.write(f.read()[-4000:])
+            raise
+        finally:
+            detener_servidor(proceso)
+
+    latencias = resumir(solicitudes + interacciones)
+    return {'clase': clase, 'workers': workers, 'segundos': segundos,
+            'solicitudes_por_segundo': len(solicitudes) / segundos,
+            'interacciones_por_segundo': len(interacciones) / segundos,
+            'errores': sum(e == ERROR for _, _, e in solicitudes) /
+                       max(len(solicitudes), 1),
+            'timeouts': sum(e == TIMEOUT for _, _, e in solicitudes) /
+                        max(len(solicitudes), 1),
+            'latencias': latencias,
+            'memoria': {str(pid): m
+                        for pid, m in sorted(memoria.maximos.items())}}
+
+
+def imprimir(resultado, base=None):
+    print('{clase} x {workers}: {solicitudes_por_segundo:.1f} solicitudes/s, '
+          '{interacciones_por_segundo:.2f} interacciones/s, errores '
+          '{errores:.1%}, timeouts {timeouts:.1%}'.format(**resultado))
+    for tipo, medida in resultado['latencias'].items():
+        linea = ('  {:<12} n={:<6} p50 {:>8.3f} s  p95 {:>8.3f} s  '
+                 'p99 {:>8.3f} s  errores {:.1%}  timeouts {:.1%}').format(
+            tipo, medida['n'], medida['p50'], medida['p95'], medida['p99'],
+            medida['errores'], medida['timeouts'])
+        anterior = (base or {}).get('latencias', {}).get(tipo)
+        if anterior:
+            linea += '  p95 x{:.2f}'.format(medida['p95'] / anterior['p95'])
+        print(linea)
+    for pid, medida in resultado['memoria'].items():
+        print('  {:<7} {:>8} RSS {:>8.1f} MB  PSS {:>8.1f} MB'.format(
+            medida['rol'], pid, medida['rss'] / 2 ** 20,
+            medida['pss'] / 2 ** 20))
+
+
+def clave(resultado):
+    return '{}-{}'.format(resultado['clase'], resultado['workers'])
+
+
+def regresiones(resultados, base):
+    """(configuracion, medida, valor, valor base) peores que la base."""
+    lentas = []
+    for resultado in resultados:
+        anterior = base.get(clave(resultado))
+        if anterior is None:
+            continue
+        for tipo, medida in resultado['latencias'].items():
+            antes = anterior['latencias'].get(tipo, {}).get('p95')
+            if (antes is not None and medida['p95'] > TOLERANCIA * antes and
+                    medida['p95'] - antes > MIN_DIFERENCIA):
+                lentas.append((clave(resultado), tipo + ' p95',
+                               medida['p95'], antes))
+        antes = anterior['solicitudes_por_segundo']
+        ahora = resultado['solicitudes_por_segundo']
+        if ahora * TOLERANCIA < antes:
+            lentas.append((clave(resultado), 'solicitudes/s', ahora, antes))
+    return lentas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Prueba de carga de la app bajo gunicorn.')
+    parser.add_argument('--clases', nargs='+', default=['gevent'],
+                        help='worker_class de gunicorn (gevent, sync, ...)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2])
+    parser.add_argument('--max-requests', type=int, default=1000)
+    parser.add_argument('--usuarios', type=int, default=10,
+                        help='usuarios concurrentes')
+    parser.add_argument('--duracion', type=float, default=30,
+                        help='segundos de carga por configuracion')
+    parser.add_argument('--pausa', type=float, default=1.0,
+                        help='pausa media (s) entre interacciones')
+    parser.add_argument('--limite', type=float, default=60,
+                        help='timeout (s) por solicitud y por interaccion')
+    parser.add_argument('--escenarios', type=int, default=50,
+                        help='escenarios distintos (controla los aciertos '
+                             'del cache)')
+    parser.add_argument('--grabacion',
+                        help='JSONL de cuerpos de _dash-update-component a '
+                             'reproducir en lugar de "Aplicar"')
+    parser.add_argument('--puerto', type=int, default=8050)
+    parser.add_argument('--arranque', type=float, default=300,
+                        help='espera maxima (s) para que la app responda')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--guardar', help='guarda los resultados (JSON)')
+    parser.add_argument('--comparar', help='linea base guardada (JSON)')
+    args = parser.parse_args()
+
+    if args.grabacion:
+        grabacion = Grabacion(args.grabacion)
+
+        def interaccion_para(url):
+            return grabacion
+    else:
+        escenarios = escenarios_aleatorios(args.escenarios, args.semilla)
+
+        def interaccion_para(url):
+            # los callbacks y los valores iniciales salen de la app
+            return Aplicar(_obtener(url + '/_dash-dependencies'),
+                           _obtener(url + '/_dash-layout'), escenarios,
+                           args.limite)
+
+    base = {}
+    if args.comparar:
+        with open(args.comparar) as f:
+            base = {clave(r): r for r in json.load(f)['resultados']}
+
+    resultados = []
+    for clase, workers in itertools.product(args.clases, args.workers):
+        resultado = probar(clase, workers, args, interaccion_para)
+        resultados.append(resultado)
+        imprimir(resultado, base.get(clave(resultado)))
+
+    if args.guardar:
+        with open(args.guardar, 'w') as f:
+            json.dump({'resultados': resultados,
+                       'parametros': {k: v for k, v in vars(args).items()
+                                      if k not in ('guardar', 'comparar')},
+                       'fecha': time.strftime('%Y-%m-%d %H:%M:%S')},
+                      f, indent=2)
+        print('Resultados guardados en {}'.format(args.guardar))
+
+    if args.comparar:
+        lentas = regresiones(resultados, base)
+        for configuracion, medida, ahora, antes in lentas:
+            print('REGRESION {}, {}: {:.3f} (base {:.3f})'.format(
+                configuracion, medida, ahora, antes))
+        sys.exit(1 if lentas else 0)
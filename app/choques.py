@@ -0,0 +1,84 @@
+"""Choques heterogeneos por sector, tamano de empresa y formalidad.
+
+Ademas del choque general (``shock``), un escenario puede llevar una tabla
+de choques: filas ``(sector, empresa, formalidad, choque)`` en las que
+``None`` significa "cualquier valor" y ``formalidad`` es el valor de
+``informales``. Las personas de las celdas de cada fila quedan en riesgo
+aunque no esten en la seleccion general del escenario (ver indice.py), de
+modo que la tabla puede cubrir varios tamanos de empresa. Cada persona en
+riesgo pierde el porcentaje de la ultima fila que le aplica, o el choque
+general si ninguna le aplica (la misma precedencia de las reglas de
+``engine.reglas_ingreso``).
+
+La combinacion de los tres codigos de cada persona se precalcula una vez
+como un indice de celda. Un escenario solo construye el vector de choques
+por celda (unos cientos de valores) y lo lee en las posiciones de las
+personas en riesgo, asi que cuesta lo mismo que un choque unico.
+"""
+import numpy as np
+
+from descomposicion import codificar
+
+DIMENSIONES = ('sector', 'tipo_empresa', 'informales')
+
+
+class TablaChoques:
+    """Choque (%) de cada persona en riesgo segun la tabla del escenario.
+
+    Como ``descomposicion.Descomposicion``, el indice de celdas se guarda
+    con ``estado()`` y se recupera con ``desde_estado``.
+    """
+
+    ESTADO = ('celda',) + tuple('codigos_' + d for d in DIMENSIONES)
+
+    def __init__(self, datos):
+        estado = {}
+        celda = np.zeros(len(datos[DIMENSIONES[0]]), dtype=np.intp)
+        for dimension in DIMENSIONES:
+            codigos, grupo = codificar(datos[dimension])
+            estado['codigos_' + dimension] = codigos
+            celda *= len(codigos)
+            celda += grupo
+        estado['celda'] = celda.astype(np.min_scalar_type(celda.max()))
+        self._usar(estado)
+
+    @classmethod
+    def desde_estado(cls, estado):
+        tabla = cls.__new__(cls)
+        tabla._usar(estado)
+        return tabla
+
+    def _usar(self, estado):
+        self._estado = {nombre: estado[nombre] for nombre in self.ESTADO}
+        self.celda = estado['celda']
+        self.codigos = [estado['codigos_' + d] for d in DIMENSIONES]
+        self.forma = tuple(len(codigos) for codigos in self.codigos)
+
+    def estado(self):
+        return dict(self._estado)
+
+    def por_celda(self, shock, tabla):
+        """Choque (%) de cada celda: ``shock`` salvo donde aplica ``tabla``."""
+        choques = np.full(self.forma, shock, dtype=np.float64)
+        for *valores, choque in tabla:
+            indice = []
+            for codigos, valor in zip(self.codigos, valores):
+                if valor is None:
+                    indice.append(slice(None))
+                    continue
+                posicion = np.searchsorted(codigos, valor)
+                if posicion == len(codigos) or codigos[posicion] != valor:
+                    break  # el valor no aparece en los datos
+                indice.append(posicion)
+            else:
+                choques[tuple(indice)] = choque
+        return choques.ravel()
+
+    def por_persona(self, escenario, riesgo, shock=None):
+        """Choque (%) de las personas en riesgo, en el orden de ``riesgo``.
+
+        ``riesgo`` es una mascara o los indices de las personas; ``shock``
+        reemplaza el choque general del escenario.
+        """
+        shock = escenario.shock if shock is None else shock
+        return self.por_celda(shock, escenario.tabla)[self.celda[riesgo]]
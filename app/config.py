@@ -7,8 +7,16 @@ def max_workers():
     return cpu_count()
 
 
+# para comparar configuraciones (clase y numero de workers) con carga
+# simulada, ver carga.py
 bind = '0.0.0.0:' + environ.get('PORT', '8000')
 max_requests = 1000
 worker_class = 'gevent'
 workers = max_workers()
-timeout = 100
\ No newline at end of file
+timeout = 100
+# cargar los datos (memoria compartida via mmap) antes de hacer fork
+preload_app = True
+
+# conexiones simultaneas por worker de gevent (los callbacks ya no comparten
+# figuras globales)
+worker_connections = int(environ.get('WORKER_CONNECTIONS', '1000'))
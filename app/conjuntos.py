@@ -0,0 +1,125 @@
+"""Registro de conjuntos de datos (anos de la GEIH, muestra completa, ...).
+
+Cada conjunto tiene un nombre y una ruta (directorio columnar o CSV, ver
+datos.py). El ``Modelo`` de un conjunto se construye la primera vez que se
+pide, con su linea base (que se lee de disco si ya esta guardada, ver
+artefactos.py). Los modelos cargados se conservan mientras su memoria total
+no supere un presupuesto; al cargar uno nuevo se descartan los que se usaron
+hace mas tiempo (LRU).
+
+Configuracion::
+
+    GEIH_DATASETS='2019=/datos/GEIH_2019,2020=/datos/GEIH_2020'
+    DATASET_MEMORY_MB=4096
+
+Sin ``GEIH_DATASETS`` hay un solo conjunto, el de ``GEIH_DATA``.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+
+from datos import cargar_datos
+from metricas import registro
+from modelo import MODO, Modelo
+from muestra import FRACCION
+
+logger = logging.getLogger(__name__)
+
+PRESUPUESTO = int(float(environ.get('DATASET_MEMORY_MB', '4096')) * 2 ** 20)
+
+
+def rutas_configuradas(texto=None):
+    """nombre -> ruta, de ``GEIH_DATASETS`` ('nombre=ruta,...')."""
+    texto = environ.get('GEIH_DATASETS', '') if texto is None else texto
+    rutas = {}
+    for parte in texto.split(','):
+        if parte.strip():
+            nombre, _, ruta = parte.partition('=')
+            rutas[nombre.strip()] = (ruta or nombre).strip()
+    if not rutas:
+        ruta = environ.get('GEIH_DATA', 'GEIH_mini')
+        rutas[os.path.basename(ruta.rstrip('/'))] = ruta
+    return rutas
+
+
+class Conjuntos:
+    """Modelos de varios conjuntos de datos, cargados al primer uso.
+
+    El modelo recien cargado se conserva aunque por si solo supere el
+    ``presupuesto`` (bytes). ``previa`` es la fraccion de hogares de la
+    vista previa de cada modelo (0 la desactiva, ver muestra.py).
+    """
+
+    def __init__(self, rutas=None, presupuesto=PRESUPUESTO, modo=MODO,
+                 previa=FRACCION):
+        self.rutas = dict(rutas_configuradas() if rutas is None else rutas)
+        if not self.rutas:
+            raise ValueError('no hay conjuntos de datos configurados')
+        self.presupuesto = presupuesto
+        self.modo = modo
+        self.previa = previa
+        self.cargas = 0
+        self.desalojos = 0
+        self._modelos = OrderedDict()  # nombre -> Modelo, del menos reciente
+        self._lock = threading.Lock()
+
+    @property
+    def nombres(self):
+        return list(self.rutas)
+
+    @property
+    def predeterminado(self):
+        return self.nombres[0]
+
+    def cargados(self):
+        return list(self._modelos)
+
+    def memoria(self):
+        """Memoria aproximada de los modelos cargados (bytes)."""
+        return sum(modelo.nbytes for modelo in self._modelos.values())
+
+    def modelo(self, nombre=None):
+        """``Modelo`` del conjunto ``nombre`` (el predeterminado si None)."""
+        nombre = self.predeterminado if nombre is None else nombre
+        if nombre not in self.rutas:
+            raise KeyError('conjunto desconocido: {}'.format(nombre))
+        with self._lock:
+            modelo = self._modelos.get(nombre)
+            if modelo is None:
+                modelo = self._cargar(nombre)
+                self._modelos[nombre] = modelo
+                self._desalojar()
+            else:
+                self._modelos.move_to_end(nombre)
+            return modelo
+
+    def cargado(self, nombre=None):
+        """``Modelo`` del conjunto si ya esta en memoria, sin cargarlo."""
+        nombre = self.predeterminado if nombre is None else nombre
+        with self._lock:
+            return self._modelos.get(nombre)
+
+    def _cargar(self, nombre):
+        inicio = time.time()
+        datos = cargar_datos(self.rutas[nombre])
+        modelo = Modelo(datos, modo=self.modo, previa=self.previa)
+        segundos = time.time() - inicio
+        self.cargas += 1
+        registro.fijar('datos_filas', datos.filas, conjunto=nombre,
+                       ayuda='Personas en la encuesta.')
+        registro.observar('conjunto_carga_seconds', segundos,
+                          ayuda='Carga de un conjunto de datos y de su '
+                                'linea base.')
+        logger.info('Conjunto %s: %d filas, %.0f MB, cargado en %.2f s',
+                    nombre, datos.filas, modelo.nbytes / 2 ** 20, segundos)
+        return modelo
+
+    def _desalojar(self):
+        while len(self._modelos) > 1 and self.memoria() > self.presupuesto:
+            nombre, _ = self._modelos.popitem(last=False)
+            self.desalojos += 1
+            logger.info('Conjunto %s descartado (presupuesto de %.0f MB)',
+                        nombre, self.presupuesto / 2 ** 20)
@@ -0,0 +1,157 @@
+"""Almacenamiento columnar de la GEIH para la aplicacion.
+
+``convertir`` toma el CSV original, deja solo las columnas que usa la
+aplicacion con tipos compactos y guarda cada columna como un ``.npy`` en un
+directorio. ``cargar_datos`` abre ese directorio con ``mmap`` en modo solo
+lectura: si se carga antes del fork de gunicorn (``preload_app``) todos los
+workers comparten la misma copia fisica en memoria.
+
+Uso::
+
+    python datos.py GEIH_mini.csv GEIH_mini
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+VERSION_FORMATO = 1
+
+# columnas del CSV que usa la aplicacion y su nombre dentro de la app
+RENOMBRAR = {'seccion_2d': 'sector'}
+
+# identificadores (sin faltantes)
+IDENTIFICADORES = ['DIRECTORIO', 'SECUENCIA_P', 'HOGAR', 'personas_hogar']
+
+# codigos categoricos y banderas: enteros pequenos, -1 si falta el dato
+CODIGOS = ['P6430', 'P6050', 'DSI', 'INI', 'CLASE_per', 'AREA_per',
+           'sector', 'tipo_empresa', 'informales', 'cuenta_propia',
+           'cat_dom']
+
+# valores continuos
+INGRESOS = ['IMPA_y', 'IE_y', 'ISA_y', 'IOF_y', 'IMDI_y',
+            'arriendo_estimado', 'ING_pc_bl_def_arriendo']
+FLOAT32 = ['fac_exp_ind_12m']
+EDAD = 'edad'
+
+COLUMNAS = IDENTIFICADORES + CODIGOS + INGRESOS + FLOAT32 + [EDAD]
+# las mismas columnas con su nombre en el CSV
+COLUMNAS_CSV = [{v: k for k, v in RENOMBRAR.items()}.get(c, c)
+                for c in COLUMNAS]
+FALTANTE = -1
+
+
+def _entero_minimo(valores):
+    tipos = [np.int8, np.int16, np.int32, np.int64]
+    if len(valores) == 0:
+        return tipos[0]
+    minimo, maximo = valores.min(), valores.max()
+    for tipo in tipos:
+        info = np.iinfo(tipo)
+        if info.min <= minimo and maximo <= info.max:
+            return tipo
+    raise ValueError('valores fuera de rango para int64')
+
+
+def compactar(df):
+    """Columnas de la app con tipos compactos, como diccionario de arreglos."""
+    df = df.rename(columns=RENOMBRAR)
+    columnas = {}
+    for col in IDENTIFICADORES:
+        valores = df[col].to_numpy()
+        columnas[col] = valores.astype(_entero_minimo(valores))
+    for col in CODIGOS:
+        valores = pd.to_numeric(df[col], errors='coerce')
+        valores = valores.fillna(FALTANTE).to_numpy()
+        columnas[col] = valores.astype(_entero_minimo(valores))
+    for col in INGRESOS:
+        columnas[col] = df[col].to_numpy(dtype=np.float64)
+    for col in FLOAT32:
+        columnas[col] = df[col].to_numpy(dtype=np.float32)
+    # la edad se compara con < 10 y < 12: un faltante no puede ser -1
+    edad = df[EDAD]
+    if edad.isna().any():
+        columnas[EDAD] = edad.to_numpy(dtype=np.float32)
+    else:
+        columnas[EDAD] = edad.to_numpy().astype(
+            _entero_minimo(edad.to_numpy()))
+    return columnas
+
+
+def leer_csv(ruta):
+    return compactar(pd.read_csv(ruta, usecols=COLUMNAS_CSV))
+
+
+def firma_columnas(columnas):
+    """Hash del contenido de los datos (independiente del formato)."""
+    h = hashlib.sha1()
+    for col in sorted(columnas):
+        valores = np.ascontiguousarray(columnas[col])
+        h.update(col.encode('utf-8'))
+        h.update(str(valores.dtype).encode('utf-8'))
+        h.update(valores.data)
+    return h.hexdigest()
+
+
+def convertir(ruta_csv, destino):
+    columnas = leer_csv(ruta_csv)
+    os.makedirs(destino, exist_ok=True)
+    for col, valores in columnas.items():
+        np.save(os.path.join(destino, col + '.npy'), valores)
+    meta = {'version': VERSION_FORMATO,
+            'origen': os.path.basename(ruta_csv),
+            'filas': len(columnas['DIRECTORIO']),
+            'firma': firma_columnas(columnas),
+            'tipos': {col: str(v.dtype) for col, v in columnas.items()}}
+    with open(os.path.join(destino, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class Datos(dict):
+    """Columnas de la encuesta (nombre -> arreglo de NumPy)."""
+
+    def __init__(self, columnas, firma=None):
+        super().__init__(columnas)
+        self.firma = firma or firma_columnas(columnas)
+
+    @property
+    def filas(self):
+        return len(self['DIRECTORIO'])
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in self.values())
+
+
+def cargar_columnar(destino):
+    with open(os.path.join(destino, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != VERSION_FORMATO:
+        raise ValueError('formato {} no soportado, vuelva a convertir '
+                         '{}'.format(meta['version'], destino))
+    columnas = {col: np.load(os.path.join(destino, col + '.npy'),
+                             mmap_mode='r')
+                for col in meta['tipos']}
+    return Datos(columnas, firma=meta['firma'])
+
+
+def cargar_datos(ruta):
+    """Carga el directorio columnar si existe; si no, el CSV."""
+    base = ruta[:-4] if ruta.endswith('.csv') else ruta
+    if os.path.isfile(os.path.join(base, 'meta.json')):
+        return cargar_columnar(base)
+    return Datos(leer_csv(base + '.csv'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('uso: python datos.py ARCHIVO.csv [DESTINO]')
+        sys.exit(1)
+    ruta_csv = sys.argv[1]
+    destino = sys.argv[2] if len(sys.argv) == 3 else ruta_csv[:-4]
+    meta = convertir(ruta_csv, destino)
+    print('{} filas guardadas en {}'.format(meta['filas'], destino))
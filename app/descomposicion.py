@@ -0,0 +1,171 @@
+"""Descomposicion de los efectos del choque por subgrupos de poblacion.
+
+Los grupos (sector, tamano de empresa, zona y cat_dom) se codifican una sola
+vez como indices enteros ``0..G-1`` por persona, y su combinacion como un
+indice de celda. Un ingreso se evalua con un ``np.bincount`` por suma sobre
+las celdas (pobreza, ingreso y las sumas del indice de Theil, que se
+descompone exactamente en desigualdad entre y dentro de los grupos); las
+sumas por grupo de cada dimension salen de sumar celdas. Las medianas se
+obtienen reagrupando el orden del ingreso por grupo (ordenamiento estable
+sobre enteros pequenos), sin volver a ordenar el ingreso.
+"""
+import numpy as np
+
+from datos import FALTANTE
+
+DIMENSIONES = ('sector', 'tipo_empresa', 'zona', 'cat_dom')
+
+# zonas: los mismos dominios de las lineas de pobreza (ver pobreza.py)
+CIUDADES = 0
+CABECERAS = 1
+RURAL = 2
+NOMBRES_ZONAS = {CIUDADES: u'13 ciudades', CABECERAS: u'Otras cabeceras',
+                 RURAL: u'Rural'}
+
+
+def zonas(clase, area):
+    clase = np.asarray(clase)
+    area = np.asarray(area)
+    zona = np.full(len(clase), FALTANTE, dtype=np.int8)
+    zona[(clase == 2) & (area == 12344)] = RURAL
+    zona[(clase == 1) & (area == 12344)] = CABECERAS
+    zona[area != 12344] = CIUDADES
+    return zona
+
+
+def codificar(valores):
+    """(codigos, grupo): valores distintos y el indice de cada persona.
+
+    Los faltantes (``FALTANTE`` o NaN) forman su propio grupo, de modo que
+    los grupos cubren a toda la poblacion.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    valores = np.where(np.isfinite(valores), valores,
+                       FALTANTE).astype(np.int64)
+    minimo = valores.min() if len(valores) else 0
+    codigos = np.flatnonzero(np.bincount(valores - minimo))
+    indice = np.zeros(codigos[-1] + 1 if len(codigos) else 1,
+                      dtype=np.int16)
+    indice[codigos] = np.arange(len(codigos))
+    return codigos + minimo, indice[valores - minimo]
+
+
+def _medianas(y_ord, pesos_ord, grupo_ord, n):
+    # personas por grupo, ordenadas por ingreso dentro de cada grupo
+    reagrupado = np.argsort(grupo_ord, kind='stable')
+    peso_acum = np.concatenate([[0], np.cumsum(pesos_ord[reagrupado])])
+    conteos = np.bincount(grupo_ord, minlength=n)
+    fin = np.cumsum(conteos)
+    inicio = fin - conteos
+    total = peso_acum[fin] - peso_acum[inicio]
+    # primer valor de cada grupo cuyo peso acumulado alcanza la mitad
+    idx = np.searchsorted(peso_acum, peso_acum[inicio] + 0.5 * total,
+                          side='left') - 1
+    idx = np.clip(idx, inicio, np.maximum(fin - 1, inicio))
+    medianas = y_ord[reagrupado[np.minimum(idx, len(reagrupado) - 1)]]
+    return np.where(total > 0, medianas, np.nan)
+
+
+class Descomposicion:
+    """Indicadores por subgrupo de un vector de ingreso.
+
+    ``lineas`` y ``peso_pobreza`` son los de ``pobreza.IndicadoresPobreza``.
+    Como ``engine.ShockEngine``, los indices se pueden guardar con
+    ``estado()`` y recuperar con ``desde_estado``.
+    """
+
+    ESTADO = ('celda',) + tuple(prefijo + dimension
+                                for dimension in DIMENSIONES
+                                for prefijo in ('codigos_', 'grupo_'))
+
+    def __init__(self, datos, pesos, lineas, peso_pobreza):
+        valores = {'sector': datos['sector'],
+                   'tipo_empresa': datos['tipo_empresa'],
+                   'zona': zonas(datos['CLASE_per'], datos['AREA_per']),
+                   'cat_dom': datos['cat_dom']}
+        estado = {}
+        celda = np.zeros(len(pesos), dtype=np.intp)
+        for dimension in DIMENSIONES:
+            codigos, grupo = codificar(valores[dimension])
+            estado['codigos_' + dimension] = codigos
+            estado['grupo_' + dimension] = grupo
+            celda *= len(codigos)
+            celda += grupo
+        estado['celda'] = celda
+        self._usar(estado, pesos, lineas, peso_pobreza)
+
+    @classmethod
+    def desde_estado(cls, estado, pesos, lineas, peso_pobreza):
+        descomposicion = cls.__new__(cls)
+        descomposicion._usar(estado, pesos, lineas, peso_pobreza)
+        return descomposicion
+
+    def _usar(self, estado, pesos, lineas, peso_pobreza):
+        self._estado = {nombre: estado[nombre] for nombre in self.ESTADO}
+        self.celda = estado['celda']
+        self.grupos = {d: (estado['codigos_' + d], estado['grupo_' + d])
+                       for d in DIMENSIONES}
+        self.pesos = np.asarray(pesos, dtype=np.float64)
+        self.lineas = lineas
+        self.peso_pobreza = peso_pobreza
+        # grupo de cada celda en cada dimension
+        forma = tuple(len(codigos) for codigos, _ in self.grupos.values())
+        self.n_celdas = int(np.prod(forma))
+        self.grupo_celda = dict(zip(DIMENSIONES, np.unravel_index(
+            np.arange(self.n_celdas), forma)))
+
+    def estado(self):
+        return dict(self._estado)
+
+    def calcular(self, ingreso, orden):
+        """dimension -> indicadores por grupo, y el Theil total.
+
+        ``orden`` son los indices que ordenan ``ingreso`` (ver
+        ``quantiles.sort_order``). Cada dimension tiene, por grupo:
+        ``poblacion`` (%), ``pobreza`` (%), ``aporte_pobreza`` (puntos de la
+        pobreza total), ``mediana``, ``media``, ``theil`` (dentro del
+        grupo) y las contribuciones ``dentro`` y ``entre`` al Theil total.
+        """
+        y = np.asarray(ingreso, dtype=np.float64)
+        valido = np.isfinite(y)
+        w = np.where(valido, self.pesos, 0)
+        y = np.where(valido, y, 0)
+        wy = w * y
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wylny = np.where(y > 0, wy * np.log(y), 0)
+        sumas_celda = np.stack([
+            np.bincount(self.celda, weights=v, minlength=self.n_celdas)
+            for v in (w, wy, wylny, self.peso_pobreza * (y < self.lineas),
+                      self.peso_pobreza)])
+        total_peso, total_y, total_ylny, _, total_pobreza = \
+            sumas_celda.sum(axis=1)
+        media = total_y / total_peso
+        theil = total_ylny / total_y - np.log(media)
+
+        # ingreso y pesos en el orden del ingreso, para las medianas
+        y_ord, w_ord = y[orden], w[orden]
+
+        resultados = {'theil': theil}
+        for dimension, (codigos, grupo) in self.grupos.items():
+            n = len(codigos)
+            peso, suma_y, suma_ylny, pobres, peso_pobreza = (
+                np.bincount(self.grupo_celda[dimension], weights=s,
+                            minlength=n)
+                for s in sumas_celda)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                media_g = suma_y / peso
+                theil_g = suma_ylny / suma_y - np.log(media_g)
+                participacion = suma_y / total_y
+                resultados[dimension] = {
+                    'codigos': codigos,
+                    'poblacion': 100 * peso / total_peso,
+                    'pobreza': 100 * pobres / peso_pobreza,
+                    'aporte_pobreza': 100 * pobres / total_pobreza,
+                    'mediana': _medianas(y_ord, w_ord, grupo[orden], n),
+                    'media': media_g,
+                    'theil': theil_g,
+                    'dentro': np.where(suma_y > 0,
+                                       participacion * theil_g, 0),
+                    'entre': np.where(suma_y > 0, participacion *
+                                      np.log(media_g / media), 0)}
+        return resultados
@@ -0,0 +1,186 @@
+"""Motor vectorizado para el calculo del ingreso per capita con choque.
+
+Reemplaza la ruta de ``functions.update_income`` (copia del DataFrame,
+asignaciones con ``.loc``, ``groupby`` y ``merge``) por arreglos de NumPy
+precalculados una sola vez al iniciar la aplicacion.
+"""
+import numpy as np
+import pandas as pd
+
+HOGAR_KEYS = ['DIRECTORIO', 'SECUENCIA_P', 'HOGAR']
+COMPONENTES = ['IMPA_y', 'IE_y', 'ISA_y', 'IOF_y', 'IMDI_y']
+
+# reglas de elegibilidad del ingreso (mismo orden de precedencia que
+# update_income: la ultima regla que aplica es la que cuenta)
+REGLA_CERO = 0            # P6050 in (6, 7, 8) o menores de edad
+REGLA_COMPLETA = 1        # IMPA + IE + ISA + IOF
+REGLA_SIN_IE = 2          # P6430 in (4, 5): IMPA + ISA + IOF
+REGLA_TRANSFERENCIAS = 3  # P6430 == 6: ISA + IOF
+REGLA_DESOCUPADO = 4      # DSI == 1 o INI == 1: IMDI + IOF
+
+# componentes que suma cada regla (filas: regla, columnas: COMPONENTES)
+SELECCION = np.array([[0, 0, 0, 0, 0],
+                      [1, 1, 1, 1, 0],
+                      [1, 0, 1, 1, 0],
+                      [0, 0, 1, 1, 0],
+                      [0, 0, 0, 1, 1]], dtype=np.float64)
+
+
+def _columna(datos, col):
+    return np.asarray(datos[col])
+
+
+def codigos_hogar(datos):
+    claves = pd.DataFrame({k: _columna(datos, k) for k in HOGAR_KEYS})
+    codigos = claves.groupby(HOGAR_KEYS, sort=False).ngroup().to_numpy()
+    return codigos.astype(np.int64), int(codigos.max()) + 1
+
+
+def reglas_ingreso(datos):
+    p6430 = _columna(datos, 'P6430')
+    p6050 = pd.to_numeric(pd.Series(_columna(datos, 'P6050')),
+                          errors='coerce').to_numpy()
+    edad = _columna(datos, 'edad')
+
+    regla = np.full(len(p6430), REGLA_COMPLETA, dtype=np.int8)
+    regla[(p6430 == 4) | (p6430 == 5)] = REGLA_SIN_IE
+    regla[p6430 == 6] = REGLA_TRANSFERENCIAS
+    regla[(_columna(datos, 'DSI') == 1) |
+          (_columna(datos, 'INI') == 1)] = REGLA_DESOCUPADO
+    regla[(p6050 == 6) | (p6050 == 7) | (p6050 == 8)] = REGLA_CERO
+    regla[(edad < 10) & (_columna(datos, 'CLASE_per') == 2)] = REGLA_CERO
+    regla[(edad < 12) & (_columna(datos, 'AREA_per') != 12344)] = REGLA_CERO
+    return regla
+
+
+class ShockEngine:
+    """Ingreso per capita del hogar bajo un choque al ingreso laboral.
+
+    Todo lo que no depende del escenario (codigos de hogar, componentes
+    del ingreso, regla de elegibilidad y la parte del ingreso que no se
+    ve afectada por el choque) se calcula en el constructor. Un escenario
+    solo requiere un ``bincount`` sobre las personas en riesgo.
+
+    ``estado()`` devuelve los arreglos precalculados y ``desde_estado`` los
+    vuelve a convertir en un motor sin recalcular nada (ver artefactos.py).
+    """
+
+    ESTADO = ('hogar', 'personas', 'impa_efectivo', 'iug_base',
+              'ingreso_base', 'orden_hogar', 'tamano_hogar', 'inicio_hogar')
+
+    def __init__(self, datos):
+        self.hogar, self.n_hogares = codigos_hogar(datos)
+        componentes = np.column_stack(
+            [_columna(datos, c) for c in COMPONENTES]).astype(np.float64)
+        np.nan_to_num(componentes, copy=False)
+        regla = reglas_ingreso(datos)
+        arriendo = _columna(datos, 'arriendo_estimado').astype(np.float64)
+        self.personas = _columna(datos, 'personas_hogar').astype(np.float64)
+
+        seleccion = SELECCION[regla]
+        # IMPA que efectivamente entra al ingreso total de cada persona
+        self.impa_efectivo = componentes[:, 0] * seleccion[:, 0]
+        it_base = (componentes * seleccion).sum(axis=1)
+        self.iug_base = np.bincount(self.hogar, weights=it_base,
+                                    minlength=self.n_hogares)
+        self.ingreso_base = ((self.iug_base[self.hogar] + arriendo) /
+                             self.personas)
+
+        # indice hogar -> personas (las personas del hogar h son
+        # orden_hogar[inicio_hogar[h]:inicio_hogar[h] + tamano_hogar[h]])
+        self.orden_hogar = np.argsort(self.hogar, kind='stable')
+        self.tamano_hogar = np.bincount(self.hogar, minlength=self.n_hogares)
+        self.inicio_hogar = np.cumsum(self.tamano_hogar) - self.tamano_hogar
+
+    def estado(self):
+        return {nombre: getattr(self, nombre) for nombre in self.ESTADO}
+
+    @classmethod
+    def desde_estado(cls, estado):
+        engine = cls.__new__(cls)
+        for nombre in cls.ESTADO:
+            setattr(engine, nombre, estado[nombre])
+        engine.n_hogares = len(engine.iug_base)
+        return engine
+
+    def __len__(self):
+        return len(self.hogar)
+
+    def perdida_hogar(self, riesgo, factor=None):
+        """IMPA total de las personas en riesgo, agregado por hogar.
+
+        ``riesgo`` es una mascara o los indices de las personas en riesgo;
+        ``factor`` multiplica el IMPA de cada una (en el orden de
+        ``riesgo``).
+        """
+        riesgo = np.asarray(riesgo)
+        impa = self.impa_efectivo[riesgo]
+        if factor is not None:
+            impa = impa * factor
+        return np.bincount(self.hogar[riesgo], weights=impa,
+                           minlength=self.n_hogares)
+
+    def personas_de(self, hogares):
+        """Indices de todas las personas de los ``hogares`` dados."""
+        tamano = self.tamano_hogar[hogares]
+        desplazamiento = np.repeat(self.inicio_hogar[hogares] -
+                                   np.cumsum(tamano) + tamano, tamano)
+        return self.orden_hogar[desplazamiento + np.arange(tamano.sum())]
+
+    def perdida_por_persona(self, riesgo, factor=None):
+        """Personas afectadas y su perdida de ingreso per capita.
+
+        ``riesgo`` es la mascara de las personas en riesgo o sus indices
+        (ver ``indice.IndiceRiesgo.personas``). Devuelve
+        ``(personas, perdida)``: los indices de las personas de hogares con
+        al menos una persona en riesgo con IMPA, y la perdida per capita de
+        su hogar con un choque de 100%. El ingreso con un choque ``s`` es
+        ``ingreso_base[personas] - s / 100 * perdida``. Con ``factor`` (uno
+        por persona en riesgo, como en ``perdida_hogar``) la perdida es la
+        del IMPA multiplicado por ``factor``.
+        """
+        riesgo = np.asarray(riesgo)
+        en_riesgo = (np.flatnonzero(riesgo) if riesgo.dtype == bool
+                     else riesgo)
+        con_impa = self.impa_efectivo[en_riesgo] != 0
+        en_riesgo = en_riesgo[con_impa]
+        impa = self.impa_efectivo[en_riesgo]
+        if factor is not None:
+            impa = impa * np.asarray(factor)[con_impa]
+        hogares, posicion = np.unique(self.hogar[en_riesgo],
+                                      return_inverse=True)
+        perdida = np.bincount(posicion, weights=impa,
+                              minlength=len(hogares))
+        personas = self.personas_de(hogares)
+        perdida = perdida[np.searchsorted(hogares, self.hogar[personas])]
+        return personas, perdida / self.personas[personas]
+
+    def ingreso_choque_parcial(self, riesgo, shock):
+        """Solo las personas cuyo ingreso cambia con el choque.
+
+        Devuelve ``(personas, ingreso)``. El costo depende del numero de
+        hogares afectados, no del tamano de la encuesta. ``shock`` es como
+        en ``ingreso_choque``.
+        """
+        if np.ndim(shock):
+            personas, perdida = self.perdida_por_persona(
+                riesgo, np.asarray(shock) / 100)
+            shock = 100
+        else:
+            personas, perdida = self.perdida_por_persona(riesgo)
+        return personas, (self.ingreso_base[personas] -
+                          (shock / 100) * perdida)
+
+    def ingreso_choque(self, riesgo, shock):
+        """Equivalente vectorizado de ``ING_pc_choque_arriendo``.
+
+        ``shock`` es el choque (%) de todas las personas en riesgo o uno
+        por persona en riesgo, en el orden de ``riesgo`` (ver choques.py).
+        """
+        if np.ndim(shock):
+            perdida = self.perdida_hogar(riesgo, np.asarray(shock) / 100)
+            shock = 100
+        else:
+            perdida = self.perdida_hogar(riesgo)
+        return self.ingreso_base - ((shock / 100) * perdida[self.hogar] /
+                                    self.personas)
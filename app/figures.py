@@ -0,0 +1,143 @@
+"""Construccion de figuras como diccionarios, sin estado compartido.
+
+Cada callback arma una figura nueva a partir de los trazos de la
+distribucion original (que se construyen una sola vez y nunca se
+modifican) y de los arreglos del escenario. No hay objetos ``go.Figure``
+globales que dos usuarios puedan modificar al mismo tiempo.
+
+Las figuras del histograma y de Lorenz se arman en el navegador
+(``assets/figuras.js``): los trazos originales, los estilos y las lineas de
+referencia se envian una sola vez con el layout (``figuras_base``) y cada
+escenario solo envia las curvas del choque, redondeadas
+(``datos_choque``).
+"""
+import numpy as np
+
+################################
+# colors
+################################
+
+grey = '#f7f4eb'
+teal = '#3C7A89'
+purple = '#37123C'
+rose = '#945D5E'
+naranja = '#edb183'
+naranja_fill = '#ffdcc2'
+black = '#001514'
+
+LAYOUT_HISTOGRAMA = {
+    'title': {'text': u"Distribución del ingreso, pobreza y vulnerabilidad"},
+    'xaxis': {'title': {'text': u"Ingreso Per Cápita"},
+              'range': [0, 1000000]},
+    'yaxis': {'visible': False},
+    'plot_bgcolor': 'white',
+    'paper_bgcolor': 'white',
+    'font': {'color': 'grey'}
+}
+
+LAYOUT_LORENZ = {
+    'title': {'text': u"Curva de Lorenz"},
+    'xaxis': {'title': {'text': "Porcentaje acumulado de personas"}},
+    'yaxis': {'title': {'text': "Porcentaje acumulado del ingreso"}},
+    'plot_bgcolor': 'white',
+    'paper_bgcolor': 'white',
+    'font': {'color': 'grey'},
+    'showlegend': True
+}
+
+# tres paneles apilados que comparten el eje del choque
+LAYOUT_BARRIDO = {
+    'title': {'text': u"Sensibilidad a la magnitud del choque"},
+    'xaxis': {'title': {'text': u"Magnitud del choque (%)"},
+              'range': [0, 100]},
+    'yaxis': {'title': {'text': u"Pobreza (%)"}, 'domain': [0.7, 1]},
+    'yaxis2': {'title': {'text': u"Mediana (COP)"}, 'domain': [0.35, 0.65]},
+    'yaxis3': {'title': {'text': u"Gini"}, 'domain': [0, 0.3]},
+    'plot_bgcolor': 'white',
+    'paper_bgcolor': 'white',
+    'font': {'color': 'grey'},
+    'showlegend': False,
+    'height': 700
+}
+
+IGUALDAD = {'type': 'scatter', 'x': [0, 1], 'y': [0, 1], 'mode': 'lines',
+            'name': u'Igualdad total',
+            'line': {'color': 'grey', 'dash': 'dashdot'}}
+
+
+def trazo(x, y, nombre, **estilo):
+    return dict(type='scatter', mode='lines', x=x, y=y, name=nombre,
+                **estilo)
+
+
+def trazo_original(x, y):
+    return trazo(x, y, u'Distribución Original', line={'color': black})
+
+
+def trazo_choque(x, y, relleno=False):
+    estilo = {'line': {'color': naranja}}
+    if relleno:
+        estilo.update(fill='tozeroy', fillcolor='rgba(237,177,131,0.5)')
+    return trazo(x, y, u'Distribución Choque', **estilo)
+
+
+def figura_histograma(original, choque=None, lineas=None, nombres=None):
+    """Densidad original (y la del choque, si hay) con lineas de referencia.
+
+    ``lineas`` y ``nombres`` son las salidas de
+    ``functions.generate_reference_lines``.
+    """
+    data = [original] if choque is None else [choque, original]
+    layout = dict(LAYOUT_HISTOGRAMA, shapes=lineas or [],
+                  annotations=nombres or [])
+    return {'data': data, 'layout': layout}
+
+
+def figura_lorenz(original, choque=None):
+    data = [IGUALDAD, original] if choque is None else [IGUALDAD, choque,
+                                                        original]
+    return {'data': data, 'layout': LAYOUT_LORENZ}
+
+
+def figura_barrido(barrido=None):
+    """Pobreza, mediana y Gini en funcion del choque (``Modelo.barrido``)."""
+    if barrido is None:
+        return {'data': [], 'layout': LAYOUT_BARRIDO}
+    niveles = barrido['niveles']
+    data = [trazo(niveles, barrido[medida], nombre, yaxis=eje,
+                  line={'color': color})
+            for medida, nombre, eje, color in [
+                ('pobreza', u'Pobreza', 'y', rose),
+                ('mediana', u'Mediana', 'y2', teal),
+                ('gini', u'Gini', 'y3', purple)]]
+    return {'data': data, 'layout': LAYOUT_BARRIDO}
+
+
+# la densidad del choque se envia como enteros entre 0 y NIVELES_DENSIDAD
+# (relativos a su maximo) y la curva de Lorenz con DECIMALES_LORENZ
+NIVELES_DENSIDAD = 10000
+DECIMALES_LORENZ = 4
+
+
+def figuras_base(trazo_histograma, trazo_lorenz, lineas_referencia):
+    """Todo lo que el navegador necesita una sola vez para las figuras.
+
+    ``lineas_referencia`` asocia cada valor del checklist de lineas con
+    su par ``(lineas, nombres)`` de ``functions.generate_reference_lines``.
+    """
+    return {'histograma': figura_histograma(trazo_histograma),
+            'lorenz': figura_lorenz(trazo_lorenz),
+            'choque_histograma': trazo_choque(None, None, relleno=True),
+            'choque_lorenz': trazo_choque(None, None),
+            'lineas': lineas_referencia}
+
+
+def datos_choque(densidad, lorenz):
+    """Curvas del choque en forma compacta (ver ``assets/figuras.js``)."""
+    densidad = np.asarray(densidad, dtype=np.float64)
+    maximo = densidad.max() if len(densidad) and densidad.max() > 0 else 1.0
+    return {'escala': maximo / NIVELES_DENSIDAD,
+            'densidad': np.rint(densidad / maximo *
+                                NIVELES_DENSIDAD).astype(int).tolist(),
+            'lorenz': np.round(np.asarray(lorenz, dtype=np.float64),
+                               DECIMALES_LORENZ).tolist()}
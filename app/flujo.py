@@ -0,0 +1,246 @@
+"""Evaluacion por bloques de hogares, sin cargar la encuesta completa.
+
+``Modelo`` necesita todas las columnas de la encuesta y su linea base en
+memoria, lo que no escala a la GEIH completa (decenas de millones de
+personas). ``evaluar`` recorre en cambio la encuesta (directorio columnar o
+CSV, ver datos.py) en bloques de unas ``FILAS`` personas alineados por
+hogar: un hogar (DIRECTORIO, SECUENCIA_P, HOGAR) nunca queda repartido
+entre dos bloques, asi que ``engine.ShockEngine`` calcula el ingreso per
+capita de cada bloque como si fuera la encuesta completa. Cada bloque
+aporta sumas que se pueden combinar (``agregados.Agregados``: binning de la
+densidad, histogramas de pesos e ingreso para cuantiles y Lorenz, momentos
+y sumas de pobreza), de modo que la memoria depende del tamano del bloque
+y no del de la encuesta.
+
+Se hacen dos pasadas. La primera (``referencia``) fija la grilla (maximo
+del ingreso y ancho de banda de referencia, como en ``Modelo``) y los
+dominios de pobreza. La segunda acumula los agregados de la distribucion
+original y de todos los escenarios a la vez; en cada bloque, como en el
+modo delta, un escenario solo recorre los hogares que afecta. Los
+resultados son los del modo delta: densidad, cuantiles y Lorenz
+aproximados por binning y pobreza exacta.
+
+Los hogares deben estar contiguos, asi que se exige que la encuesta este
+ordenada por DIRECTORIO, SECUENCIA_P y HOGAR (como viene la GEIH).
+"""
+import json
+import os
+from os import environ
+
+import numpy as np
+import pandas as pd
+
+from agregados import GrillaAgregados
+from choques import TablaChoques
+from datos import COLUMNAS_CSV, compactar
+from engine import HOGAR_KEYS, ShockEngine
+from indice import IndiceRiesgo
+from kde import bandwidth_factor
+from modelo import SIN_CHOQUE
+from pobreza import TOTAL, IndicadoresPobreza, resultados_pobreza
+
+FILAS = int(environ.get('STREAM_CHUNK_ROWS', '1000000'))
+
+
+# ----------------------------
+# Bloques alineados por hogar
+# ----------------------------
+
+def _claves(columnas):
+    return np.column_stack([np.asarray(columnas[k], dtype=np.int64)
+                            for k in HOGAR_KEYS])
+
+
+def _verificar_orden(claves, anterior=None):
+    # orden lexicografico de (DIRECTORIO, SECUENCIA_P, HOGAR): la primera
+    # diferencia no nula entre filas consecutivas no puede ser negativa
+    if anterior is not None:
+        claves = np.vstack([anterior, claves])
+    diferencias = np.diff(claves, axis=0)
+    primera = diferencias[np.arange(len(diferencias)),
+                          np.argmax(diferencias != 0, axis=1)]
+    if (primera < 0).any():
+        raise ValueError('la encuesta debe estar ordenada por {}'.format(
+            ', '.join(HOGAR_KEYS)))
+
+
+def _bloques_columnar(destino, filas):
+    with open(os.path.join(destino, 'meta.json')) as f:
+        meta = json.load(f)
+
+    def leer(columnas, inicio, fin):
+        # un mmap por lectura: las paginas de bloques anteriores no quedan
+        # mapeadas en el proceso
+        bloque = {}
+        for col in columnas:
+            mapa = np.load(os.path.join(destino, col + '.npy'),
+                           mmap_mode='r')
+            bloque[col] = np.array(mapa[inicio:fin])
+            del mapa
+        return bloque
+
+    inicio, n = 0, meta['filas']
+    while inicio < n:
+        fin = min(inicio + filas, n)
+        # se extiende hasta el final del hogar de la fila fin - 1
+        while fin < n:
+            siguiente = min(fin + 64, n)
+            claves = _claves(leer(HOGAR_KEYS, fin - 1, siguiente))
+            cambia = np.flatnonzero((claves[1:] != claves[0]).any(axis=1))
+            if len(cambia):
+                fin += cambia[0]
+                break
+            fin = siguiente
+        yield leer(meta['tipos'], inicio, fin)
+        inicio = fin
+
+
+def _bloques_csv(ruta, filas):
+    resto = None
+    for parte in pd.read_csv(ruta, usecols=COLUMNAS_CSV, chunksize=filas):
+        if resto is not None:
+            parte = pd.concat([resto, parte], ignore_index=True)
+        # el ultimo hogar puede seguir en la siguiente parte del archivo
+        claves = _claves(parte)
+        otros = np.flatnonzero((claves != claves[-1]).any(axis=1))
+        corte = otros[-1] + 1 if len(otros) else 0
+        resto = parte.iloc[corte:]
+        if corte:
+            yield compactar(parte.iloc[:corte])
+    if resto is not None and len(resto):
+        yield compactar(resto)
+
+
+def bloques(ruta, filas=FILAS):
+    """Bloques (columna -> arreglo) de ~``filas`` personas, sin partir
+    hogares. ``ruta`` es como en ``datos.cargar_datos``."""
+    base = ruta[:-4] if ruta.endswith('.csv') else ruta
+    if os.path.isfile(os.path.join(base, 'meta.json')):
+        partes = _bloques_columnar(base, filas)
+    else:
+        partes = _bloques_csv(base + '.csv', filas)
+    anterior = None
+    for bloque in partes:
+        claves = _claves(bloque)
+        _verificar_orden(claves, anterior)
+        anterior = claves[-1:]
+        yield bloque
+
+
+def _valores(bloque):
+    return (np.asarray(bloque['fac_exp_ind_12m'], dtype=np.float64),
+            np.asarray(bloque['ING_pc_bl_def_arriendo'], dtype=np.float64))
+
+
+# ----------------------------
+# Evaluacion
+# ----------------------------
+
+def referencia(ruta, filas=FILAS, n_puntos=1000, bw_method='scott'):
+    """Primera pasada: grilla de agregados y dominios de pobreza."""
+    maximo = -np.inf
+    momentos = np.zeros(4)
+    centro = None
+    dominios = np.zeros(0, dtype=np.int64)
+    personas = 0
+    for bloque in bloques(ruta, filas):
+        pesos, original = _valores(bloque)
+        personas += len(pesos)
+        maximo = max(maximo, np.nanmax(original))
+        base = ShockEngine(bloque).ingreso_base
+        finito = np.isfinite(base)
+        y, w = base[finito], pesos[finito]
+        # momentos alrededor de la media del primer bloque (estabilidad)
+        if centro is None:
+            centro = np.average(y, weights=w)
+        d = y - centro
+        momentos += [w.sum(), (w * d).sum(), (w * d * d).sum(),
+                     (w * w).sum()]
+        cat_dom = np.asarray(bloque['cat_dom'], dtype=np.float64)
+        dominios = np.union1d(dominios, cat_dom[np.isfinite(cat_dom) &
+                                                (cat_dom >= 0)])
+
+    # ancho de banda de kde.kde_bandwidth sobre el ingreso sin choque
+    s0, s1, s2, sw2 = momentos
+    varianza = (s2 / s0 - (s1 / s0) ** 2) / (1 - sw2 / s0 ** 2)
+    h = np.sqrt(varianza) * bandwidth_factor(s0 ** 2 / sw2, bw_method)
+    grilla = GrillaAgregados(np.linspace(0, maximo, n_puntos), h,
+                             centro=centro + s1 / s0, bw_method=bw_method)
+    return {'grilla': grilla, 'dominios': dominios.astype(np.int64),
+            'personas': personas}
+
+
+def _resultados(grilla, agregados, dominios, en_riesgo=0):
+    resultados = grilla.resultados(agregados)
+    pobreza = resultados_pobreza(agregados.pobreza, dominios)
+    resultados.update(pobreza=pobreza['pobreza'], pobreza_detalle=pobreza,
+                      en_riesgo=en_riesgo)
+    return resultados
+
+
+def evaluar(ruta, escenarios, filas=FILAS, n_puntos=1000, ref=None):
+    """Resultados de la distribucion original y de cada escenario.
+
+    Devuelve ``{'original': ..., 'escenarios': [...], 'bloques': n}`` con
+    las mismas salidas de ``Modelo.evaluar_delta``; un escenario que falla
+    no detiene la pasada y su lugar lo ocupa la excepcion. ``ref`` es la
+    salida de ``referencia`` (se calcula si es None).
+    """
+    ref = referencia(ruta, filas, n_puntos) if ref is None else ref
+    grilla, dominios = ref['grilla'], ref['dominios']
+    con_tabla = any(escenario.tabla for escenario in escenarios)
+
+    original = base = None
+    cambios = [None] * len(escenarios)
+    en_riesgo = np.zeros(len(escenarios), dtype=np.int64)
+    n_bloques = 0
+    for bloque in bloques(ruta, filas):
+        n_bloques += 1
+        pesos, ingreso_original = _valores(bloque)
+        engine = ShockEngine(bloque)
+        indicadores = IndicadoresPobreza(bloque['CLASE_per'],
+                                         bloque['AREA_per'],
+                                         bloque['cat_dom'], pesos)
+        # columnas de los dominios del bloque entre todos los dominios
+        columnas = np.searchsorted(dominios, indicadores.dominios)
+
+        def agregar(ingreso, personas=None):
+            sumas = np.zeros((TOTAL + 1, len(dominios)))
+            sumas[:, columnas] = indicadores.sumas(ingreso, personas)
+            w = pesos if personas is None else pesos[personas]
+            return grilla.agregar(ingreso, w, sumas)
+
+        original = _sumar(original, agregar(ingreso_original))
+        base = _sumar(base, agregar(engine.ingreso_base))
+
+        indice = IndiceRiesgo(bloque, engine.hogar)
+        tabla = TablaChoques(bloque) if con_tabla else None
+        for i, escenario in enumerate(escenarios):
+            if escenario == SIN_CHOQUE or isinstance(cambios[i], Exception):
+                continue
+            try:
+                riesgo = indice.personas(escenario)
+                shock = (tabla.por_persona(escenario, riesgo)
+                         if escenario.tabla else escenario.shock)
+                personas, ingreso = engine.ingreso_choque_parcial(riesgo,
+                                                                  shock)
+                cambio = (agregar(ingreso, personas) -
+                          agregar(engine.ingreso_base[personas], personas))
+            except Exception as error:
+                cambios[i] = error
+                continue
+            en_riesgo[i] += len(riesgo)
+            cambios[i] = _sumar(cambios[i], cambio)
+
+    return {'original': _resultados(grilla, original, dominios),
+            'escenarios': [
+                cambio if isinstance(cambio, Exception) else
+                _resultados(grilla, _sumar(base, cambio), dominios, int(n))
+                for cambio, n in zip(cambios, en_riesgo)],
+            'bloques': n_bloques}
+
+
+def _sumar(total, agregados):
+    if agregados is None:
+        return total
+    return agregados if total is None else total + agregados
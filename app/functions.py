@@ -1,12 +1,19 @@
 import pandas as pd
 import numpy as np
+from quantiles import weighted_quantiles
+from pobreza import IndicadoresPobreza
 
 teal = '#3C7A89'
 def update_income(df_shock, shock):
-    # cambio del ingreso para hogares en riesgo
+    # cambio del ingreso para hogares en riesgo. shock es un porcentaje o
+    # un arreglo con el de cada fila (tabla de choques, ver choques.py)
     df_shock['IMPA_choque'] = df_shock.IMPA_y
-    df_shock.loc[(df_shock.riesgo == 1), 'IMPA_choque'] = (1-(shock/100)) * \
-                                                          df_shock.IMPA_choque
+    riesgo = (df_shock.riesgo == 1).to_numpy()
+    factor = 1 - np.asarray(shock, dtype=np.float64) / 100
+    if factor.ndim:
+        factor = factor[riesgo]
+    df_shock.loc[riesgo, 'IMPA_choque'] = factor * \
+                                          df_shock.IMPA_choque[riesgo]
 
     # calculo de ingreso per capita
     df_shock.loc[((df_shock.P6430 != 4) & (df_shock.P6430 != 5) & (
@@ -55,12 +62,10 @@ def update_income(df_shock, shock):
 
     return df_shock
 
-def weighted_median(df, x_col, weigths_col):
-    df.sort_values(x_col, inplace=True)
-    cumsum = df[weigths_col].cumsum()
-    cutoff = df[weigths_col].sum() / 2.0
-    median = df[x_col][cumsum >= cutoff].iloc[0]
-    return median
+def weighted_median(df, x_col, weigths_col, orden=None):
+    # no modifica df (antes se ordenaba en el mismo frame)
+    return weighted_quantiles(df[x_col].to_numpy(),
+                              df[weigths_col].to_numpy(), 0.5, orden=orden)
 
 def generate_reference_lines(reference_lines, dist_original):
     lines = []
@@ -134,30 +139,8 @@ def generate_reference_lines(reference_lines, dist_original):
     return lines, names
 
 def calculo_pobreza(df, col_ingreso):
-    l_ciudad = 294897.29
-    l_cab = 294285.32
-    l_resto = 175783.22
-
-    df.loc[((df[col_ingreso] < l_resto) &
-            (df.CLASE_per == 2) &
-            (df.AREA_per == 12344)), 'pobreza_nuevo_arr'] = 1
-
-    df.loc[((df[col_ingreso] < l_cab) &
-            (df.CLASE_per == 1) &
-            (df.AREA_per == 12344)), 'pobreza_nuevo_arr'] = 1
-
-    df.loc[((df[col_ingreso] < l_ciudad) &
-            (df.AREA_per != 12344)), 'pobreza_nuevo_arr'] = 1
-
-    df.pobreza_nuevo_arr = df.pobreza_nuevo_arr.fillna(value=0)
-
-    t_temp = pd.crosstab(df.pobreza_nuevo_arr, df.cat_dom,
-                         df.fac_exp_ind_12m, aggfunc='sum',
-                         dropna=True)
-
-    t_temp = t_temp.fillna(value=0)
-    t_temp = t_temp.append(t_temp.sum().rename('Total'))
-    t_temp['Total'] = t_temp.sum(axis=1)
-    pobreza = (t_temp.Total.iloc[1]/t_temp.Total.iloc[2])*100
-
-    return pobreza
\ No newline at end of file
+    # indice de pobreza (%) sin modificar df (ver pobreza.py para los demas
+    # indicadores y el desglose por cat_dom)
+    indicadores = IndicadoresPobreza(df.CLASE_per, df.AREA_per, df.cat_dom,
+                                     df.fac_exp_ind_12m)
+    return indicadores.calcular(df[col_ingreso].to_numpy())['pobreza']
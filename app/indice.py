@@ -0,0 +1,114 @@
+"""Indice de mapas de bits para seleccionar a las personas en riesgo.
+
+Los selectores de la interfaz tienen dominios pequenos y cerrados (17
+sectores, 4 tamanos de empresa y dos indicadores binarios). Al cargar los
+datos se construye, para cada valor de cada selector, la mascara de las
+personas con ese valor empaquetada en palabras de 64 bits. La mascara de
+riesgo de un escenario sale de unas pocas operaciones OR/AND sobre
+``n / 64`` palabras, en lugar de comparar las cuatro columnas completas.
+
+Con tabla de choques (ver choques.py) tambien estan en riesgo las personas
+de las celdas de cada fila, aunque no esten en la seleccion general.
+"""
+import numpy as np
+
+from datos import FALTANTE
+
+SELECTORES = ('sector', 'tipo_empresa', 'informales', 'cuenta_propia')
+PALABRA = 64
+
+
+def empaquetar(mascara):
+    """Mascara booleana -> palabras ``uint64`` (bit ``i`` = persona ``i``)."""
+    empaquetado = np.packbits(np.asarray(mascara, dtype=bool))
+    relleno = np.zeros(-len(empaquetado) % (PALABRA // 8), dtype=np.uint8)
+    return np.concatenate([empaquetado, relleno]).view(np.uint64)
+
+
+def desempaquetar(palabras, n):
+    """Inverso de ``empaquetar`` para ``n`` personas."""
+    return np.unpackbits(palabras.view(np.uint8), count=n).view(bool)
+
+
+class IndiceRiesgo:
+    """Mapas de bits por valor de cada selector del escenario.
+
+    ``hogar`` es el codigo de hogar de cada persona (el de
+    ``engine.ShockEngine``). Como los demas indices de la linea base, se
+    guarda con ``estado()`` y se recupera con ``desde_estado``.
+    """
+
+    ESTADO = tuple(prefijo + selector for selector in SELECTORES
+                   for prefijo in ('codigos_', 'bits_'))
+
+    def __init__(self, datos, hogar):
+        estado = {}
+        for selector in SELECTORES:
+            valores = np.asarray(datos[selector], dtype=np.float64)
+            codigos = np.unique(valores[np.isfinite(valores) &
+                                        (valores != FALTANTE)])
+            estado['codigos_' + selector] = codigos.astype(np.int64)
+            estado['bits_' + selector] = np.stack(
+                [empaquetar(valores == codigo) for codigo in codigos]
+            ) if len(codigos) else np.zeros((0, 0), dtype=np.uint64)
+        self._usar(estado, hogar)
+
+    @classmethod
+    def desde_estado(cls, estado, hogar):
+        indice = cls.__new__(cls)
+        indice._usar(estado, hogar)
+        return indice
+
+    def _usar(self, estado, hogar):
+        self._estado = {nombre: estado[nombre] for nombre in self.ESTADO}
+        self.hogar = hogar
+        self.n = len(hogar)
+        self.n_palabras = -(-self.n // PALABRA)
+        self.bits = {s: (estado['codigos_' + s], estado['bits_' + s])
+                     for s in SELECTORES}
+
+    def estado(self):
+        return dict(self._estado)
+
+    def _alguno(self, selector, valores):
+        # OR de los mapas de los valores seleccionados (los valores que no
+        # aparecen en los datos no seleccionan a nadie)
+        codigos, bits = self.bits[selector]
+        filas = np.flatnonzero(np.isin(codigos, valores))
+        if not len(filas):
+            return np.zeros(self.n_palabras, dtype=np.uint64)
+        return np.bitwise_or.reduce(bits[filas], axis=0)
+
+    def _valor(self, selector, valor):
+        # None: cualquier valor registrado del selector
+        if valor is None:
+            return self._alguno(selector, self.bits[selector][0])
+        return self._alguno(selector, [valor])
+
+    def palabras(self, escenario):
+        """Mascara de riesgo empaquetada (ver ``modelo.Modelo.riesgo``).
+
+        Es la seleccion general del escenario mas, con tabla de choques, la
+        union de las celdas (sector, empresa, formalidad) de sus filas.
+        """
+        empresa = () if escenario.empresa is None else [escenario.empresa]
+        palabras = self._alguno('sector', escenario.sectores)
+        palabras &= self._alguno('tipo_empresa', empresa)
+        palabras &= (self._alguno('informales', escenario.formalidad) |
+                     self._alguno('cuenta_propia', escenario.contrato))
+        for sector, empresa, formalidad, _ in escenario.tabla:
+            palabras |= (self._valor('sector', sector) &
+                         self._valor('tipo_empresa', empresa) &
+                         self._valor('informales', formalidad))
+        return palabras
+
+    def mascara(self, escenario):
+        return desempaquetar(self.palabras(escenario), self.n)
+
+    def personas(self, escenario):
+        """Indices (ordenados) de las personas en riesgo."""
+        return np.flatnonzero(self.mascara(escenario))
+
+    def hogares(self, escenario):
+        """Codigos (ordenados) de los hogares con alguien en riesgo."""
+        return np.unique(self.hogar[self.personas(escenario)])
@@ -0,0 +1,181 @@
+"""Evaluacion de escenarios fuera del loop de gevent, en un pool de procesos.
+
+El calculo de un escenario es CPU puro: ejecutarlo dentro del worker de
+gevent bloquea todas las demas conexiones de ese worker. ``ScenarioJobs``
+lo envia a un ``ProcessPoolExecutor`` cuyos procesos se crean con ``fork``
+desde el worker (y por lo tanto ya tienen cargados los mismos modelos). Un
+proceso del pool que recibe un conjunto de datos que no tiene lo carga con
+su copia de ``Conjuntos`` (ver conjuntos.py).
+
+El identificador de un trabajo es la clave del escenario en el cache: el
+proceso que hace el calculo guarda el resultado (o el error, si falla) en
+``ScenarioCache``, de modo que cualquier worker puede responder la consulta
+de estado aunque el trabajo lo haya recibido otro.
+
+El limite de la cola (``SCENARIO_MAX_QUEUED``, por omision cuatro por
+proceso del pool) cuenta grupos de trabajos pendientes: los trabajos de
+una misma sesion (el escenario exacto y sus bloques de replicas) forman un
+solo grupo, y las vistas previas (que toman milisegundos) no cuentan.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import environ
+
+from metricas import perfilar
+
+PROCESOS = int(environ.get('SCENARIO_PROCESSES', '2'))
+MAX_PENDIENTES = int(environ.get('SCENARIO_MAX_QUEUED',
+                                 str(4 * max(1, PROCESOS))))
+TIMEOUT = float(environ.get('SCENARIO_TIMEOUT', '100'))
+# trabajos terminados que se conservan para reportar errores/cancelaciones
+MAX_TERMINADOS = 64
+
+PENDIENTE = 'pendiente'
+LISTO = 'listo'
+ERROR = 'error'
+CANCELADO = 'cancelado'
+
+# estado heredado por los procesos del pool al hacer fork
+_conjuntos = None
+_cache = None
+
+
+class JobsSaturados(Exception):
+    """Hay demasiados trabajos en cola en este worker."""
+
+
+def _calcular(conjuntos, cache, clave, metodo, escenario, conjunto,
+              argumentos=()):
+    try:
+        modelo = conjuntos.modelo(conjunto)
+        resultado = getattr(modelo, metodo)(escenario, *argumentos)
+    except Exception as error:
+        cache.set_error(clave, repr(error))
+        raise
+    cache.set(clave, resultado)
+
+
+def _evaluar(clave, metodo, escenario, conjunto, argumentos=()):
+    with perfilar(metodo):
+        _calcular(_conjuntos, _cache, clave, metodo, escenario, conjunto,
+                  argumentos)
+
+
+class ScenarioJobs:
+
+    def __init__(self, conjuntos, cache, procesos=PROCESOS,
+                 max_pendientes=MAX_PENDIENTES):
+        self.conjuntos = conjuntos
+        self.cache = cache
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._trabajos = {}  # clave -> future
+        self._grupos = {}  # clave -> grupo (None si no cuenta en el limite)
+        self._por_sesion = {}  # sesion -> clave del ultimo trabajo
+
+    def _executor(self):
+        # el pool se crea en cada worker de gunicorn (despues del fork), no
+        # en el proceso maestro
+        if self._pid != os.getpid():
+            global _conjuntos, _cache
+            _conjuntos, _cache = self.conjuntos, self.cache
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.procesos,
+                mp_context=multiprocessing.get_context('fork'))
+            self._pid = os.getpid()
+            self._trabajos = {}
+            self._grupos = {}
+            self._por_sesion = {}
+        return self._pool
+
+    def pendientes(self):
+        return sum(not f.done() for f in self._trabajos.values())
+
+    def _grupos_pendientes(self):
+        return {self._grupos.get(c, c) for c, f in self._trabajos.items()
+                if not f.done()} - {None}
+
+    def submit(self, sesion, clave, escenario, metodo='evaluar',
+               conjunto=None, argumentos=(), grupo=None, limitar=True):
+        """Encola el escenario y devuelve su identificador (``clave``).
+
+        ``metodo`` es el metodo de ``Modelo`` que se ejecuta (``evaluar``,
+        ``barrido``, ...) sobre el modelo del ``conjunto`` de datos, con el
+        escenario y los ``argumentos`` adicionales. Cancela el
+        trabajo anterior de la misma sesion si todavia no ha empezado. Lanza
+        ``JobsSaturados`` si la cola del worker esta llena; los trabajos con
+        el mismo ``grupo`` cuentan como uno y los de ``limitar=False`` no
+        cuentan.
+        """
+        if self.procesos == 0:
+            # sin pool: se calcula en el mismo proceso
+            _calcular(self.conjuntos, self.cache, clave, metodo, escenario,
+                      conjunto, argumentos)
+            return clave
+
+        with self._lock:
+            pool = self._executor()
+            anterior = self._por_sesion.get(sesion)
+            self._por_sesion[sesion] = clave
+            # el trabajo anterior se cancela solo si ninguna otra sesion lo
+            # esta esperando
+            if (anterior is not None and
+                    anterior not in self._por_sesion.values()):
+                futuro = self._trabajos.get(anterior)
+                if futuro is not None and futuro.cancel():
+                    del self._trabajos[anterior]
+
+            futuro = self._trabajos.get(clave)
+            if futuro is None or futuro.done():
+                grupo = (grupo or clave) if limitar else None
+                grupos = self._grupos_pendientes()
+                if (grupo is not None and grupo not in grupos and
+                        len(grupos) >= self.max_pendientes):
+                    raise JobsSaturados()
+                self._grupos[clave] = grupo
+                # un reintento no debe reportar el fallo anterior
+                self.cache.borrar_error(clave)
+                self._trabajos[clave] = pool.submit(_evaluar, clave, metodo,
+                                                    escenario, conjunto,
+                                                    argumentos)
+            self._limpiar()
+        return clave
+
+    def _limpiar(self):
+        terminados = [c for c, f in self._trabajos.items() if f.done()]
+        for clave in terminados[:max(0, len(terminados) - MAX_TERMINADOS)]:
+            del self._trabajos[clave]
+        self._grupos = {c: g for c, g in self._grupos.items()
+                        if c in self._trabajos}
+        self._por_sesion = {s: c for s, c in self._por_sesion.items()
+                            if c in self._trabajos}
+
+    def estado(self, clave, enviado=None):
+        """(estado, resultado) de un trabajo; ``resultado`` solo si LISTO."""
+        resultado = self.cache.get(clave, contar=False)
+        if resultado is not None:
+            return LISTO, resultado
+        # fallo en cualquier worker (ver _calcular)
+        if self.cache.get_error(clave) is not None:
+            return ERROR, None
+
+        futuro = self._trabajos.get(clave) if self._pid == os.getpid() \
+            else None
+        if futuro is not None and futuro.done():
+            if futuro.cancelled():
+                return CANCELADO, None
+            if futuro.exception() is not None:
+                return ERROR, None
+        if enviado is not None and time.time() - enviado > TIMEOUT:
+            return ERROR, None
+        return PENDIENTE, None
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
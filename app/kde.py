@@ -0,0 +1,176 @@
+"""Estimador de densidad por kernel gaussiano con pesos, binned + FFT.
+
+Reemplazo de ``scipy.stats.gaussian_kde`` para datos univariados evaluados
+sobre una grilla equiespaciada (``xs``). Los datos se asignan a una grilla
+fina con binning lineal y la densidad se obtiene convolucionando con el
+kernel mediante FFT: O(n + m log m) en lugar de O(n * len(xs)).
+
+Cota de error frente a scipy (mismo ancho de banda h): el binning lineal
+interpola el kernel entre nodos separados por delta <= h / REFINAMIENTO,
+con error <= phi(0) * delta**2 / (8 * h**3), y el kernel se trunca en
+CORTE * h, con error <= phi(CORTE) / h. Con los valores por defecto
+(8 y 5)::
+
+    max |binned_kde(xs) - gaussian_kde(xs)| <= 8e-4 / h
+
+es decir, menos de 0.2% de la altura de un kernel individual, phi(0) / h.
+
+La grilla fina tiene a lo sumo ``MAX_CELDAS`` nodos. Si h es tan pequeno
+frente al paso de ``xs`` que delta <= h / REFINAMIENTO exigiria mas,
+``binned_kde`` suma el kernel directamente (``kde_directo``), con el error
+del truncamiento como unica aproximacion.
+"""
+import numpy as np
+
+REFINAMIENTO = 8
+CORTE = 5
+MAX_CELDAS = 2 ** 22
+
+
+def kde_bandwidth(x, weights=None, bw_method='scott'):
+    """Desviacion estandar del kernel, con las reglas de scipy.
+
+    ``bw_method`` acepta 'scott', 'silverman' o un escalar, igual que
+    ``gaussian_kde`` (el escalar es el factor que multiplica la desviacion
+    estandar de los datos).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if weights is None:
+        weights = np.ones_like(x)
+    w = np.asarray(weights, dtype=np.float64)
+    w = w / w.sum()
+    suma_w2 = (w ** 2).sum()
+
+    # covarianza con pesos insesgada, como np.cov(aweights=w)
+    media = (w * x).sum()
+    varianza = (w * (x - media) ** 2).sum() / (1 - suma_w2)
+    return np.sqrt(varianza) * bandwidth_factor(1 / suma_w2, bw_method)
+
+
+def bandwidth_factor(neff, bw_method='scott'):
+    """Factor de ``gaussian_kde`` para un tamano de muestra efectivo."""
+    if bw_method == 'scott':
+        return neff ** (-1 / 5)
+    if bw_method == 'silverman':
+        return (neff * 3 / 4) ** (-1 / 5)
+    if np.isscalar(bw_method) and not isinstance(bw_method, str):
+        return float(bw_method)
+    raise ValueError("bw_method debe ser 'scott', 'silverman' o un escalar")
+
+
+def _paso_grilla(xs):
+    xs = np.asarray(xs, dtype=np.float64)
+    if len(xs) < 2:
+        raise ValueError('xs debe tener al menos dos puntos')
+    dx = (xs[-1] - xs[0]) / (len(xs) - 1)
+    if not np.allclose(np.diff(xs), dx, rtol=1e-6, atol=0):
+        raise ValueError('xs debe ser una grilla equiespaciada')
+    return xs, dx
+
+
+def fine_grid(xs, h, refinamiento=REFINAMIENTO, margen=CORTE):
+    """Grilla fina (inicio, delta, celdas, r, pad) que contiene a ``xs``.
+
+    El paso es a lo sumo ``h / refinamiento`` y la grilla se extiende
+    ``margen * h`` a cada lado de ``xs``. ``xs[i]`` corresponde a la celda
+    ``pad + i * r``.
+    """
+    xs, dx = _paso_grilla(xs)
+    r = max(1, int(np.ceil(dx * refinamiento / h)))
+    r = min(r, max(1, MAX_CELDAS // len(xs)))
+    delta = dx / r
+    pad = int(np.ceil(margen * h / delta))
+    celdas = (len(xs) - 1) * r + 1 + 2 * pad
+    return xs[0] - pad * delta, delta, celdas, r, pad
+
+
+def linear_binning(x, weights, inicio, delta, celdas):
+    """Pesos asignados a cada nodo de la grilla por interpolacion lineal.
+
+    Los datos fuera de la grilla se descartan.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    w = np.asarray(weights, dtype=np.float64)
+    t = (x - inicio) / delta
+    dentro = (t >= 0) & (t < celdas - 1)
+    t = t[dentro]
+    w = w[dentro]
+    i = t.astype(np.int64)
+    f = t - i
+    return (np.bincount(i, weights=w * (1 - f), minlength=celdas) +
+            np.bincount(i + 1, weights=w * f, minlength=celdas))
+
+
+def smooth(conteos, delta, h):
+    """Convolucion de los conteos con el kernel gaussiano (via FFT)."""
+    pad = int(np.ceil(CORTE * h / delta))
+    j = np.arange(-pad, pad + 1) * delta / h
+    kernel = np.exp(-0.5 * j ** 2) / (h * np.sqrt(2 * np.pi))
+    n = len(conteos) + len(kernel) - 1
+    n_fft = 1 << int(np.ceil(np.log2(n)))
+    conv = np.fft.irfft(np.fft.rfft(conteos, n_fft) *
+                        np.fft.rfft(kernel, n_fft), n_fft)
+    return conv[pad:pad + len(conteos)]
+
+
+def kde_directo(x, weights, xs, h):
+    """Suma directa del kernel (truncado en ``CORTE * h``) en ``xs``.
+
+    Cada dato solo aporta a los puntos de ``xs`` a menos de ``CORTE * h``,
+    asi que cuesta O(n * (1 + CORTE * h / dx)).
+    """
+    xs, dx = _paso_grilla(xs)
+    x = np.asarray(x, dtype=np.float64)
+    w = np.asarray(weights, dtype=np.float64)
+    total = w.sum()
+    finito = np.isfinite(x)
+    x, w = x[finito], w[finito]
+    cercano = np.rint((x - xs[0]) / dx).astype(np.int64)
+    alcance = int(np.ceil(CORTE * h / dx + 0.5))
+    densidad = np.zeros(len(xs))
+    for desplazamiento in range(-alcance, alcance + 1):
+        j = cercano + desplazamiento
+        valido = (j >= 0) & (j < len(xs))
+        z = (xs[j[valido]] - x[valido]) / h
+        aporte = w[valido] * np.exp(-0.5 * z ** 2) * (np.abs(z) <= CORTE)
+        densidad += np.bincount(j[valido], weights=aporte,
+                                minlength=len(xs))
+    return densidad / (h * np.sqrt(2 * np.pi) * total)
+
+
+def binned_kde(x, weights, xs, bw_method='scott', h=None):
+    """Densidad de ``x`` (con pesos) evaluada en la grilla ``xs``."""
+    x = np.asarray(x, dtype=np.float64)
+    if weights is None:
+        weights = np.ones_like(x)
+    weights = np.asarray(weights, dtype=np.float64)
+    if h is None:
+        h = kde_bandwidth(x, weights, bw_method)
+    xs, dx = _paso_grilla(xs)
+    if np.ceil(dx * REFINAMIENTO / h) > max(1, MAX_CELDAS // len(xs)):
+        # el tope de celdas no permite delta <= h / REFINAMIENTO
+        return kde_directo(x, weights, xs, h)
+    inicio, delta, celdas, r, pad = fine_grid(xs, h)
+    conteos = linear_binning(x, weights, inicio, delta, celdas)
+    densidad = smooth(conteos, delta, h) / weights.sum()
+    return np.maximum(densidad[pad:celdas - pad:r], 0)
+
+
+class BinnedKDE:
+    """Interfaz compatible con ``gaussian_kde`` para el caso univariado.
+
+    ``BinnedKDE(x, weights=w)(xs)`` reemplaza a
+    ``gaussian_kde(x, weights=w)(xs)`` cuando ``xs`` es equiespaciada.
+    """
+
+    def __init__(self, dataset, bw_method='scott', weights=None):
+        self.dataset = np.asarray(dataset, dtype=np.float64)
+        if weights is None:
+            weights = np.ones_like(self.dataset)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.h = kde_bandwidth(self.dataset, self.weights, bw_method)
+
+    def __call__(self, xs):
+        return binned_kde(self.dataset, self.weights, xs, h=self.h)
+
+    evaluate = __call__
@@ -0,0 +1,349 @@
+"""Evaluacion de escenarios por lotes, sin Dash ni Flask.
+
+Lee escenarios de un archivo JSONL (un objeto por linea)::
+
+    {"id": "manufactura-40", "sectores": [4], "empresa": 1,
+     "formalidad": [1], "contrato": [], "shock": 40}
+
+con choques por grupo opcionales (ver choques.py; sin una clave, la fila
+aplica a cualquier valor)::
+
+    {"id": "hoteles", "sectores": [4, 8], "empresa": 1, "formalidad": [1],
+     "contrato": [], "shock": 20, "tabla": [{"sector": 8, "choque": 80}]}
+
+los evalua en un pool de procesos (creados con ``fork`` despues de cargar
+los datos, de modo que todos comparten el mismo ``Modelo``) y escribe los
+resultados a medida que terminan, en CSV (cada fila apenas termina) o en
+Parquet (un directorio de archivos ``parte-*.parquet``, cada uno con las
+filas de a lo sumo ``INTERVALO_PARQUET`` segundos o ``BLOQUE_PARQUET``
+filas).
+
+Si la ejecucion se interrumpe, volver a correr el mismo comando retoma el
+lote: los escenarios cuyo ``id`` ya esta en la salida no se recalculan. Con
+Parquet, las filas que aun no se habian volcado a un archivo (las de los
+ultimos segundos) se pierden y se recalculan. Sin
+``id``, el escenario se identifica por su numero de linea. Los escenarios
+que fallan quedan registrados con el mensaje en la columna ``error``.
+
+Uso::
+
+    python lote.py escenarios.jsonl resultados.csv [--datos GEIH_mini]
+
+Con ``--bloques FILAS`` la encuesta no se carga completa: se recorre por
+bloques de hogares (ver flujo.py) y cada pasada evalua hasta
+``--por-pasada`` escenarios; los resultados son los del modo delta.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+import uuid
+
+import pandas as pd
+
+import flujo
+from datos import cargar_datos
+from modelo import MODO, Modelo, normalizar_escenario
+from quantiles import DECILES
+
+DECILES_COLUMNAS = ['d{}'.format(int(round(q * 10))) for q in DECILES]
+COLUMNAS = (['id', 'escenario', 'mediana', 'pobreza', 'gini'] +
+            DECILES_COLUMNAS + ['p90_p10', 'palma', 'top1', 'segundos',
+                                'error'])
+
+# filas por archivo de Parquet, y segundos entre archivos
+BLOQUE_PARQUET = 500
+INTERVALO_PARQUET = 5
+# escenarios por pasada sobre la encuesta con --bloques
+POR_PASADA = 100
+
+# estado heredado por los procesos del pool al hacer fork
+_modelo = None
+
+
+def leer_escenarios(ruta):
+    """(id, especificacion) de cada linea no vacia de un archivo JSONL."""
+    with open(ruta) as archivo:
+        for numero, linea in enumerate(archivo, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                spec = json.loads(linea)
+            except ValueError as error:
+                spec = {'error': 'JSON invalido: {}'.format(error)}
+            identificador = spec.get('id') if isinstance(spec, dict) \
+                else None
+            yield str(identificador if identificador is not None
+                      else 'linea-{}'.format(numero)), spec
+
+
+def _fila(identificador, escenario, resultados, segundos, error=''):
+    fila = dict.fromkeys(COLUMNAS, float('nan'))
+    fila.update(id=identificador, escenario=escenario, segundos=segundos,
+                error=error)
+    if resultados is not None:
+        resumen = resultados['resumen']
+        fila.update(mediana=resultados['mediana'],
+                    pobreza=resultados['pobreza'],
+                    gini=resultados['gini'],
+                    p90_p10=resumen['p90_p10'], palma=resumen['palma'],
+                    top1=resumen['top1'])
+        fila.update(zip(DECILES_COLUMNAS, resumen['deciles']))
+    return fila
+
+
+def escenario_spec(spec):
+    """``Escenario`` de una linea del archivo (ValueError si no es valida)."""
+    if not isinstance(spec, dict):
+        raise ValueError('el escenario debe ser un objeto JSON')
+    if 'error' in spec:
+        raise ValueError(spec['error'])
+    return normalizar_escenario(
+        spec.get('sectores'), spec.get('empresa'),
+        spec.get('formalidad'), spec.get('contrato'),
+        spec.get('shock'), spec.get('tabla'))
+
+
+def evaluar_spec(modelo, identificador, spec):
+    """Fila de resultados de un escenario (nunca lanza excepciones)."""
+    inicio = time.time()
+    try:
+        escenario = escenario_spec(spec)
+        resultados = modelo.evaluar(escenario)
+    except Exception as error:
+        return _fila(identificador, json.dumps(spec), None,
+                     time.time() - inicio, error=repr(error))
+    return _fila(identificador, json.dumps(escenario._asdict()), resultados,
+                 time.time() - inicio)
+
+
+def _evaluar(item):
+    return evaluar_spec(_modelo, *item)
+
+
+# ----------------------------
+# Salidas (con reanudacion)
+# ----------------------------
+
+class SalidaCSV:
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        if os.path.exists(ruta):
+            self._recortar()
+        nuevo = not os.path.exists(ruta) or os.path.getsize(ruta) == 0
+        self.archivo = open(ruta, 'a', newline='')
+        self.escritor = csv.DictWriter(self.archivo, fieldnames=COLUMNAS)
+        if nuevo:
+            self.escritor.writeheader()
+
+    def _recortar(self):
+        # una interrupcion puede dejar la ultima linea incompleta
+        with open(self.ruta, 'rb+') as archivo:
+            contenido = archivo.read()
+            if contenido and not contenido.endswith(b'\n'):
+                archivo.truncate(contenido.rfind(b'\n') + 1)
+
+    def terminados(self):
+        if not os.path.exists(self.ruta) or os.path.getsize(self.ruta) == 0:
+            return set()
+        with open(self.ruta, newline='') as archivo:
+            return {fila['id'] for fila in csv.DictReader(archivo)}
+
+    def escribir(self, fila):
+        self.escritor.writerow(fila)
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class SalidaParquet:
+    """Directorio de archivos Parquet; cada bloque se escribe atomicamente.
+
+    Un bloque se vuelca al llegar a ``bloque`` filas o ``intervalo``
+    segundos despues del anterior.
+    """
+
+    def __init__(self, ruta, bloque=BLOQUE_PARQUET,
+                 intervalo=INTERVALO_PARQUET):
+        self.ruta = ruta
+        self.bloque = bloque
+        self.intervalo = intervalo
+        self.filas = []
+        self.volcado = time.time()
+        os.makedirs(ruta, exist_ok=True)
+
+    def _partes(self):
+        return [os.path.join(self.ruta, nombre)
+                for nombre in sorted(os.listdir(self.ruta))
+                if nombre.startswith('parte-') and
+                nombre.endswith('.parquet')]
+
+    def terminados(self):
+        terminados = set()
+        for parte in self._partes():
+            terminados.update(pd.read_parquet(parte, columns=['id'])['id'])
+        return terminados
+
+    def escribir(self, fila):
+        self.filas.append(fila)
+        if (len(self.filas) >= self.bloque or
+                time.time() - self.volcado >= self.intervalo):
+            self._volcar()
+
+    def _volcar(self):
+        if not self.filas:
+            return
+        nombre = 'parte-{:06d}-{}.parquet'.format(len(self._partes()),
+                                                  uuid.uuid4().hex[:8])
+        temporal = os.path.join(self.ruta, '.' + nombre)
+        pd.DataFrame(self.filas, columns=COLUMNAS).to_parquet(temporal,
+                                                              index=False)
+        os.replace(temporal, os.path.join(self.ruta, nombre))
+        self.filas = []
+        self.volcado = time.time()
+
+    def cerrar(self):
+        self._volcar()
+
+
+def abrir_salida(ruta):
+    if ruta.endswith('.csv'):
+        return SalidaCSV(ruta)
+    if ruta.endswith('.parquet'):
+        return SalidaParquet(ruta)
+    raise ValueError('la salida debe terminar en .csv o .parquet')
+
+
+# ----------------------------
+# Lote
+# ----------------------------
+
+def ejecutar_lote(ruta_escenarios, ruta_salida, datos='GEIH_mini',
+                  procesos=None, modo=MODO, chunksize=4, reporte=100):
+    """Evalua los escenarios pendientes; devuelve (evaluados, omitidos)."""
+    global _modelo
+    salida = abrir_salida(ruta_salida)
+    terminados = salida.terminados()
+    vistos = set(terminados)
+
+    def pendientes():
+        for identificador, spec in leer_escenarios(ruta_escenarios):
+            if identificador not in vistos:
+                vistos.add(identificador)
+                yield identificador, spec
+
+    inicio = time.time()
+    _modelo = Modelo(cargar_datos(datos), modo=modo)
+    print('Modelo cargado en {:.1f} s'.format(time.time() - inicio))
+
+    evaluados = 0
+    contexto = multiprocessing.get_context('fork')
+    pool = contexto.Pool(procesos or os.cpu_count())
+    try:
+        for fila in pool.imap_unordered(_evaluar, pendientes(),
+                                        chunksize=chunksize):
+            salida.escribir(fila)
+            evaluados += 1
+            if evaluados % reporte == 0:
+                print('{} escenarios en {:.1f} s'.format(
+                    evaluados, time.time() - inicio))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        salida.cerrar()
+    return evaluados, len(terminados)
+
+
+def ejecutar_lote_por_bloques(ruta_escenarios, ruta_salida,
+                              datos='GEIH_mini', filas=flujo.FILAS,
+                              por_pasada=POR_PASADA):
+    """Como ``ejecutar_lote``, sin cargar la encuesta en memoria.
+
+    Cada pasada por la encuesta (ver flujo.py) evalua hasta ``por_pasada``
+    escenarios; sus filas se escriben al terminar la pasada.
+    """
+    salida = abrir_salida(ruta_salida)
+    terminados = salida.terminados()
+    vistos = set(terminados)
+    pendientes = []
+    for identificador, spec in leer_escenarios(ruta_escenarios):
+        if identificador not in vistos:
+            vistos.add(identificador)
+            pendientes.append((identificador, spec))
+
+    inicio = time.time()
+    evaluados = 0
+    try:
+        ref = flujo.referencia(datos, filas)
+        print('Referencia de {:,} personas en {:.1f} s'.format(
+            ref['personas'], time.time() - inicio))
+        for desde in range(0, len(pendientes), por_pasada):
+            validos = []
+            for identificador, spec in pendientes[desde:desde + por_pasada]:
+                try:
+                    validos.append((identificador, escenario_spec(spec)))
+                except Exception as error:
+                    salida.escribir(_fila(identificador, json.dumps(spec),
+                                          None, 0, error=repr(error)))
+                    evaluados += 1
+            if not validos:
+                continue
+            inicio_pasada = time.time()
+            resultados = flujo.evaluar(datos, [e for _, e in validos],
+                                       filas, ref=ref)['escenarios']
+            segundos = (time.time() - inicio_pasada) / len(validos)
+            for (identificador, escenario), resultado in zip(validos,
+                                                             resultados):
+                error = ''
+                if isinstance(resultado, Exception):
+                    resultado, error = None, repr(resultado)
+                salida.escribir(_fila(identificador,
+                                      json.dumps(escenario._asdict()),
+                                      resultado, segundos, error=error))
+            evaluados += len(validos)
+            print('{} escenarios en {:.1f} s'.format(
+                evaluados, time.time() - inicio))
+    finally:
+        salida.cerrar()
+    return evaluados, len(terminados)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Evalua escenarios de choque por lotes.')
+    parser.add_argument('escenarios', help='archivo JSONL de escenarios')
+    parser.add_argument('salida', help='archivo .csv o directorio .parquet')
+    parser.add_argument('--datos', default=os.environ.get('GEIH_DATA',
+                                                          'GEIH_mini'),
+                        help='directorio columnar o CSV (ver datos.py)')
+    parser.add_argument('--procesos', type=int, default=None,
+                        help='procesos del pool (por defecto, uno por core)')
+    parser.add_argument('--modo', default=MODO, help="'exacto' o 'delta'")
+    parser.add_argument('--bloques', type=int, default=None,
+                        metavar='FILAS',
+                        help='recorre la encuesta por bloques de hogares '
+                             'de ~FILAS personas sin cargarla (ver '
+                             'flujo.py)')
+    parser.add_argument('--por-pasada', type=int, default=POR_PASADA,
+                        help='escenarios por pasada con --bloques')
+    args = parser.parse_args()
+
+    if args.bloques:
+        evaluados, omitidos = ejecutar_lote_por_bloques(
+            args.escenarios, args.salida, datos=args.datos,
+            filas=args.bloques, por_pasada=args.por_pasada)
+    else:
+        evaluados, omitidos = ejecutar_lote(args.escenarios, args.salida,
+                                            datos=args.datos,
+                                            procesos=args.procesos,
+                                            modo=args.modo)
+    print('{} escenarios evaluados, {} ya estaban en {}'.format(
+        evaluados, omitidos, args.salida))
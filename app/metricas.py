@@ -0,0 +1,250 @@
+"""Temporizadores y contadores por etapa, en formato de texto de Prometheus.
+
+Cada proceso tiene su propio ``Registro``. El calculo de escenarios ocurre
+en el pool de ``jobs.py``, asi que los tiempos de cada etapa viajan con el
+resultado (``resultados['tiempos']``) y el worker que lo entrega los
+registra con ``Registro.observar_etapas``.
+
+``/metrics`` lo atiende cualquiera de los workers de gunicorn, asi que cada
+worker publica periodicamente su ``Registro.estado()`` en el cache
+compartido (ver cache.py) y la respuesta es ``Registro.combinar`` de todos:
+contadores e histogramas sumados (los de workers que ya terminaron se
+conservan, para que no parezcan reinicios) y gauges por worker, con la
+etiqueta ``pid``.
+
+Con ``PROFILE_SAMPLE`` (fraccion entre 0 y 1) una muestra de los calculos
+del pool se perfila con cProfile; los archivos ``.prof`` quedan en
+``PROFILE_DIR``. Las solicitudes no se perfilan: en un worker de gevent
+comparten el hilo y sus perfiles se mezclarian.
+"""
+import cProfile
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from os import environ
+
+PROFILE_SAMPLE = float(environ.get('PROFILE_SAMPLE', '0'))
+PROFILE_DIR = environ.get('PROFILE_DIR',
+                          os.path.join(tempfile.gettempdir(),
+                                       'inequality_app_profiles'))
+
+# segundos entre publicaciones del estado de un worker
+PUBLICAR = 5
+
+# limites (segundos) de los histogramas de latencia
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+           30)
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v)
+                          for k, v in sorted(etiquetas.items())) + '}'
+
+
+class Registro:
+    """Contadores, gauges e histogramas con etiquetas (de un proceso)."""
+
+    def __init__(self, prefijo='inequality_app'):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._ayuda = {}
+        self._tipos = {}
+        self._valores = {}        # (nombre, etiquetas) -> valor
+        self._histogramas = {}    # (nombre, etiquetas) -> [conteos, suma, n]
+
+    def _declarar(self, nombre, tipo, ayuda):
+        nombre = '{}_{}'.format(self.prefijo, nombre)
+        self._tipos.setdefault(nombre, tipo)
+        if ayuda:
+            self._ayuda.setdefault(nombre, ayuda)
+        return nombre
+
+    def contar(self, nombre, valor=1, ayuda='', **etiquetas):
+        nombre = self._declarar(nombre, 'counter', ayuda)
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, ayuda='', **etiquetas):
+        nombre = self._declarar(nombre, 'gauge', ayuda)
+        with self._lock:
+            self._valores[(nombre, tuple(sorted(etiquetas.items())))] = valor
+
+    def observar(self, nombre, valor, ayuda='', **etiquetas):
+        nombre = self._declarar(nombre, 'histogram', ayuda)
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            conteos, suma, n = self._histogramas.get(
+                clave, [[0] * len(BUCKETS), 0.0, 0])
+            conteos = [c + (valor <= b) for c, b in zip(conteos, BUCKETS)]
+            self._histogramas[clave] = [conteos, suma + valor, n + 1]
+
+    @contextmanager
+    def etapa(self, nombre, **etiquetas):
+        """Tiempo de un bloque en el histograma ``<nombre>_seconds``."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre + '_seconds', time.perf_counter() - inicio,
+                          **etiquetas)
+
+    def observar_etapas(self, tiempos, **etiquetas):
+        """Registra los ``tiempos`` por etapa de un resultado del modelo."""
+        for etapa, segundos in tiempos.items():
+            self.observar('etapa_seconds', segundos,
+                          ayuda='Duracion de cada etapa del calculo de un '
+                                'escenario.', etapa=etapa, **etiquetas)
+
+    def estado(self):
+        """Copia de las series, para combinarla con las de otros procesos."""
+        with self._lock:
+            return {'tipos': dict(self._tipos),
+                    'ayuda': dict(self._ayuda),
+                    'valores': dict(self._valores),
+                    'histogramas': {k: list(v)
+                                    for k, v in self._histogramas.items()}}
+
+    @classmethod
+    def combinar(cls, estados, vivos=(), prefijo='inequality_app'):
+        """Registro con las series de varios procesos.
+
+        ``estados`` son pares (pid, estado). Contadores e histogramas se
+        suman; los gauges solo se conservan para los pids en ``vivos``, con
+        la etiqueta ``pid``.
+        """
+        total = cls(prefijo)
+        for pid, estado in estados:
+            total._tipos.update(estado['tipos'])
+            total._ayuda.update(estado['ayuda'])
+            for (nombre, etiquetas), valor in estado['valores'].items():
+                if estado['tipos'][nombre] != 'gauge':
+                    clave = (nombre, etiquetas)
+                    total._valores[clave] = total._valores.get(clave,
+                                                               0) + valor
+                elif pid in vivos:
+                    etiquetas = tuple(sorted(dict(etiquetas,
+                                                  pid=pid).items()))
+                    total._valores[(nombre, etiquetas)] = valor
+            for clave, (conteos, suma, n) in estado['histogramas'].items():
+                previos, suma_previa, n_previo = total._histogramas.get(
+                    clave, [[0] * len(BUCKETS), 0.0, 0])
+                total._histogramas[clave] = [
+                    [a + b for a, b in zip(previos, conteos)],
+                    suma_previa + suma, n_previo + n]
+        return total
+
+    def texto(self):
+        """Todas las series en el formato de texto de Prometheus."""
+        with self._lock:
+            valores = dict(self._valores)
+            histogramas = {k: list(v) for k, v in self._histogramas.items()}
+        lineas = []
+        for nombre in sorted(self._tipos):
+            if nombre in self._ayuda:
+                lineas.append('# HELP {} {}'.format(nombre,
+                                                     self._ayuda[nombre]))
+            lineas.append('# TYPE {} {}'.format(nombre, self._tipos[nombre]))
+            for (serie, etiquetas), valor in sorted(valores.items()):
+                if serie == nombre:
+                    lineas.append('{}{} {}'.format(
+                        nombre, _etiquetas(dict(etiquetas)), valor))
+            for (serie, etiquetas), (conteos, suma, n) in sorted(
+                    histogramas.items()):
+                if serie != nombre:
+                    continue
+                etiquetas = dict(etiquetas)
+                for limite, conteo in zip(BUCKETS, conteos):
+                    lineas.append('{}_bucket{} {}'.format(
+                        nombre, _etiquetas(dict(etiquetas, le=limite)),
+                        conteo))
+                lineas.append('{}_bucket{} {}'.format(
+                    nombre, _etiquetas(dict(etiquetas, le='+Inf')), n))
+                lineas.append('{}_sum{} {}'.format(
+                    nombre, _etiquetas(etiquetas), suma))
+                lineas.append('{}_count{} {}'.format(
+                    nombre, _etiquetas(etiquetas), n))
+        return '\n'.join(lineas) + '\n'
+
+
+_procesos = {}
+
+
+def identificador_proceso():
+    """Identificador unico del proceso (un pid se puede reutilizar)."""
+    pid = os.getpid()
+    if pid not in _procesos:
+        _procesos[pid] = '{}-{}'.format(pid, uuid.uuid4().hex[:8])
+    return _procesos[pid]
+
+
+def proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def memoria_rss():
+    """Memoria residente del proceso, en bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def iniciar_perfil(muestra=None):
+    """Un ``cProfile.Profile`` activo con probabilidad ``muestra``, o None."""
+    muestra = PROFILE_SAMPLE if muestra is None else muestra
+    if muestra <= 0 or random.random() >= muestra:
+        return None
+    perfil = cProfile.Profile()
+    perfil.enable()
+    return perfil
+
+
+def guardar_perfil(perfil, nombre):
+    perfil.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    perfil.dump_stats(os.path.join(PROFILE_DIR, '{}-{}-{}.prof'.format(
+        nombre, os.getpid(), int(time.time() * 1000))))
+
+
+@contextmanager
+def perfilar(nombre, muestra=None):
+    """Perfila el bloque con probabilidad ``muestra`` (``PROFILE_SAMPLE``)."""
+    perfil = iniciar_perfil(muestra)
+    try:
+        yield
+    finally:
+        if perfil is not None:
+            guardar_perfil(perfil, nombre)
+
+
+class Cronometro:
+    """Tiempos por etapa de un calculo, para devolver con el resultado."""
+
+    def __init__(self):
+        self.tiempos = {}
+        self._inicio = time.perf_counter()
+
+    def marcar(self, etapa):
+        """Tiempo desde la marca anterior, asignado a ``etapa``."""
+        ahora = time.perf_counter()
+        self.tiempos[etapa] = self.tiempos.get(etapa, 0) + ahora - \
+            self._inicio
+        self._inicio = ahora
+
+
+registro = Registro()
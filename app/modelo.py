@@ -0,0 +1,501 @@
+"""Calculo de escenarios de choque, independiente de la interfaz."""
+from collections import namedtuple
+from os import environ
+
+import numpy as np
+
+from agregados import GrillaAgregados
+from artefactos import (DIRECTORIO as ARTEFACTOS, cargar_artefactos,
+                        guardar_artefactos, parametros, ruta_artefactos)
+from bootstrap import (BLOQUE, ESTADISTICAS, REPLICAS, SEMILLA, Bootstrap,
+                       multiplicidades)
+from choques import TablaChoques
+from datos import Datos
+from descomposicion import Descomposicion
+from engine import ShockEngine
+from indice import IndiceRiesgo
+from kde import BinnedKDE, kde_bandwidth
+from lorenz import GRILLA, weighted_lorenz
+from metricas import Cronometro
+from muestra import submuestra
+from pobreza import POBRES, TOTAL, IndicadoresPobreza
+from quantiles import sort_order, distribution_summary
+
+# tabla: choques por sector, empresa y formalidad (ver choques.py)
+Escenario = namedtuple('Escenario', ['sectores', 'empresa', 'formalidad',
+                                     'contrato', 'shock', 'tabla'],
+                       defaults=((),))
+
+SIN_CHOQUE = Escenario((), None, (), (), 0)
+
+# cambia cuando cambia el contenido de los resultados de evaluar()
+VERSION_RESULTADOS = 8
+
+# 'exacto': recalcula todo sobre la encuesta completa
+# 'delta': actualiza agregados de la linea base solo con los hogares
+#          afectados (densidad, cuantiles y Lorenz aproximados por binning)
+EXACTO = 'exacto'
+DELTA = 'delta'
+MODO = environ.get('SCENARIO_MODE', EXACTO)
+
+# niveles del slider de choque evaluados por Modelo.barrido
+NIVELES = np.arange(0, 101)
+
+
+def _valores(valores):
+    return tuple(sorted(set(valores or [])))
+
+
+def _codigo(valor):
+    # '', None y 'todos' (la opcion de la interfaz) son "cualquier valor"
+    if valor in (None, '', 'todos'):
+        return None
+    return int(valor)
+
+
+def _tabla(tabla):
+    filas = []
+    for fila in tabla or []:
+        if isinstance(fila, dict):
+            fila = [fila.get(clave) for clave in
+                    ('sector', 'empresa', 'formalidad', 'choque')]
+        *valores, choque = fila
+        if choque in (None, ''):
+            continue
+        filas.append(tuple(_codigo(valor) for valor in valores) +
+                     (min(max(float(choque), 0), 100),))
+    return tuple(filas)
+
+
+def normalizar_escenario(sectores, empresa, formalidad, contrato, shock,
+                         tabla=None):
+    """Forma canonica de los valores seleccionados en la interfaz.
+
+    Las listas se ordenan y ``None`` equivale a ``[]``. ``tabla`` son filas
+    ``(sector, empresa, formalidad, choque)`` o diccionarios con esas
+    claves (ver choques.py); se conserva su orden, las filas sin choque se
+    descartan y los choques se limitan a [0, 100]. La seleccion general
+    (sectores, empresa y relacion laboral) solo cuenta si esta completa y
+    su choque no es 0%; las filas de la tabla aplican aunque no lo este.
+    Los escenarios que no afectan a nadie se reducen todos a
+    ``SIN_CHOQUE``.
+    """
+    escenario = Escenario(_valores(sectores), empresa, _valores(formalidad),
+                          _valores(contrato), shock or 0, _tabla(tabla))
+    if (not escenario.sectores or escenario.empresa is None or
+            not (escenario.formalidad or escenario.contrato) or
+            escenario.shock == 0):
+        escenario = SIN_CHOQUE._replace(tabla=escenario.tabla)
+    if not any(fila[-1] for fila in escenario.tabla) and (
+            escenario.shock == 0):
+        return SIN_CHOQUE
+    return escenario
+
+
+class Modelo:
+    """Datos, motor del choque y estadisticas de la distribucion original.
+
+    ``datos`` es un ``datos.Datos`` o cualquier mapeo columna -> arreglo,
+    que se convierte en ``datos.Datos`` (su firma es el hash de las
+    columnas, ver ``datos.firma_columnas``).
+    ``maximo`` es el extremo de la grilla de la densidad (por defecto el
+    maximo del ingreso original). Con ``previa`` > 0, ``self.previa`` es el
+    modelo (en modo delta) de una submuestra de esa fraccion de los
+    hogares, para la vista previa de los escenarios (ver muestra.py).
+    """
+
+    def __init__(self, datos, n_puntos=1000, modo=MODO,
+                 artefactos=ARTEFACTOS, maximo=None, previa=0):
+        if modo not in (EXACTO, DELTA):
+            raise ValueError('modo desconocido: {}'.format(modo))
+        if not isinstance(datos, Datos):
+            datos = Datos({col: np.asarray(valores)
+                           for col, valores in datos.items()})
+        self.datos = datos
+        self.modo = modo
+        self.pesos = np.asarray(datos['fac_exp_ind_12m'])
+        self.ingreso_original = np.asarray(datos['ING_pc_bl_def_arriendo'])
+
+        # firma de los datos para invalidar resultados guardados
+        self.firma = datos.firma[:16]
+        self.namespace = '{}-v{}-{}'.format(self.firma, VERSION_RESULTADOS,
+                                            modo)
+
+        maximo = self.ingreso_original.max() if maximo is None else maximo
+        self.xs = np.linspace(0, maximo, n_puntos)
+        self.lorenz_grilla = GRILLA
+
+        # la linea base se lee de disco si ya se calculo para estos datos y
+        # parametros (ver artefactos.py)
+        self.engine = None
+        self.indicadores = None
+        self.ruta_artefactos = None
+        base = None
+        if artefactos:
+            self.ruta_artefactos = ruta_artefactos(
+                datos.firma, parametros(n_puntos), artefactos)
+            base = cargar_artefactos(self.ruta_artefactos)
+        if base is None:
+            base = self._calcular_base()
+            if artefactos:
+                guardar_artefactos(self.ruta_artefactos, base,
+                                   meta={'firma': datos.firma,
+                                         'parametros': parametros(n_puntos)})
+        self._usar_base(base)
+        self._nbytes_base = sum(v.nbytes for v in base.values()
+                                if isinstance(v, np.ndarray))
+
+        # la vista previa usa la misma grilla, asi que sus curvas se
+        # dibujan sobre las de la distribucion original
+        self.previa = None
+        if previa:
+            self.previa = Modelo(submuestra(datos, previa), n_puntos,
+                                 modo=DELTA, artefactos=artefactos,
+                                 maximo=maximo)
+
+    def _calcular_base(self):
+        """Estadisticas de la distribucion original y agregados de base."""
+        datos = self.datos
+        self.engine = ShockEngine(datos)
+        self.indicadores = IndicadoresPobreza(datos['CLASE_per'],
+                                              datos['AREA_per'],
+                                              datos['cat_dom'], self.pesos)
+
+        # ordenamientos de referencia: el de la distribucion original y el
+        # del ingreso sin choque del motor (punto de partida para ordenar
+        # el ingreso con choque)
+        orden_original = sort_order(self.ingreso_original)
+        lorenz, gini = weighted_lorenz(self.ingreso_original, self.pesos,
+                                       orden=orden_original)
+
+        # agregados del ingreso sin choque, para el modo delta
+        base = self.engine.ingreso_base
+        h = kde_bandwidth(base, self.pesos)
+        centro = np.average(base, weights=self.pesos)
+        agregados = GrillaAgregados(self.xs, h, centro=centro).agregar(
+            base, self.pesos, self.indicadores.sumas(base))
+
+        base = {'dist_original': BinnedKDE(self.ingreso_original,
+                                           weights=self.pesos)(self.xs),
+                'orden_original': orden_original,
+                'orden_base': sort_order(base),
+                'resumen_original': distribution_summary(
+                    self.ingreso_original, self.pesos,
+                    orden=orden_original),
+                'lorenz_original': lorenz,
+                'gini_original': gini,
+                'pobreza_detalle_original': self.indicadores.calcular(
+                    self.ingreso_original),
+                'h_grilla': h,
+                'centro_grilla': centro,
+                'agregados_base': agregados}
+
+        # mapas de bits de los selectores del escenario (ver indice.py)
+        self.indice = IndiceRiesgo(datos, self.engine.hogar)
+
+        # celdas de la tabla de choques (ver choques.py)
+        self.choques = TablaChoques(datos)
+
+        # indices de los subgrupos (ver descomposicion.py)
+        self.descomposicion = Descomposicion(
+            datos, self.pesos, self.indicadores.lineas, self.indicadores.peso)
+        base['descomposicion_original'] = self.descomposicion.calcular(
+            self.ingreso_original, orden_original)
+
+        base.update(('engine_' + k, v)
+                    for k, v in self.engine.estado().items())
+        base.update(('pobreza_' + k, v)
+                    for k, v in self.indicadores.estado().items())
+        base.update(('riesgo_' + k, v)
+                    for k, v in self.indice.estado().items())
+        base.update(('choques_' + k, v)
+                    for k, v in self.choques.estado().items())
+        base.update(('descomposicion_' + k, v)
+                    for k, v in self.descomposicion.estado().items())
+        return base
+
+    def _usar_base(self, base):
+        if self.engine is None:
+            self.engine = ShockEngine.desde_estado(
+                {k: base['engine_' + k] for k in ShockEngine.ESTADO})
+            self.indicadores = IndicadoresPobreza.desde_estado(
+                {k: base['pobreza_' + k] for k in IndicadoresPobreza.ESTADO})
+            self.indice = IndiceRiesgo.desde_estado(
+                {k: base['riesgo_' + k] for k in IndiceRiesgo.ESTADO},
+                self.engine.hogar)
+            self.choques = TablaChoques.desde_estado(
+                {k: base['choques_' + k] for k in TablaChoques.ESTADO})
+            self.descomposicion = Descomposicion.desde_estado(
+                {k: base['descomposicion_' + k]
+                 for k in Descomposicion.ESTADO},
+                self.pesos, self.indicadores.lineas, self.indicadores.peso)
+        self.dist_original = base['dist_original']
+        self.orden_original = base['orden_original']
+        self.orden_base = base['orden_base']
+        self.resumen_original = base['resumen_original']
+        self.median_original = self.resumen_original['mediana']
+        self.lorenz_original = base['lorenz_original']
+        self.gini_original = base['gini_original']
+        self.pobreza_detalle_original = base['pobreza_detalle_original']
+        self.pobreza_original = self.pobreza_detalle_original['pobreza']
+        self.grilla = GrillaAgregados(self.xs, base['h_grilla'],
+                                      centro=base['centro_grilla'])
+        self.agregados_base = base['agregados_base']
+        self.descomposicion_original = base['descomposicion_original']
+        self.bootstrap = Bootstrap(self.engine.hogar, self.engine.n_hogares,
+                                   self.pesos, self.indicadores.lineas,
+                                   self.indicadores.peso)
+        # replicas del bootstrap (al primer uso)
+        self._replicas_base = None
+
+    @property
+    def nbytes(self):
+        """Memoria aproximada de los datos y de la linea base (bytes)."""
+        previa = self.previa.nbytes if self.previa is not None else 0
+        return self.datos.nbytes + self._nbytes_base + previa
+
+    def descripcion(self, escenario=None):
+        """Lo que la interfaz necesita del modelo: la distribucion original
+        y el namespace de los resultados en el cache.
+
+        Es pequeno, asi que un proceso del pool puede cargar el conjunto y
+        devolverlo al worker web (ver ``jobs.ScenarioJobs``); ``escenario``
+        se ignora.
+        """
+        return {'namespace': self.namespace,
+                'xs': self.xs,
+                'dist_original': self.dist_original,
+                'lorenz_grilla': self.lorenz_grilla,
+                'lorenz_original': self.lorenz_original,
+                'resumen_original': self.resumen_original,
+                'gini_original': self.gini_original,
+                'pobreza_detalle_original': self.pobreza_detalle_original}
+
+    def evaluar_previa(self, escenario):
+        """``evaluar`` sobre la submuestra de la vista previa."""
+        if self.previa is None:
+            raise ValueError('el modelo no tiene vista previa')
+        return self.previa.evaluar(escenario)
+
+    def riesgo(self, escenario):
+        """Mascara de las personas en riesgo (ver indice.py)."""
+        if escenario == SIN_CHOQUE:
+            return np.zeros(len(self.pesos), dtype=bool)
+        return self.indice.mascara(escenario)
+
+    def personas_en_riesgo(self, escenario):
+        """Indices (ordenados) de las personas en riesgo."""
+        return self.indice.personas(escenario)
+
+    def hogares_en_riesgo(self, escenario):
+        """Codigos de hogar (``engine.hogar``) con alguien en riesgo."""
+        return self.indice.hogares(escenario)
+
+    def choque(self, escenario, riesgo):
+        """Choque (%) para ``engine.ingreso_choque``: el del escenario o,
+        con tabla de choques, uno por persona en ``riesgo``."""
+        if not escenario.tabla:
+            return escenario.shock
+        return self.choques.por_persona(escenario, riesgo)
+
+    def evaluar(self, escenario):
+        """Densidad, cuantiles, Lorenz, Gini y pobreza bajo el choque."""
+        if self.modo == DELTA:
+            return self.evaluar_delta(escenario)
+        return self.evaluar_exacto(escenario)
+
+    def _agregar(self, personas, ingreso):
+        return self.grilla.agregar(ingreso, self.pesos[personas],
+                                   self.indicadores.sumas(ingreso, personas))
+
+    def evaluar_delta(self, escenario):
+        """Como ``evaluar_exacto``, recorriendo solo los hogares afectados."""
+        cronometro = Cronometro()
+        riesgo = self.personas_en_riesgo(escenario)
+        cronometro.marcar('riesgo')
+        personas, ingreso = self.engine.ingreso_choque_parcial(
+            riesgo, self.choque(escenario, riesgo))
+        cronometro.marcar('ingreso')
+        agregados = (self.agregados_base -
+                     self._agregar(personas,
+                                   self.engine.ingreso_base[personas]) +
+                     self._agregar(personas, ingreso))
+        cronometro.marcar('agregados')
+        resultados = self.grilla.resultados(agregados)
+        pobreza = self.indicadores.resultados(agregados.pobreza)
+        resultados.update(pobreza=pobreza['pobreza'], pobreza_detalle=pobreza)
+        cronometro.marcar('resultados')
+        resultados.update(tiempos=cronometro.tiempos, en_riesgo=len(riesgo))
+        return resultados
+
+    def barrido(self, escenario, niveles=NIVELES):
+        """Pobreza, mediana y Gini para todos los ``niveles`` de choque.
+
+        Con la seleccion de ``escenario`` fija (su ``shock`` se ignora), el
+        ingreso de cada persona afectada es afin en el choque, asi que todos
+        los niveles se evaluan con una sola matriz personas x niveles sobre
+        la grilla de agregados (mediana y Gini aproximados como en el modo
+        delta). Los niveles reemplazan el choque general; los de la tabla
+        de choques se mantienen fijos.
+        """
+        cronometro = Cronometro()
+        niveles = np.asarray(niveles, dtype=np.float64)
+        riesgo = self.personas_en_riesgo(escenario)
+        cronometro.marcar('riesgo')
+        if escenario.tabla:
+            # NaN: personas con el choque general, que varia con el nivel
+            tabla = self.choques.por_persona(escenario, riesgo, np.nan)
+            general = np.isnan(tabla)
+            personas, perdida = self.engine.perdida_por_persona(riesgo,
+                                                                general)
+            _, fija = self.engine.perdida_por_persona(
+                riesgo, np.where(general, 0, tabla / 100))
+        else:
+            personas, perdida = self.engine.perdida_por_persona(riesgo)
+            fija = 0
+        base = self.engine.ingreso_base[personas]
+        cronometro.marcar('ingreso')
+        resto = self.agregados_base - self._agregar(personas, base)
+        hist_pesos, hist_ingresos, pobreza = self.grilla.histogramas_por_nivel(
+            base - fija, perdida, niveles, self.pesos[personas],
+            self.indicadores.lineas[personas],
+            self.indicadores.peso[personas])
+        pobreza += resto.pobreza[[POBRES, TOTAL]].sum(axis=1)
+        cronometro.marcar('agregados')
+        curvas = self.grilla.curvas(resto, hist_pesos, hist_ingresos, pobreza)
+        cronometro.marcar('resultados')
+        curvas.update(niveles=niveles, tiempos=cronometro.tiempos,
+                      en_riesgo=len(riesgo))
+        return curvas
+
+    def descomponer(self, escenario):
+        """Pobreza, medianas y Theil por subgrupo, sin y con el choque.
+
+        Se calcula siempre sobre el ingreso completo (tambien en el modo
+        delta); ver descomposicion.py.
+        """
+        cronometro = Cronometro()
+        riesgo = self.riesgo(escenario)
+        cronometro.marcar('riesgo')
+        ingreso = self.engine.ingreso_choque(
+            riesgo, self.choque(escenario, riesgo))
+        cronometro.marcar('ingreso')
+        orden = sort_order(ingreso, orden_base=self.orden_base)
+        cronometro.marcar('orden')
+        choque = self.descomposicion.calcular(ingreso, orden)
+        cronometro.marcar('descomposicion')
+        return {'original': self.descomposicion_original,
+                'choque': choque,
+                'tiempos': cronometro.tiempos,
+                'en_riesgo': int(riesgo.sum())}
+
+    def replicas_base(self):
+        """Estadisticas originales de las ``REPLICAS``.
+
+        No dependen del escenario: se calculan una vez y se guardan junto a
+        los artefactos de la linea base. Las multiplicidades no se guardan
+        (son una matriz replicas x hogares); cada bloque las regenera a
+        partir de la semilla.
+        """
+        if self._replicas_base is None:
+            ruta = None
+            base = None
+            if self.ruta_artefactos:
+                ruta = '{}-replicas-{}-{}'.format(self.ruta_artefactos,
+                                                  REPLICAS, SEMILLA)
+                base = cargar_artefactos(ruta)
+            if base is None:
+                original = self.bootstrap.preparar(self.ingreso_original,
+                                                   self.orden_original)
+                pobreza, mediana = [], []
+                for bloque in range(0, REPLICAS, BLOQUE):
+                    matriz = multiplicidades(
+                        self.engine.n_hogares,
+                        range(bloque, min(bloque + BLOQUE, REPLICAS)))
+                    p, m = self.bootstrap.evaluar(original, matriz)
+                    pobreza.append(p)
+                    mediana.append(m)
+                base = {'pobreza_original': np.concatenate(pobreza),
+                        'mediana_original': np.concatenate(mediana)}
+                if ruta:
+                    guardar_artefactos(ruta, base,
+                                       meta={'replicas': REPLICAS,
+                                             'semilla': SEMILLA})
+            self._replicas_base = base
+        return self._replicas_base
+
+    def replicas(self, escenario, inicio=0, fin=REPLICAS):
+        """Pobreza y mediana, original y con el choque, en cada replica.
+
+        Evalua las replicas ``inicio..fin-1`` del bootstrap de hogares (ver
+        bootstrap.py); ``bootstrap.intervalos`` combina los bloques. Las
+        ``REPLICAS`` de la distribucion original vienen de
+        ``replicas_base``.
+        """
+        cronometro = Cronometro()
+        riesgo = self.riesgo(escenario)
+        cronometro.marcar('riesgo')
+        ingreso = self.engine.ingreso_choque(
+            riesgo, self.choque(escenario, riesgo))
+        cronometro.marcar('ingreso')
+        orden = sort_order(ingreso, orden_base=self.orden_base)
+        cronometro.marcar('orden')
+        base = self.replicas_base()
+        choque = self.bootstrap.preparar(ingreso, orden)
+        original = None
+        cronometro.marcar('preparar')
+
+        resultados = {nombre: [] for nombre in ESTADISTICAS}
+        for bloque in range(inicio, fin, BLOQUE):
+            replicas = range(bloque, min(bloque + BLOQUE, fin))
+            matriz = multiplicidades(self.engine.n_hogares, replicas)
+            if replicas.stop <= REPLICAS:
+                for nombre in ('pobreza_original', 'mediana_original'):
+                    resultados[nombre].append(
+                        base[nombre][replicas.start:replicas.stop])
+            else:
+                if original is None:
+                    original = self.bootstrap.preparar(self.ingreso_original,
+                                                       self.orden_original)
+                pobreza, mediana = self.bootstrap.evaluar(original, matriz)
+                resultados['pobreza_original'].append(pobreza)
+                resultados['mediana_original'].append(mediana)
+            pobreza, mediana = self.bootstrap.evaluar(choque, matriz)
+            resultados['pobreza'].append(pobreza)
+            resultados['mediana'].append(mediana)
+        cronometro.marcar('replicas')
+        resultados = {nombre: np.concatenate(valores)
+                      for nombre, valores in resultados.items()}
+        resultados.update(tiempos=cronometro.tiempos,
+                          en_riesgo=int(riesgo.sum()))
+        return resultados
+
+    def evaluar_exacto(self, escenario):
+        cronometro = Cronometro()
+        riesgo = self.riesgo(escenario)
+        cronometro.marcar('riesgo')
+        ingreso = self.engine.ingreso_choque(
+            riesgo, self.choque(escenario, riesgo))
+        cronometro.marcar('ingreso')
+
+        densidad = BinnedKDE(ingreso, weights=self.pesos)(self.xs)
+        cronometro.marcar('kde')
+        orden = sort_order(ingreso, orden_base=self.orden_base)
+        cronometro.marcar('orden')
+        resumen = distribution_summary(ingreso, self.pesos, orden=orden)
+        cronometro.marcar('cuantiles')
+        lorenz, gini = weighted_lorenz(ingreso, self.pesos, orden=orden)
+        cronometro.marcar('lorenz')
+
+        pobreza = self.indicadores.calcular(ingreso)
+        cronometro.marcar('pobreza')
+
+        return {'densidad': densidad,
+                'mediana': resumen['mediana'],
+                'resumen': resumen,
+                'lorenz': lorenz,
+                'gini': gini,
+                'pobreza': pobreza['pobreza'],
+                'pobreza_detalle': pobreza,
+                'tiempos': cronometro.tiempos,
+                'en_riesgo': int(riesgo.sum())}
@@ -0,0 +1,87 @@
+"""Submuestra de hogares para la vista previa de los escenarios.
+
+Al presionar "Aplicar" la interfaz muestra primero el escenario calculado
+sobre una submuestra fija de hogares (unos pocos por ciento de la
+encuesta) y lo reemplaza por el resultado exacto cuando este termina.
+
+La submuestra se elige una sola vez al cargar los datos. Los estratos son
+el dominio de pobreza (``cat_dom``) por la clase (cabecera / resto); dentro
+de cada estrato los hogares se ordenan por ingreso per capita y se toma una
+muestra sistematica con arranque aleatorio (semilla fija), de modo que
+cada estrato queda representado en toda su distribucion del ingreso. Los
+factores de expansion se calibran por posestratificacion: en cada estrato
+la submuestra suma la misma poblacion que la encuesta completa.
+"""
+import hashlib
+from os import environ
+
+import numpy as np
+
+from datos import Datos
+from descomposicion import codificar
+from engine import codigos_hogar
+
+# 0 desactiva la vista previa
+FRACCION = float(environ.get('PREVIEW_FRACTION', '0.03'))
+SEMILLA = 20200316
+ESTRATOS = ('cat_dom', 'CLASE_per')
+
+
+def estratos(datos):
+    """Estrato de cada persona (combinacion de ``ESTRATOS``)."""
+    estrato = np.zeros(len(datos[ESTRATOS[0]]), dtype=np.int64)
+    for columna in ESTRATOS:
+        codigos, grupo = codificar(datos[columna])
+        estrato = estrato * len(codigos) + grupo
+    return estrato
+
+
+def seleccionar(hogar, estrato, ingreso, fraccion, semilla=SEMILLA):
+    """Mascara de los hogares elegidos (al menos uno por estrato)."""
+    primera = np.unique(hogar, return_index=True)[1]
+    estrato, ingreso = estrato[primera], ingreso[primera]
+    # hogares ordenados por estrato y, dentro del estrato, por ingreso
+    orden = np.lexsort((ingreso, estrato))
+    rng = np.random.default_rng(semilla)
+    elegidos = np.zeros(len(primera), dtype=bool)
+    inicio = 0
+    for n in np.bincount(estrato):
+        if n:
+            k = max(1, int(round(fraccion * n)))
+            paso = n / k
+            posiciones = (rng.uniform(0, paso) +
+                          paso * np.arange(k)).astype(np.int64)
+            elegidos[orden[inicio + np.minimum(posiciones, n - 1)]] = True
+        inicio += n
+    return elegidos
+
+
+def submuestra(datos, fraccion=FRACCION, semilla=SEMILLA):
+    """``datos.Datos`` de los hogares elegidos, con pesos calibrados."""
+    hogar, _ = codigos_hogar(datos)
+    estrato = estratos(datos)
+    pesos = np.asarray(datos['fac_exp_ind_12m'], dtype=np.float64)
+    elegidos = seleccionar(
+        hogar, estrato,
+        np.asarray(datos['ING_pc_bl_def_arriendo'], dtype=np.float64),
+        fraccion, semilla)
+    personas = np.flatnonzero(elegidos[hogar])
+
+    # posestratificacion: poblacion de cada estrato igual a la de la
+    # encuesta completa
+    total = np.bincount(estrato, weights=pesos)
+    parcial = np.bincount(estrato[personas], weights=pesos[personas],
+                          minlength=len(total))
+    factor = np.divide(total, parcial, out=np.ones_like(total),
+                       where=parcial > 0)
+
+    columnas = {col: np.asarray(valores)[personas]
+                for col, valores in datos.items()}
+    columnas['fac_exp_ind_12m'] = (
+        pesos[personas] * factor[estrato[personas]]).astype(
+            np.asarray(datos['fac_exp_ind_12m']).dtype)
+    # la firma depende de la encuesta completa (que fija la grilla de la
+    # densidad) y de la seleccion
+    firma = hashlib.sha1('{}-{}-{}'.format(datos.firma, fraccion,
+                                           semilla).encode('utf-8'))
+    return Datos(columnas, firma=firma.hexdigest())
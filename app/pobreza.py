@@ -0,0 +1,128 @@
+"""Indicadores de pobreza monetaria con lineas por persona.
+
+Las lineas de pobreza de cada persona dependen solo de CLASE_per y
+AREA_per, asi que se calculan una vez. Un ingreso se evalua con
+comparaciones vectorizadas y un ``bincount`` por indicador sobre el codigo
+de ``cat_dom``; la entrada nunca se modifica.
+
+``IndicadoresPobreza.sumas`` devuelve sumas ponderadas por dominio (una
+fila por indicador) que se pueden sumar y restar, como los agregados del
+modo delta; ``IndicadoresPobreza.resultados`` las convierte en tasas.
+"""
+import numpy as np
+
+# lineas de pobreza (ingreso per capita mensual)
+L_CIUDAD = 294897.29
+L_CABECERA = 294285.32
+L_RESTO = 175783.22
+
+# linea de vulnerabilidad (la misma de generate_reference_lines)
+L_VULNERABILIDAD = 401208.0
+
+# filas de IndicadoresPobreza.sumas
+POBRES = 0
+VULNERABLES = 1
+BRECHA = 2
+SEVERIDAD = 3
+TOTAL = 4
+INDICADORES = ('pobreza', 'vulnerabilidad', 'brecha', 'severidad')
+
+
+def lineas_por_persona(clase, area, ciudad, cabecera, resto):
+    """Linea de cada persona segun dominio (-inf donde ninguna regla aplica).
+
+    Mismo orden de precedencia que el calculo original: resto, cabecera y
+    finalmente las 13 ciudades (AREA_per != 12344).
+    """
+    clase = np.asarray(clase)
+    area = np.asarray(area)
+    lineas = np.full(len(clase), -np.inf)
+    lineas[(clase == 2) & (area == 12344)] = resto
+    lineas[(clase == 1) & (area == 12344)] = cabecera
+    lineas[area != 12344] = ciudad
+    return lineas
+
+
+def lineas_pobreza(clase, area):
+    return lineas_por_persona(clase, area, L_CIUDAD, L_CABECERA, L_RESTO)
+
+
+def resultados_pobreza(sumas, dominios):
+    """Tasas (%) totales y por dominio a partir de ``sumas`` (ver
+    ``IndicadoresPobreza.sumas``), con una columna por dominio."""
+    totales = sumas.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tasas = 100 * sumas[:TOTAL] / sumas[TOTAL]
+        tasas_total = 100 * totales[:TOTAL] / totales[TOTAL]
+    resultados = dict(zip(INDICADORES, tasas_total.tolist()))
+    resultados['por_dominio'] = {
+        int(dominio): dict(zip(INDICADORES, tasas[:, i].tolist()))
+        for i, dominio in enumerate(dominios)}
+    return resultados
+
+
+class IndicadoresPobreza:
+    """Pobreza, vulnerabilidad y FGT1/FGT2 por cat_dom.
+
+    Las personas sin ``cat_dom`` (negativo o NaN) no entran al calculo, como
+    en el ``crosstab`` original.
+    """
+
+    ESTADO = ('lineas', 'dominios', 'grupo', 'peso')
+
+    def __init__(self, clase, area, cat_dom, pesos):
+        self.lineas = lineas_pobreza(clase, area)
+
+        cat_dom = np.asarray(cat_dom, dtype=np.float64)
+        valido = np.isfinite(cat_dom) & (cat_dom >= 0)
+        self.dominios, grupo = np.unique(cat_dom[valido], return_inverse=True)
+        self.dominios = self.dominios.astype(np.int64)
+        self.grupo = np.zeros(len(cat_dom), dtype=np.int64)
+        self.grupo[valido] = grupo
+        # peso en el calculo (0 para quienes no tienen dominio)
+        self.peso = np.where(valido, np.asarray(pesos, dtype=np.float64), 0)
+
+    def estado(self):
+        return {nombre: getattr(self, nombre) for nombre in self.ESTADO}
+
+    @classmethod
+    def desde_estado(cls, estado):
+        indicadores = cls.__new__(cls)
+        for nombre in cls.ESTADO:
+            setattr(indicadores, nombre, estado[nombre])
+        return indicadores
+
+    def sumas(self, ingreso, personas=None):
+        """Sumas ponderadas por dominio: arreglo (5, dominios).
+
+        ``personas`` restringe el calculo a esas posiciones (``ingreso``
+        tiene entonces una entrada por persona de la lista).
+        """
+        z, grupo, peso = self.lineas, self.grupo, self.peso
+        if personas is not None:
+            z = z[personas]
+            grupo, peso = grupo[personas], peso[personas]
+
+        y = np.asarray(ingreso, dtype=np.float64)
+        pobre = y < z
+        with np.errstate(invalid='ignore', divide='ignore'):
+            brecha = np.where(pobre, (z - y) / z, 0)
+        valores = (pobre,
+                   (y >= z) & (y < L_VULNERABILIDAD),
+                   brecha,
+                   brecha * brecha,
+                   1)
+        n = len(self.dominios)
+        return np.stack([np.bincount(grupo, weights=peso * v, minlength=n)
+                         for v in valores])
+
+    def resultados(self, sumas):
+        """Tasas (%) totales y por dominio a partir de ``sumas``."""
+        return resultados_pobreza(sumas, self.dominios)
+
+    def calcular(self, ingreso):
+        return self.resultados(self.sumas(ingreso))
+
+    def tasa(self, sumas):
+        """Solo el indice de pobreza (%)."""
+        return 100 * sumas[POBRES].sum() / sumas[TOTAL].sum()
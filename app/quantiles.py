@@ -0,0 +1,115 @@
+"""Cuantiles con pesos sobre arreglos de NumPy, sin modificar la entrada.
+
+Todos los cuantiles se obtienen de un solo ordenamiento (O(n log n)), que
+puede reutilizarse entre llamadas, o de un histograma con pesos (O(n)).
+La definicion coincide con la de ``functions.weighted_median``: el
+cuantil q es el primer valor cuyo peso acumulado alcanza q veces el total.
+"""
+import numpy as np
+
+DECILES = np.arange(1, 10) / 10
+
+
+def sort_order(x, orden_base=None):
+    """Indices que ordenan ``x``.
+
+    Si se pasa el orden de una distribucion parecida (p. ej. la original
+    antes del choque) se usa como punto de partida: el ordenamiento estable
+    sobre datos casi ordenados es practicamente lineal.
+    """
+    x = np.asarray(x)
+    if orden_base is None:
+        return np.argsort(x, kind='stable')
+    return orden_base[np.argsort(x[orden_base], kind='stable')]
+
+
+def _acumulados(x, weights, orden):
+    x = np.asarray(x, dtype=np.float64)
+    if orden is None:
+        orden = sort_order(x)
+    x_ord = x[orden]
+    peso_acum = np.cumsum(np.asarray(weights, dtype=np.float64)[orden])
+    return x_ord, peso_acum
+
+
+def weighted_quantiles(x, weights, qs, orden=None):
+    """Cuantiles ``qs`` de ``x`` con pesos ``weights``.
+
+    ``orden`` es opcional: los indices que ordenan ``x`` (ver
+    ``sort_order``), para no volver a ordenar.
+    """
+    x_ord, peso_acum = _acumulados(x, weights, orden)
+    return _cuantiles(x_ord, peso_acum, qs)
+
+
+def _cuantiles(x_ord, peso_acum, qs):
+    corte = np.asarray(qs, dtype=np.float64) * peso_acum[-1]
+    idx = np.searchsorted(peso_acum, corte, side='left')
+    return x_ord[np.minimum(idx, len(x_ord) - 1)]
+
+
+def weighted_quantiles_hist(x, weights, qs, edges):
+    """Cuantiles aproximados en O(n) a partir de un histograma con pesos.
+
+    Dentro de cada intervalo de ``edges`` se interpola linealmente, por lo
+    que el error es a lo sumo el ancho del intervalo.
+    """
+    conteos = weighted_histogram(x, weights, edges)
+    return quantiles_from_histogram(conteos, edges, qs)
+
+
+def weighted_histogram(x, weights, edges):
+    """Pesos por intervalo; los valores por fuera van al primero/ultimo."""
+    idx = np.clip(np.searchsorted(edges, x, side='right') - 1,
+                  0, len(edges) - 2)
+    return np.bincount(idx, weights=weights, minlength=len(edges) - 1)
+
+
+def quantiles_from_histogram(conteos, edges, qs):
+    acumulado = np.concatenate([[0], np.cumsum(conteos)])
+    return np.interp(np.asarray(qs) * acumulado[-1], acumulado, edges)
+
+
+def income_shares(x_ord, peso_acum, pesos_ord, ps):
+    """Participacion en el ingreso total del ``p`` mas pobre, para cada p."""
+    ingreso_acum = np.concatenate([[0], np.cumsum(x_ord * pesos_ord)])
+    poblacion = np.concatenate([[0], peso_acum]) / peso_acum[-1]
+    return np.interp(ps, poblacion, ingreso_acum) / ingreso_acum[-1]
+
+
+def distribution_summary(x, weights, orden=None):
+    """Mediana, deciles, P90/P10, razon de Palma y participacion del 1%."""
+    x = np.asarray(x, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if orden is None:
+        orden = sort_order(x)
+    x_ord, peso_acum = _acumulados(x, weights, orden)
+
+    deciles = _cuantiles(x_ord, peso_acum, DECILES)
+    q40, q90, q99 = income_shares(x_ord, peso_acum, weights[orden],
+                                  [0.4, 0.9, 0.99])
+    return _resumen(deciles, q40, q90, q99)
+
+
+def summary_from_histogram(conteos, sumas, edges):
+    """``distribution_summary`` a partir de un histograma con pesos.
+
+    ``conteos`` son los pesos y ``sumas`` el ingreso (peso * ingreso) de
+    cada intervalo de ``edges``. Los cuantiles tienen un error de a lo sumo
+    el ancho del intervalo.
+    """
+    deciles = quantiles_from_histogram(conteos, edges, DECILES)
+    poblacion = np.concatenate([[0], np.cumsum(conteos)])
+    ingreso = np.concatenate([[0], np.cumsum(sumas)])
+    q40, q90, q99 = np.interp([0.4, 0.9, 0.99], poblacion / poblacion[-1],
+                              ingreso / ingreso[-1])
+    return _resumen(deciles, q40, q90, q99)
+
+
+def _resumen(deciles, q40, q90, q99):
+    p10 = deciles[0]
+    return {'mediana': deciles[4],
+            'deciles': deciles,
+            'p90_p10': deciles[8] / p10 if p10 > 0 else np.nan,
+            'palma': (1 - q90) / q40,
+            'top1': 1 - q99}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# los modulos de la aplicacion son planos, en app/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
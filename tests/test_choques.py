@@ -0,0 +1,58 @@
+import numpy as np
+
+from choques import TablaChoques
+from indice import IndiceRiesgo
+from modelo import SIN_CHOQUE, normalizar_escenario
+
+# sector, tipo_empresa, informales, cuenta_propia de cada persona
+PERSONAS = np.array([[8, 1, 1, 0],   # hotel, pequena, informal
+                     [8, 3, 0, 0],   # hotel, grande, formal
+                     [4, 2, 1, 0],   # manufactura, mediana, informal
+                     [4, 4, 0, 1],   # manufactura, gigante, formal
+                     [7, 1, 1, 0],   # comercio: ninguna fila le aplica
+                     [-1, -1, -1, -1]])  # sin empleo
+DATOS = {nombre: PERSONAS[:, i] for i, nombre in
+         enumerate(['sector', 'tipo_empresa', 'informales',
+                    'cuenta_propia'])}
+
+
+def riesgo_y_choque(escenario):
+    indice = IndiceRiesgo(DATOS, np.arange(len(PERSONAS)))
+    personas = indice.personas(escenario)
+    return personas, TablaChoques(DATOS).por_persona(escenario, personas)
+
+
+def test_filas_con_distintos_tamanos_de_empresa():
+    # hoteles -80% en cualquier tamano y manufactura -20% en medianas y
+    # gigantes, sin seleccion general de empresa
+    escenario = normalizar_escenario(
+        [8, 4], None, [1], [], 0,
+        [{'sector': 8, 'empresa': 'todos', 'formalidad': 'todos',
+          'choque': 80},
+         {'sector': 4, 'empresa': 2, 'formalidad': 'todos', 'choque': 20},
+         {'sector': 4, 'empresa': 4, 'formalidad': 'todos', 'choque': 20}])
+    assert escenario != SIN_CHOQUE
+    personas, choque = riesgo_y_choque(escenario)
+    assert personas.tolist() == [0, 1, 2, 3]
+    assert choque.tolist() == [80, 80, 20, 20]
+
+
+def test_tabla_y_seleccion_general():
+    # la seleccion general (informales pequenos de hoteles y comercio) se
+    # suma a las celdas de la tabla; la ultima fila que aplica cuenta
+    escenario = normalizar_escenario(
+        [7, 8], 1, [1], [], 10,
+        [(4, 2, None, 20), (8, None, None, 50)])
+    personas, choque = riesgo_y_choque(escenario)
+    assert personas.tolist() == [0, 1, 2, 4]
+    assert choque.tolist() == [50, 50, 20, 10]
+
+
+def test_sin_choque():
+    assert normalizar_escenario([8], None, [1], [], 30) == SIN_CHOQUE
+    assert normalizar_escenario(
+        [8], 1, [1], [], 0, [(8, None, None, 0)]) == SIN_CHOQUE
+    # sin choque general solo cuentan las filas de la tabla
+    assert normalizar_escenario(
+        [8], 1, [1], [], 0, [(4, None, None, 30)]) == normalizar_escenario(
+        None, None, None, None, 0, [(4, None, None, 30)])
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from cache import ScenarioCache
+from jobs import JobsSaturados, ScenarioJobs
+
+
+class Modelo:
+
+    def evaluar_previa(self, escenario):
+        return {'previa': escenario}
+
+    def evaluar(self, escenario):
+        time.sleep(1)
+        return {'escenario': escenario}
+
+    def replicas(self, escenario, inicio, fin):
+        time.sleep(1)
+        return {'replicas': (inicio, fin)}
+
+    def descripcion(self, escenario):
+        return {'descripcion': True}
+
+
+class Conjuntos:
+
+    def modelo(self, conjunto):
+        return Modelo()
+
+
+def aplicar(jobs, sesion):
+    """Lo que envia "Aplicar" con intervalos (ver app.enviar_trabajo)."""
+    jobs.submit(sesion, sesion + '-previa', sesion, 'evaluar_previa',
+                limitar=False)
+    jobs.submit(sesion, sesion + '-exacto', sesion, 'evaluar',
+                grupo=sesion)
+    for inicio, fin in ((0, 50), (50, 100)):
+        jobs.submit('{}-replicas-{}-{}'.format(sesion, inicio, fin),
+                    '{}-replicas-{}'.format(sesion, inicio), sesion,
+                    'replicas', argumentos=(inicio, fin),
+                    grupo=sesion)
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    jobs = ScenarioJobs(Conjuntos(), ScenarioCache(str(tmp_path / 'c.db')),
+                        procesos=2, max_pendientes=4)
+    yield jobs
+    jobs.shutdown()
+
+
+def test_dos_sesiones_con_intervalos(jobs):
+    aplicar(jobs, 'a')
+    aplicar(jobs, 'b')
+    # todavia cabe la carga de un conjunto de datos
+    jobs.submit('conjunto-otro', 'conjunto', None, 'descripcion')
+
+
+def test_limite_de_la_cola(jobs):
+    for sesion in 'abcd':
+        aplicar(jobs, sesion)
+    with pytest.raises(JobsSaturados):
+        aplicar(jobs, 'e')
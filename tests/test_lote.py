@@ -0,0 +1,25 @@
+from lote import COLUMNAS, SalidaParquet
+
+
+def fila(id):
+    valores = dict.fromkeys(COLUMNAS, 0.0)
+    valores.update(id=id, escenario='{}', error='')
+    return valores
+
+
+def test_parquet_vuelca_por_tiempo_sin_cerrar(tmp_path):
+    salida = SalidaParquet(str(tmp_path / 'r.parquet'), intervalo=0)
+    salida.escribir(fila('a'))
+    salida.escribir(fila('b'))
+    # sin cerrar (p. ej. el proceso recibe SIGKILL)
+    reanudada = SalidaParquet(str(tmp_path / 'r.parquet'))
+    assert reanudada.terminados() == {'a', 'b'}
+
+
+def test_parquet_agrupa_filas_dentro_del_intervalo(tmp_path):
+    salida = SalidaParquet(str(tmp_path / 'r.parquet'), intervalo=60)
+    for id in 'abc':
+        salida.escribir(fila(id))
+    assert salida.terminados() == set()
+    salida.cerrar()
+    assert salida.terminados() == {'a', 'b', 'c'}
@@ -0,0 +1,36 @@
+from cache import ScenarioCache
+from metricas import Registro
+
+
+def registro(solicitudes, rss):
+    r = Registro()
+    r.contar('solicitudes_total', solicitudes)
+    r.observar('solicitud_seconds', 0.2)
+    r.fijar('rss_bytes', rss)
+    return r.estado()
+
+
+def test_combinar_suma_contadores_y_separa_gauges():
+    total = Registro.combinar([(10, registro(2, 100)), (11, registro(3, 50))],
+                              vivos={10, 11}).texto()
+    assert 'inequality_app_solicitudes_total 5' in total
+    assert 'inequality_app_solicitud_seconds_count 2' in total
+    assert 'inequality_app_rss_bytes{pid="10"} 100' in total
+    assert 'inequality_app_rss_bytes{pid="11"} 50' in total
+
+
+def test_workers_terminados_conservan_sus_contadores(tmp_path):
+    cache = ScenarioCache(str(tmp_path / 'cache.sqlite'))
+    cache.publicar_metricas('10-a', 10, registro(2, 100))
+    cache.publicar_metricas('11-b', 11, registro(3, 50))
+
+    def combinar(estados):
+        return Registro.combinar([(0, e) for e in estados]).estado()
+
+    for _ in range(2):
+        # el worker 10 termino; leer dos veces no lo cuenta dos veces
+        estados = cache.leer_metricas(lambda pid: pid != 10, combinar)
+        total = Registro.combinar(estados, vivos={11}).texto()
+        assert 'inequality_app_solicitudes_total 5' in total
+        assert 'pid="10"' not in total
+        assert 'inequality_app_rss_bytes{pid="11"} 50' in total